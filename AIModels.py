@@ -1,6 +1,7 @@
 import ModelInterfaces
 import torch
 import numpy as np
+import queue
 
 
 class NeuralASR(ModelInterfaces.IASRModel):
@@ -27,13 +28,48 @@ class NeuralASR(ModelInterfaces.IASRModel):
 
     def processAudio(self, audio: torch.Tensor):
         """Process the audio"""
+        result = self.transcribeAudio(audio)
+        self.audio_transcript = result.transcript
+        self.word_locations_in_samples = list(result.word_locations)
+
+    def transcribeAudio(self, audio: torch.Tensor) -> ModelInterfaces.ASRResult:
         audio_length_in_samples = audio.shape[1]
         with torch.inference_mode():
             nn_output = self.model(audio)
 
-            self.audio_transcript, self.word_locations_in_samples = self.decoder(
+            audio_transcript, word_locations_in_samples = self.decoder(
                 nn_output[0, :, :].detach(), audio_length_in_samples, word_align=True)
 
+        return ModelInterfaces.ASRResult(audio_transcript, tuple(word_locations_in_samples), nn_output[0, :, :].numpy())
+
+
+class ASRModelPool(ModelInterfaces.IASRModel):
+    """Serves transcriptions from a pool of model replicas, one request per replica at a time"""
+    last_result = None
+
+    def __init__(self, replicas: list) -> None:
+        super().__init__()
+        self.number_of_replicas = len(replicas)
+        self.available_replicas = queue.Queue()
+        for replica in replicas:
+            self.available_replicas.put(replica)
+
+    def transcribeAudio(self, audio) -> ModelInterfaces.ASRResult:
+        replica = self.available_replicas.get()
+        try:
+            return replica.transcribeAudio(audio)
+        finally:
+            self.available_replicas.put(replica)
+
+    def processAudio(self, audio):
+        self.last_result = self.transcribeAudio(audio)
+
+    def getTranscript(self) -> str:
+        return self.last_result.transcript
+
+    def getWordLocations(self) -> list:
+        return list(self.last_result.word_locations)
+
 
 class NeuralTTS(ModelInterfaces.ITextToSpeechModel):
     def __init__(self, model: torch.nn.Module, sampling_rate: int) -> None:
@@ -1,6 +1,16 @@
 
 import abc
 import numpy as np
+from dataclasses import dataclass
+from typing import Optional
+
+
+@dataclass(frozen=True)
+class ASRResult:
+    """Immutable result of transcribing one recording"""
+    transcript: str
+    word_locations: tuple  # dicts with 'word', 'start_ts' and 'end_ts' in samples
+    logits: Optional[np.ndarray] = None
 
 
 class IASRModel(metaclass=abc.ABCMeta):
@@ -28,6 +38,15 @@ class IASRModel(metaclass=abc.ABCMeta):
         """Process the audio"""
         raise NotImplementedError
 
+    def transcribeAudio(self, audio) -> ASRResult:
+        """Transcribe the audio and return the result without keeping it in the model.
+
+        Models that can serve concurrent requests override this. The default goes
+        through processAudio and the getters, so it is not thread-safe.
+        """
+        self.processAudio(audio)
+        return ASRResult(self.getTranscript(), tuple(self.getWordLocations()))
+
 
 class ITranslationModel(metaclass=abc.ABCMeta):
     @classmethod
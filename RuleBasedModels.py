@@ -3,9 +3,21 @@ import torch
 import numpy as np
 import epitran
 import eng_to_ipa
+import atexit
+import json
+import os
+import threading
+import utilsFileIO
+from collections import OrderedDict
 
+lexicon_folder = './databases/'
 
-def get_phonem_converter(language: str):
+
+def get_lexicon_path(language: str) -> str:
+    return lexicon_folder+'ipa_lexicon_'+language+'.bin'
+
+
+def get_base_phonem_converter(language: str):
     if language == 'de':
         phonem_converter = EpitranPhonemConverter(
             epitran.Epitran('deu-Latn'))
@@ -16,6 +28,20 @@ def get_phonem_converter(language: str):
 
     return phonem_converter
 
+
+def get_phonem_converter(language: str, cache_size: int = 50000, cache_path: str = None, lexicon_path: str = None):
+    phonem_converter = CachedPhonemConverter(
+        get_base_phonem_converter(language), cache_size, cache_path)
+
+    # The precomputed lexicon is optional, it is built with buildDatabases.py
+    if lexicon_path is None:
+        lexicon_path = get_lexicon_path(language)
+    if os.path.exists(lexicon_path):
+        phonem_converter = LexiconPhonemConverter(
+            IpaLexicon(lexicon_path), phonem_converter)
+
+    return phonem_converter
+
 class EpitranPhonemConverter(ModelInterfaces.ITextToPhonemModel):
     word_locations_in_samples = None
     audio_transcript = None
@@ -38,3 +64,140 @@ class EngPhonemConverter(ModelInterfaces.ITextToPhonemModel):
         phonem_representation = eng_to_ipa.convert(sentence)
         phonem_representation = phonem_representation.replace('*','')
         return phonem_representation
+
+
+class CachedPhonemConverter(ModelInterfaces.ITextToPhonemModel):
+    """Word-level memoizing wrapper around another phonem converter.
+
+    Sentences are converted word by word and every word goes through a bounded,
+    thread-safe LRU cache. If cache_path is given, the cache is loaded from that
+    JSON file at start and written back by save() and at interpreter exit.
+    """
+
+    def __init__(self, phonem_converter: ModelInterfaces.ITextToPhonemModel, max_size: int = 50000, cache_path: str = None) -> None:
+        super().__init__()
+        self.phonem_converter = phonem_converter
+        self.max_size = max_size
+        self.cache_path = cache_path
+        self.hits = 0
+        self.misses = 0
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+
+        if cache_path is not None:
+            if os.path.exists(cache_path):
+                self.load(cache_path)
+            atexit.register(self.save)
+
+    def convertToPhonem(self, sentence: str) -> str:
+        return ' '.join([self.convertWordToPhonem(word) for word in sentence.split()])
+
+    def convertWordToPhonem(self, word: str) -> str:
+        with self._lock:
+            phonem_representation = self._cache.get(word)
+            if phonem_representation is not None:
+                self._cache.move_to_end(word)
+                self.hits += 1
+                return phonem_representation
+            self.misses += 1
+
+        # Conversion runs outside the lock, two threads may convert the same word
+        phonem_representation = self.phonem_converter.convertToPhonem(word)
+
+        with self._lock:
+            self._cache[word] = phonem_representation
+            self._cache.move_to_end(word)
+            while len(self._cache) > self.max_size:
+                self._cache.popitem(last=False)
+        return phonem_representation
+
+    def getCacheInfo(self) -> dict:
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses,
+                    'size': len(self._cache), 'max_size': self.max_size}
+
+    def clear(self):
+        with self._lock:
+            self._cache.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def load(self, cache_path: str):
+        with open(cache_path, 'r', encoding='utf-8') as f:
+            cached_words = json.load(f)
+        with self._lock:
+            for word, phonem_representation in cached_words.items():
+                self._cache[word] = phonem_representation
+            while len(self._cache) > self.max_size:
+                self._cache.popitem(last=False)
+
+    def save(self, cache_path: str = None):
+        cache_path = cache_path or self.cache_path
+        if cache_path is None:
+            raise ValueError('No path to save the phonem cache to')
+        with self._lock:
+            cached_words = dict(self._cache)
+        # Written to a temporary file first so a crash never leaves a truncated cache
+        utilsFileIO.replaceFile(cache_path, [json.dumps(
+            cached_words, ensure_ascii=False).encode('utf-8')])
+
+
+class IpaLexicon():
+    """Sorted text to IPA table, memory-mapped from a packed string file.
+
+    The file holds all keys in sorted order followed by their IPA in the same
+    order, so a lookup is a binary search that only decodes the visited keys.
+    """
+
+    def __init__(self, file_path: str) -> None:
+        self.entries = utilsFileIO.PackedStrings(file_path)
+        self.number_of_entries = len(self.entries)//2
+
+    def get(self, text: str) -> str:
+        low, high = 0, self.number_of_entries
+        while low < high:
+            middle = (low+high)//2
+            key = self.entries[middle]
+            if key < text:
+                low = middle+1
+            elif key > text:
+                high = middle
+            else:
+                return self.entries[self.number_of_entries+middle]
+        return None
+
+    def __len__(self):
+        return self.number_of_entries
+
+    @staticmethod
+    def write(file_path: str, ipa_of_text: dict):
+        keys = sorted(ipa_of_text)
+        utilsFileIO.writePackedStrings(
+            file_path, keys + [ipa_of_text[key] for key in keys])
+
+
+class LexiconPhonemConverter(ModelInterfaces.ITextToPhonemModel):
+    """Looks sentences and words up in a precomputed IpaLexicon.
+
+    Whole sentences found in the lexicon are returned as stored. Otherwise the
+    text is converted word by word, and only words missing from the lexicon go
+    to the live phonem converter.
+    """
+
+    def __init__(self, lexicon: IpaLexicon, phonem_converter: ModelInterfaces.ITextToPhonemModel) -> None:
+        super().__init__()
+        self.lexicon = lexicon
+        self.phonem_converter = phonem_converter
+
+    def convertToPhonem(self, sentence: str) -> str:
+        phonem_representation = self.lexicon.get(sentence)
+        if phonem_representation is not None:
+            return phonem_representation
+
+        phonem_words = []
+        for word in sentence.split():
+            phonem_word = self.lexicon.get(word)
+            if phonem_word is None:
+                phonem_word = self.phonem_converter.convertToPhonem(word)
+            phonem_words.append(phonem_word)
+        return ' '.join(phonem_words)
@@ -1,85 +1,134 @@
 import WordMetrics
 import numpy as np
 from string import punctuation
-from dtwalign import dtw_from_distance_matrix
-import time
 from typing import List, Tuple
-#from ortools.sat.python import cp_model
 
 offset_blank = 1
-TIME_THRESHOLD_MAPPING = 5.0
+# Numbers of word pairs for which the vectorized distance matrix is faster than
+# one_vs_many rows: below, numpy's per-call overhead dominates, above, the
+# (estimated, real, letters) arrays no longer fit in cache
+vectorized_min_pairs = 256
+vectorized_max_pairs = 5000
+# Sentence length from which the batched letter aligner is faster than one DP per word
+batched_letters_min_words = 32
+
+
+def encode_words(words: list, symbol_codes: dict, padding_code: int) -> Tuple[np.ndarray, np.ndarray]:
+    """Integer-encodes a list of words into a padded (len(words), max_length) int32 array"""
+    max_length = max([len(word) for word in words], default=0)
+    word_codes = np.full((len(words), max_length), padding_code, dtype=np.int32)
+    word_lengths = np.zeros(len(words), dtype=np.int32)
+    for idx_word, word in enumerate(words):
+        word_codes[idx_word, :len(word)] = [symbol_codes.setdefault(
+            symbol, len(symbol_codes)) for symbol in word]
+        word_lengths[idx_word] = len(word)
+    return word_codes, word_lengths
 
 
 def get_word_distance_matrix(words_estimated: list, words_real: list) -> np.ndarray:
+    """Edit distance between every estimated and real word, plus the blank row.
+
+    Row len(words_estimated) holds the cost of a real word having no match.
+    Mid-sized sentences use the vectorized all-pairs DP, short and very long
+    ones a one_vs_many row per estimated word, which is faster there.
+    """
+    number_of_pairs = len(words_estimated)*len(words_real)
+    if vectorized_min_pairs <= number_of_pairs <= vectorized_max_pairs:
+        word_distance_matrix = get_word_distance_matrix_vectorized(
+            words_estimated, words_real)
+    else:
+        word_distance_matrix = np.zeros(
+            (len(words_estimated)+offset_blank, len(words_real)), dtype=np.int32)
+        for idx_estimated, word_estimated in enumerate(words_estimated):
+            word_distance_matrix[idx_estimated] = WordMetrics.one_vs_many(
+                word_estimated, words_real)
+
+    if offset_blank == 1:
+        word_distance_matrix[len(words_estimated)] = [
+            len(word) for word in words_real]
+    return word_distance_matrix
+
+
+def get_word_distance_matrix_vectorized(words_estimated: list, words_real: list) -> np.ndarray:
+    """Runs the Levenshtein DP for all word pairs at the same time, one row of
+    the DP per letter of the integer-encoded estimated words"""
     number_of_real_words = len(words_real)
     number_of_estimated_words = len(words_estimated)
 
-    word_distance_matrix = np.zeros(
-        (number_of_estimated_words+offset_blank, number_of_real_words))
-    for idx_estimated in range(number_of_estimated_words):
-        for idx_real in range(number_of_real_words):
-            word_distance_matrix[idx_estimated, idx_real] = WordMetrics.edit_distance_python(
-                words_estimated[idx_estimated], words_real[idx_real])
+    symbol_codes = {}
+    # Different paddings so that padded positions never count as a match
+    estimated_codes, estimated_lengths = encode_words(
+        words_estimated, symbol_codes, -1)
+    real_codes, real_lengths = encode_words(words_real, symbol_codes, -2)
+
+    real_positions = np.arange(real_codes.shape[1]+1, dtype=np.int32)
+    previous_row = np.broadcast_to(real_positions, (number_of_estimated_words,
+                                                    number_of_real_words, len(real_positions)))
+    last_rows = np.array(previous_row)
+    for idx_letter in range(estimated_codes.shape[1]):
+        substitution_cost = (estimated_codes[:, None, idx_letter, None]
+                             != real_codes[None, :, :]).astype(np.int32)
+        current_row = np.empty_like(last_rows)
+        current_row[:, :, 0] = idx_letter+1
+        np.minimum(previous_row[:, :, 1:]+1, previous_row[:, :, :-1] +
+                   substitution_cost, out=current_row[:, :, 1:])
+        # Insertions chain along the row: D[j] = min_k(D'[k] + j - k)
+        current_row = np.minimum.accumulate(
+            current_row-real_positions, axis=2)+real_positions
+        words_ending_here = estimated_lengths == idx_letter+1
+        last_rows[words_ending_here] = current_row[words_ending_here]
+        previous_row = current_row
 
-    if offset_blank == 1:
-        for idx_real in range(number_of_real_words):
-            word_distance_matrix[number_of_estimated_words,
-                                 idx_real] = len(words_real[idx_real])
+    word_distance_matrix = np.zeros(
+        (number_of_estimated_words+offset_blank, number_of_real_words), dtype=np.int32)
+    word_distance_matrix[:number_of_estimated_words] = last_rows[:, np.arange(
+        number_of_real_words), real_lengths]
     return word_distance_matrix
 
 
-def get_best_path_from_distance_matrix(word_distance_matrix):
-    modelCpp = cp_model.CpModel()
+def get_best_path_from_distance_matrix(word_distance_matrix: np.ndarray, deletion_cost: float = 0.) -> np.ndarray:
+    """Optimal monotonic one-to-one mapping between estimated and real words.
 
+    Matching estimated word i with real word j costs word_distance_matrix[i, j],
+    leaving real word j without a match costs its blank row entry and skipping an
+    extra estimated word costs deletion_cost. Solved exactly by dynamic
+    programming in O(n*m). Returns, for every estimated word, the index of the
+    real word it is mapped to, or -1 if it is not mapped.
+    """
+    number_of_estimated_words = word_distance_matrix.shape[0]-offset_blank
     number_of_real_words = word_distance_matrix.shape[1]
-    number_of_estimated_words = word_distance_matrix.shape[0]-1
-
-    number_words = np.maximum(number_of_real_words, number_of_estimated_words)
-
-    estimated_words_order = [modelCpp.NewIntVar(0, int(
-        number_words - 1 + offset_blank), 'w%i' % i) for i in range(number_words+offset_blank)]
-
-    # They are in ascending order
-    for word_idx in range(number_words-1):
-        modelCpp.Add(
-            estimated_words_order[word_idx+1] >= estimated_words_order[word_idx])
-
-    total_phoneme_distance = 0
-    real_word_at_time = {}
-    for idx_estimated in range(number_of_estimated_words):
-        for idx_real in range(number_of_real_words):
-            real_word_at_time[idx_estimated, idx_real] = modelCpp.NewBoolVar(
-                'real_word_at_time'+str(idx_real)+'-'+str(idx_estimated))
-            modelCpp.Add(estimated_words_order[idx_estimated] == idx_real).OnlyEnforceIf(
-                real_word_at_time[idx_estimated, idx_real])
-            total_phoneme_distance += word_distance_matrix[idx_estimated,
-                                                           idx_real]*real_word_at_time[idx_estimated, idx_real]
-
-    # If no word in time, difference is calculated from empty string
-    for idx_real in range(number_of_real_words):
-        word_has_a_match = modelCpp.NewBoolVar(
-            'word_has_a_match'+str(idx_real))
-        modelCpp.Add(sum([real_word_at_time[idx_estimated, idx_real] for idx_estimated in range(
-            number_of_estimated_words)]) == 1).OnlyEnforceIf(word_has_a_match)
-        total_phoneme_distance += word_distance_matrix[number_of_estimated_words,
-                                                       idx_real]*word_has_a_match.Not()
-
-    # Loss should be minimized
-    modelCpp.Minimize(total_phoneme_distance)
-
-    solver = cp_model.CpSolver()
-    solver.parameters.max_time_in_seconds = TIME_THRESHOLD_MAPPING
-    status = solver.Solve(modelCpp)
-
-    mapped_indices = []
-    try:
-        for word_idx in range(number_words):
-            mapped_indices.append(
-                (solver.Value(estimated_words_order[word_idx])))
-
-        return np.array(mapped_indices, dtype=int)
-    except:
-        return []
+    match_costs = word_distance_matrix[:number_of_estimated_words].astype(float)
+    insertion_costs = word_distance_matrix[number_of_estimated_words].astype(float)
+
+    # accumulated_cost[i, j]: best cost of aligning the first i estimated words with the first j real words
+    accumulated_insertion_cost = np.concatenate(([0.], np.cumsum(insertion_costs)))
+    accumulated_cost = np.empty(
+        (number_of_estimated_words+1, number_of_real_words+1))
+    accumulated_cost[0] = accumulated_insertion_cost
+    for idx_estimated in range(1, number_of_estimated_words+1):
+        previous_row = accumulated_cost[idx_estimated-1]
+        current_row = accumulated_cost[idx_estimated]
+        current_row[0] = previous_row[0] + deletion_cost
+        np.minimum(previous_row[1:] + deletion_cost, previous_row[:-1] +
+                   match_costs[idx_estimated-1], out=current_row[1:])
+        # Insertions chain along the row, accumulate them as a running minimum
+        current_row[:] = np.minimum.accumulate(
+            current_row-accumulated_insertion_cost) + accumulated_insertion_cost
+
+    mapped_indices = np.full(number_of_estimated_words, -1, dtype=int)
+    idx_estimated, idx_real = number_of_estimated_words, number_of_real_words
+    while idx_estimated > 0 and idx_real > 0:
+        current_cost = accumulated_cost[idx_estimated, idx_real]
+        if abs(current_cost - accumulated_cost[idx_estimated-1, idx_real-1] - match_costs[idx_estimated-1, idx_real-1]) < 1e-9:
+            idx_estimated -= 1
+            idx_real -= 1
+            mapped_indices[idx_estimated] = idx_real
+        elif abs(current_cost - accumulated_cost[idx_estimated-1, idx_real] - deletion_cost) < 1e-9:
+            idx_estimated -= 1
+        else:
+            idx_real -= 1
+
+    return mapped_indices
 
 
 def get_resulting_string(mapped_indices: np.ndarray, words_estimated: list, words_real: list) -> Tuple[List,List]:
@@ -110,7 +159,7 @@ def get_resulting_string(mapped_indices: np.ndarray, words_estimated: list, word
                 idx_above_word = single_word_idx >= len(words_estimated)
                 if idx_above_word:
                     continue
-                error_word = WordMetrics.edit_distance_python(
+                error_word = WordMetrics.edit_distance(
                     words_estimated[single_word_idx], words_real[word_idx])
                 if error_word < error:
                     error = error_word*1
@@ -124,31 +173,12 @@ def get_resulting_string(mapped_indices: np.ndarray, words_estimated: list, word
     return mapped_words, mapped_words_indices
 
 
-def get_best_mapped_words(words_estimated: list, words_real: list,use_dtw:bool = True) -> list:
+def get_best_mapped_words(words_estimated: list, words_real: list) -> list:
 
     word_distance_matrix = get_word_distance_matrix(
         words_estimated, words_real)
 
-    start = time.time()
-    
-    if use_dtw:
-        alignment = (dtw_from_distance_matrix(
-                word_distance_matrix.T))
-            
-        mapped_indices = alignment.get_warping_path()[:len(words_estimated)]
-        duration_of_mapping = time.time()-start
-    else:
-        mapped_indices = get_best_path_from_distance_matrix(word_distance_matrix)
-
-        duration_of_mapping = time.time()-start
-        # In case or-tools doesn't converge, go to a faster, low-quality solution
-        if len(mapped_indices) == 0 or duration_of_mapping > TIME_THRESHOLD_MAPPING+0.5:
-            #mapped_indices = (dtw_from_distance_matrix(
-            #    word_distance_matrix)).path[:len(words_estimated), 1]
-            alignment = (dtw_from_distance_matrix(
-                word_distance_matrix.T))
-            
-            mapped_indices = alignment.get_warping_path()
+    mapped_indices = get_best_path_from_distance_matrix(word_distance_matrix)
 
     mapped_words, mapped_words_indices = get_resulting_string(
         mapped_indices, words_estimated, words_real)
@@ -156,32 +186,105 @@ def get_best_mapped_words(words_estimated: list, words_real: list,use_dtw:bool =
     return mapped_words, mapped_words_indices
 
 
-# Faster, but not optimal
-def get_best_mapped_words_dtw(words_estimated: list, words_real: list) -> list:
-
-    from dtwalign import dtw_from_distance_matrix
-    word_distance_matrix = get_word_distance_matrix(
-        words_estimated, words_real)
-    mapped_indices = dtw_from_distance_matrix(
-        word_distance_matrix).path[:-1, 0]
-
-    mapped_words, mapped_words_indices = get_resulting_string(
-        mapped_indices, words_estimated, words_real)
-    return mapped_words, mapped_words_indices
-
-
 def getWhichLettersWereTranscribedCorrectly(real_word, transcribed_word):
-    is_leter_correct = [None]*len(real_word)    
-    for idx, letter in enumerate(real_word):   
-        letter = letter.lower()    
-        transcribed_word[idx] = transcribed_word[idx].lower() 
-        if letter == transcribed_word[idx] or letter in punctuation:
+    is_leter_correct = [None]*len(real_word)
+    for idx, letter in enumerate(real_word):
+        letter = letter.lower()
+        transcribed_letter = transcribed_word[idx].lower() if idx < len(
+            transcribed_word) else ''
+        if letter == transcribed_letter or letter in punctuation:
             is_leter_correct[idx] = 1
         else:
             is_leter_correct[idx] = 0
     return is_leter_correct
 
 
+def get_letters_correctness(words_real: list, words_transcribed: list) -> List[List[int]]:
+    """Per-letter correctness of every real word against its transcribed word.
+
+    Every (real, transcribed) pair is aligned letter by letter with a
+    Levenshtein DP, case-insensitively. A real letter is correct (1) when it is
+    aligned to the same transcribed letter or is a punctuation sign, otherwise 0.
+    Long sentences run the DP of all words in one batch.
+    """
+    words_real = [word.lower() for word in words_real]
+    words_transcribed = [word.lower() for word in words_transcribed]
+
+    if len(words_real) >= batched_letters_min_words:
+        distance_tables = get_letter_distance_tables_batched(
+            words_real, words_transcribed)
+    else:
+        distance_tables = [get_letter_distance_table(word_real, word_transcribed)
+                           for word_real, word_transcribed in zip(words_real, words_transcribed)]
+
+    return [get_aligned_letters_correctness(word_real, word_transcribed, distance_table)
+            for word_real, word_transcribed, distance_table in zip(words_real, words_transcribed, distance_tables)]
+
+
+def get_letter_distance_table(word_real: str, word_transcribed: str) -> List[List[int]]:
+    """Levenshtein DP table of one word, (len(word_real)+1, len(word_transcribed)+1)"""
+    distance_table = [list(range(len(word_transcribed)+1))]
+    for idx_real, letter_real in enumerate(word_real, start=1):
+        previous_row = distance_table[-1]
+        current_row = [idx_real]
+        for idx_transcribed, letter_transcribed in enumerate(word_transcribed, start=1):
+            current_row.append(min(previous_row[idx_transcribed]+1, current_row[idx_transcribed-1]+1,
+                                   previous_row[idx_transcribed-1]+(letter_real != letter_transcribed)))
+        distance_table.append(current_row)
+    return distance_table
+
+
+def get_letter_distance_tables_batched(words_real: list, words_transcribed: list) -> list:
+    """DP tables of all words in one vectorized pass, one row per real letter"""
+    symbol_codes = {}
+    real_codes, real_lengths = encode_words(words_real, symbol_codes, -1)
+    transcribed_codes, transcribed_lengths = encode_words(
+        words_transcribed, symbol_codes, -2)
+
+    number_of_words = len(words_real)
+    transcribed_positions = np.arange(
+        transcribed_codes.shape[1]+1, dtype=np.int32)
+    distance_tables = np.empty(
+        (number_of_words, real_codes.shape[1]+1, len(transcribed_positions)), dtype=np.int32)
+    distance_tables[:, 0, :] = transcribed_positions
+    for idx_letter in range(1, real_codes.shape[1]+1):
+        substitution_cost = (real_codes[:, idx_letter-1, None]
+                             != transcribed_codes).astype(np.int32)
+        previous_row = distance_tables[:, idx_letter-1, :]
+        current_row = distance_tables[:, idx_letter, :]
+        current_row[:, 0] = idx_letter
+        np.minimum(previous_row[:, 1:]+1, previous_row[:, :-1] +
+                   substitution_cost, out=current_row[:, 1:])
+        current_row[:] = np.minimum.accumulate(
+            current_row-transcribed_positions, axis=1)+transcribed_positions
+
+    # Backtracking reads single cells, which is much faster on lists
+    return [distance_tables[idx_word, :real_lengths[idx_word]+1, :transcribed_lengths[idx_word]+1].tolist()
+            for idx_word in range(number_of_words)]
+
+
+def get_aligned_letters_correctness(word_real: str, word_transcribed: str, distance_table: list) -> List[int]:
+    is_letter_correct = [
+        1 if letter in punctuation else 0 for letter in word_real]
+    idx_real, idx_transcribed = len(word_real), len(word_transcribed)
+    while idx_real > 0:
+        current_distance = distance_table[idx_real][idx_transcribed]
+        if idx_transcribed > 0:
+            letters_are_equal = word_real[idx_real -
+                                          1] == word_transcribed[idx_transcribed-1]
+            if current_distance == distance_table[idx_real-1][idx_transcribed-1] + (not letters_are_equal):
+                if letters_are_equal:
+                    is_letter_correct[idx_real-1] = 1
+                idx_real -= 1
+                idx_transcribed -= 1
+                continue
+            if current_distance != distance_table[idx_real-1][idx_transcribed] + 1:
+                idx_transcribed -= 1
+                continue
+        idx_real -= 1
+    return is_letter_correct
+
+
 def parseLetterErrorsToHTML(word_real, is_leter_correct):
     word_colored = ''
     correct_color_start = '*'
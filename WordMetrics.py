@@ -52,4 +52,77 @@ def edit_distance_python(seq1, seq2):
                     matrix[x,y-1] + 1
                 )
     #print (matrix)
-    return (matrix[size_x - 1, size_y - 1])
\ No newline at end of file
+    return (matrix[size_x - 1, size_y - 1])
+
+
+# Bit-parallel Levenshtein distance (Myers 1999, global variant by Hyyrö 2003).
+# The shorter sequence is encoded as one bitmask per symbol, so each symbol of the
+# longer sequence updates a whole DP column with a handful of integer operations.
+def _pattern_bitmasks(pattern) -> dict:
+    bitmasks = {}
+    for idx, token in enumerate(pattern):
+        bitmasks[token] = bitmasks.get(token, 0) | (1 << idx)
+    return bitmasks
+
+
+def _bit_parallel_distance(bitmasks: dict, pattern_length: int, text, max_distance: int = None) -> int:
+    if pattern_length == 0:
+        return len(text)
+    all_ones = (1 << pattern_length) - 1
+    last_bit = 1 << (pattern_length - 1)
+    vertical_positive = all_ones
+    vertical_negative = 0
+    score = pattern_length
+    remaining = len(text)
+    for token in text:
+        equal = bitmasks.get(token, 0)
+        x_vertical = equal | vertical_negative
+        x_horizontal = (((equal & vertical_positive) + vertical_positive)
+                        ^ vertical_positive) | equal
+        horizontal_positive = (vertical_negative | ~(x_horizontal | vertical_positive)) & all_ones
+        horizontal_negative = vertical_positive & x_horizontal
+        if horizontal_positive & last_bit:
+            score += 1
+        elif horizontal_negative & last_bit:
+            score -= 1
+        remaining -= 1
+        # The last cell can decrease by at most one per remaining symbol
+        if max_distance is not None and score - remaining > max_distance:
+            return max_distance + 1
+        horizontal_positive = ((horizontal_positive << 1) | 1) & all_ones
+        horizontal_negative = (horizontal_negative << 1) & all_ones
+        vertical_positive = (horizontal_negative | ~(x_vertical | horizontal_positive)) & all_ones
+        vertical_negative = horizontal_positive & x_vertical
+    return score
+
+
+def edit_distance(seq1, seq2, max_distance: int = None) -> int:
+    """Levenshtein distance between two sequences of hashable tokens.
+
+    Gives the same result as edit_distance_python, which is kept as reference.
+    If max_distance is given, the computation stops as soon as the distance is
+    known to exceed it and max_distance+1 is returned instead.
+    """
+    if len(seq1) < len(seq2):
+        seq1, seq2 = seq2, seq1
+    if max_distance is not None and len(seq1) - len(seq2) > max_distance:
+        return max_distance + 1
+    return _bit_parallel_distance(_pattern_bitmasks(seq2), len(seq2), seq1, max_distance)
+
+
+def one_vs_many(word, candidates: list, max_distance: int = None) -> np.ndarray:
+    """Levenshtein distance from word to every candidate, as an int32 array.
+
+    The bitmasks of word are computed once and reused for all candidates. With
+    max_distance, distances above it are reported as max_distance+1.
+    """
+    bitmasks = _pattern_bitmasks(word)
+    word_length = len(word)
+    distances = np.empty(len(candidates), dtype=np.int32)
+    for idx, candidate in enumerate(candidates):
+        if max_distance is not None and abs(len(candidate) - word_length) > max_distance:
+            distances[idx] = max_distance + 1
+        else:
+            distances[idx] = _bit_parallel_distance(
+                bitmasks, word_length, candidate, max_distance)
+    return distances
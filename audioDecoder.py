@@ -0,0 +1,109 @@
+import io
+import shutil
+from functools import lru_cache
+import subprocess
+import numpy as np
+import soundfile as sf
+import torch
+import torchaudio
+import instrumentation
+
+try:
+    import av
+except ImportError:
+    av = None
+
+target_sampling_rate = 16000
+
+# Containers libsndfile reads directly from memory (OGG Vorbis/Opus, WAV, FLAC)
+SOUNDFILE_SIGNATURES = (b'OggS', b'RIFF', b'fLaC')
+
+
+class AudioDecodingError(ValueError):
+    pass
+
+
+def decodeAudio(file_bytes: bytes, sampling_rate: int = target_sampling_rate) -> np.ndarray:
+    """Decodes an in-memory recording into a contiguous, writable float32 mono
+    signal at sampling_rate, ready to be shared with torch.from_numpy.
+
+    OGG, WAV and FLAC are read with soundfile at their own rate and resampled
+    with a cached kernel, unless they are already at sampling_rate. Other
+    containers (e.g. the browsers' WebM) go to PyAV, if installed, and a failure
+    of those decoders to an ffmpeg subprocess through pipes. Both of these
+    output sampling_rate directly.
+    """
+    if len(file_bytes) == 0:
+        raise AudioDecodingError('Empty audio file')
+
+    decoders = []
+    if file_bytes[:4] in SOUNDFILE_SIGNATURES:
+        decoders.append(decodeWithSoundfile)
+    if av is not None:
+        decoders.append(decodeWithPyAV)
+    decoders.append(decodeWithFFmpeg)
+
+    errors = []
+    with instrumentation.span('decode'):
+        for decoder in decoders:
+            try:
+                signal, signal_sampling_rate = decoder(file_bytes, sampling_rate)
+                break
+            except Exception as e:
+                errors.append(decoder.__name__ + ': ' + str(e))
+        else:
+            raise AudioDecodingError(
+                'Could not decode audio (' + '; '.join(errors) + ')')
+
+    with instrumentation.span('resample'):
+        signal = resampleAudio(signal, signal_sampling_rate, sampling_rate)
+    return np.ascontiguousarray(signal, dtype=np.float32)
+
+
+@lru_cache(maxsize=16)
+def getResampler(original_sampling_rate: int, target_sampling_rate: int) -> torchaudio.transforms.Resample:
+    # The resampling kernel is computed once, when the transform is created
+    return torchaudio.transforms.Resample(original_sampling_rate, target_sampling_rate)
+
+
+def resampleAudio(signal: np.ndarray, original_sampling_rate: int, target_sampling_rate: int) -> np.ndarray:
+    if original_sampling_rate == target_sampling_rate:
+        return signal
+    with torch.inference_mode():
+        return getResampler(int(original_sampling_rate), int(target_sampling_rate))(
+            torch.from_numpy(np.ascontiguousarray(signal, dtype=np.float32))).numpy()
+
+
+def decodeWithSoundfile(file_bytes: bytes, sampling_rate: int):
+    signal, signal_sampling_rate = sf.read(
+        io.BytesIO(file_bytes), dtype='float32', always_2d=True)
+    if signal.shape[1] == 1:
+        return signal[:, 0], signal_sampling_rate
+    return signal.mean(axis=1), signal_sampling_rate
+
+
+def decodeWithPyAV(file_bytes: bytes, sampling_rate: int):
+    # PyAV resamples to the target rate while decoding
+    resampler = av.AudioResampler(
+        format='flt', layout='mono', rate=sampling_rate)
+    signal_chunks = []
+    with av.open(io.BytesIO(file_bytes)) as container:
+        for frame in container.decode(audio=0):
+            for resampled_frame in resampler.resample(frame):
+                signal_chunks.append(resampled_frame.to_ndarray()[0])
+        for resampled_frame in resampler.resample(None):
+            signal_chunks.append(resampled_frame.to_ndarray()[0])
+    if len(signal_chunks) == 0:
+        return np.zeros(0, dtype=np.float32), sampling_rate
+    return np.concatenate(signal_chunks), sampling_rate
+
+
+def decodeWithFFmpeg(file_bytes: bytes, sampling_rate: int):
+    if shutil.which('ffmpeg') is None:
+        raise AudioDecodingError('ffmpeg is not installed')
+    process = subprocess.run([
+        'ffmpeg', '-i', 'pipe:0', '-f', 'f32le', '-acodec', 'pcm_f32le',
+        '-ar', str(sampling_rate), '-ac', '1', 'pipe:1'
+    ], input=file_bytes, check=True, capture_output=True)
+    # Copied once, as the buffer of the output bytes is read-only
+    return np.frombuffer(process.stdout, dtype=np.float32).copy(), sampling_rate
@@ -0,0 +1,70 @@
+#!/usr/bin/env python3
+"""Times in-memory decoding and resampling to 16 kHz for 8, 16, 44.1 and 48 kHz
+recordings. Run with: python benchmarks/benchmarkAudioDecoding.py"""
+
+import argparse
+import io
+import json
+import os
+import sys
+import time
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+import soundfile as sf
+import torch
+import torchaudio
+import audioDecoder
+
+sampling_rates = [8000, 16000, 44100, 48000]
+file_formats = [('WAV', 'PCM_16'), ('OGG', 'VORBIS'), ('OGG', 'OPUS')]
+
+
+def timeFunction(function, repetitions: int) -> float:
+    function()  # Warm-up, also fills the resampler cache
+    start = time.perf_counter()
+    for _ in range(repetitions):
+        function()
+    return (time.perf_counter()-start)/repetitions*1000
+
+
+def benchmarkSamplingRate(sampling_rate: int, duration: float, repetitions: int) -> dict:
+    time_axis = np.arange(int(sampling_rate*duration))/sampling_rate
+    signal = (0.5*np.sin(2*np.pi*220*time_axis)).astype(np.float32)
+
+    results = {'sampling_rate': sampling_rate}
+    results['resample_cached_ms'] = timeFunction(
+        lambda: audioDecoder.resampleAudio(signal, sampling_rate, audioDecoder.target_sampling_rate), repetitions)
+    results['resample_uncached_ms'] = timeFunction(
+        lambda: torchaudio.functional.resample(torch.from_numpy(signal), sampling_rate, audioDecoder.target_sampling_rate), repetitions)
+
+    for file_format, subtype in file_formats:
+        file_buffer = io.BytesIO()
+        try:
+            sf.write(file_buffer, signal, sampling_rate,
+                     format=file_format, subtype=subtype)
+        except Exception:
+            continue  # e.g. Opus only supports some sampling rates
+        file_bytes = file_buffer.getvalue()
+        results['decode_' + file_format.lower() + '_' + subtype.lower() + '_ms'] = timeFunction(
+            lambda: audioDecoder.decodeAudio(file_bytes), repetitions)
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--duration', type=float, default=5.,
+                        help='Length of the test signal in seconds')
+    parser.add_argument('--repetitions', type=int, default=20)
+    parser.add_argument('--output', help='Write the results to this json file')
+    args = parser.parse_args()
+
+    all_results = [benchmarkSamplingRate(sampling_rate, args.duration, args.repetitions)
+                   for sampling_rate in sampling_rates]
+    for results in all_results:
+        print(', '.join([key + ': ' + (str(round(value, 3)) if isinstance(value, float) else str(value))
+                         for key, value in results.items()]))
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(all_results, f, indent=2)
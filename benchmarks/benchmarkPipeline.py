@@ -0,0 +1,279 @@
+#!/usr/bin/env python3
+"""End-to-end latency and throughput of pronunciation scoring.
+
+Runs PronunciationTrainer.processAudioForGivenText and
+lambdaSpeechToScore.lambda_handler on static/ASR_good.wav, ASR_okay.wav and
+ASR_bad.wav and on synthetic recordings of sentences drawn from databases/.
+With --asr fake (the default) Whisper is replaced by the deterministic
+FakeASRModel, so everything but the neural network is measured, on any CPU,
+with the same scores on every run. --asr whisper uses the real models.
+
+Results (latency percentiles, throughput, per-stage times from
+instrumentation.py and mean scores) are written with --output. With
+--baseline, they are compared against a stored result file and regressions
+are listed; the exit code is 1 if there are any.
+
+    python benchmarks/benchmarkPipeline.py --output baseline.json
+    python benchmarks/benchmarkPipeline.py --baseline baseline.json
+"""
+
+import argparse
+import base64
+import io
+import json
+import os
+import platform
+import random
+import sys
+import time
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+import numpy as np
+import soundfile as sf
+import torch
+
+import audioDecoder
+import buildDatabases
+import instrumentation
+import lambdaSpeechToScore
+import modelRegistry
+import pronunciationService
+import pronunciationTrainer
+import RuleBasedModels
+from fakeASR import FakeASRModel
+
+static_folder = os.path.join(os.path.dirname(
+    os.path.dirname(os.path.abspath(__file__))), 'static')
+# Recognition error rate the fake ASR simulates for each recording
+static_recordings = {'ASR_good.wav': 0., 'ASR_okay.wav': 0.2, 'ASR_bad.wav': 0.5}
+static_sentence = {'de': 'Ich habe sehr viel Glück, am Leben und gesund zu sein',
+                   'en': 'I am very lucky to be alive and healthy'}
+
+recording_sampling_rate = 48000  # Like the browser's recordings
+seconds_per_word = 0.35
+
+
+def loadCorpus(language: str, sentences_per_category: int, seed: int) -> list:
+    """(category, sentence) pairs, the same number from every difficulty category"""
+    sentences_in_category = {}
+    for sentence in buildDatabases.readSentences(language):
+        category = pronunciationService.getSentenceCategory(sentence)
+        if category is not None:
+            sentences_in_category.setdefault(category, []).append(sentence)
+
+    rng = random.Random(seed)
+    corpus = []
+    for category in sorted(sentences_in_category):
+        sentences = sentences_in_category[category]
+        corpus += [(category, sentence) for sentence in rng.sample(
+            sentences, min(sentences_per_category, len(sentences)))]
+    return corpus
+
+
+def synthesizeRecording(sentence: str, recording_format: str, seed: int) -> bytes:
+    """Noise with a voiced-like tone per word, as long as the sentence would be spoken"""
+    rng = np.random.default_rng(seed)
+    number_of_words = len(sentence.split())
+    word_samples = int(seconds_per_word*recording_sampling_rate)
+    signal = 0.01*rng.standard_normal(
+        (number_of_words+1)*word_samples).astype(np.float32)
+    time_axis = np.arange(word_samples)/recording_sampling_rate
+    for word_idx in range(number_of_words):
+        start = word_samples//2 + word_idx*word_samples
+        signal[start:start+word_samples] += 0.3 * \
+            np.sin(2*np.pi*rng.uniform(100, 250)*time_axis)
+
+    file_buffer = io.BytesIO()
+    if recording_format == 'ogg':
+        sf.write(file_buffer, signal, recording_sampling_rate,
+                 format='OGG', subtype='OPUS')
+    else:
+        sf.write(file_buffer, signal, recording_sampling_rate, format='WAV')
+    return file_buffer.getvalue()
+
+
+def buildCases(languages: list, sentences_per_category: int, error_rate: float,
+               recording_format: str, seed: int) -> list:
+    cases = []
+    for language in languages:
+        for file_name, recording_error_rate in static_recordings.items():
+            with open(os.path.join(static_folder, file_name), 'rb') as f:
+                cases.append({'scenario': 'static', 'name': file_name, 'language': language,
+                              'text': static_sentence[language], 'error_rate': recording_error_rate,
+                              'audio': f.read()})
+
+        for category, sentence in loadCorpus(language, sentences_per_category, seed):
+            cases.append({'scenario': 'corpus_category_' + str(category), 'name': sentence,
+                          'language': language, 'text': sentence, 'error_rate': error_rate,
+                          'audio': synthesizeRecording(sentence, recording_format, seed)})
+
+    # The trainer is called with decoded audio, like the service does after decoding
+    for case in cases:
+        case['signal'] = audioDecoder.decodeAudio(case['audio'])
+    return cases
+
+
+def buildTrainer(language: str, asr: str) -> pronunciationTrainer.PronunciationTrainer:
+    if asr == 'whisper':
+        return pronunciationTrainer.getTrainer(language)
+    return pronunciationTrainer.PronunciationTrainer(
+        FakeASRModel(), RuleBasedModels.get_phonem_converter(language))
+
+
+def scoreWithTrainer(trainer, case: dict) -> tuple:
+    signal = torch.from_numpy(case['signal']).unsqueeze(0)
+    start = time.perf_counter()
+    with instrumentation.trace(case['language']), instrumentation.span('total'):
+        result = trainer.processAudioForGivenText(signal, case['text'])
+    return time.perf_counter()-start, float(result['pronunciation_accuracy'])
+
+
+def scoreWithLambdaHandler(trainer, case: dict) -> tuple:
+    event = {'body': json.dumps({
+        'title': case['text'], 'language': case['language'],
+        'base64Audio': 'data:audio/ogg;base64,' + base64.b64encode(case['audio']).decode('ascii')})}
+    start = time.perf_counter()
+    result = json.loads(lambdaSpeechToScore.lambda_handler(event, []))
+    return time.perf_counter()-start, float(result['pronunciation_accuracy'])
+
+
+pipelines = {'trainer': scoreWithTrainer, 'lambda': scoreWithLambdaHandler}
+
+
+def summarizeLatencies(latencies: list) -> dict:
+    latencies_ms = np.array(latencies)*1000
+    return {'mean_ms': float(latencies_ms.mean()),
+            'p50_ms': float(np.percentile(latencies_ms, 50)),
+            'p95_ms': float(np.percentile(latencies_ms, 95)),
+            'p99_ms': float(np.percentile(latencies_ms, 99))}
+
+
+def runBenchmark(cases: list, trainers: dict, repetitions: int) -> dict:
+    # The lambda handler gets its trainers from the service's model registry
+    pronunciationService.model_registry = modelRegistry.ModelRegistry(
+        {'trainer': lambda language: trainers[language]})
+
+    results = {}
+    for pipeline_name, score in pipelines.items():
+        scenarios = sorted(set((case['scenario'], case['language']) for case in cases))
+        for scenario, language in scenarios:
+            scenario_cases = [case for case in cases if case['scenario']
+                              == scenario and case['language'] == language]
+            trainer = trainers[language]
+
+            def scoreCase(case):
+                if isinstance(trainer.asr_model, FakeASRModel):
+                    trainer.asr_model.setReferenceText(
+                        case['text'], case['error_rate'])
+                return score(trainer, case)
+
+            scoreCase(scenario_cases[0])  # Warm-up (caches, lazy loading)
+            instrumentation.metrics = instrumentation.Metrics()
+
+            latencies = []
+            accuracies = []
+            start = time.perf_counter()
+            for _ in range(repetitions):
+                for case in scenario_cases:
+                    latency, accuracy = scoreCase(case)
+                    latencies.append(latency)
+                    accuracies.append(accuracy)
+            total_time = time.perf_counter()-start
+
+            stages = {stage: {'p50_ms': latency['p50']*1000, 'p95_ms': latency['p95']*1000,
+                              'p99_ms': latency['p99']*1000}
+                      for (stage, stage_language), latency in instrumentation.metrics.getLatencies().items()
+                      if stage_language == language}
+            key = pipeline_name + '/' + scenario + '/' + language
+            results[key] = dict(summarizeLatencies(latencies),
+                                requests=len(latencies),
+                                throughput_rps=len(latencies)/total_time,
+                                mean_accuracy=float(np.mean(accuracies)),
+                                stages=stages)
+            print(key + ': p50 %.1f ms, p95 %.1f ms, %.1f req/s, accuracy %.1f' % (
+                results[key]['p50_ms'], results[key]['p95_ms'], results[key]['throughput_rps'],
+                results[key]['mean_accuracy']))
+    return results
+
+
+def compareWithBaseline(results: dict, baseline: dict, tolerance: float, min_delta_ms: float) -> list:
+    """Latencies more than tolerance (relative) and min_delta_ms slower than
+    the baseline, lower throughput, and any change of the scores"""
+    regressions = []
+
+    def compareLatency(name, value, baseline_value):
+        if value > baseline_value*(1+tolerance) and value-baseline_value > min_delta_ms:
+            regressions.append('%s: %.2f ms -> %.2f ms (+%.0f%%)' % (
+                name, baseline_value, value, (value/baseline_value-1)*100))
+
+    for key, baseline_result in baseline['results'].items():
+        if key not in results:
+            regressions.append(key + ': missing from the results')
+            continue
+        result = results[key]
+        for metric in ['p50_ms', 'p95_ms']:
+            compareLatency(key + ' ' + metric, result[metric], baseline_result[metric])
+        if result['throughput_rps'] < baseline_result['throughput_rps']/(1+tolerance):
+            regressions.append('%s throughput: %.1f -> %.1f req/s' % (
+                key, baseline_result['throughput_rps'], result['throughput_rps']))
+        for stage, baseline_stage in baseline_result['stages'].items():
+            if stage in result['stages']:
+                compareLatency(key + ' ' + stage + ' p50_ms',
+                               result['stages'][stage]['p50_ms'], baseline_stage['p50_ms'])
+        if baseline['config']['asr'] == 'fake' and abs(result['mean_accuracy']-baseline_result['mean_accuracy']) > 1e-6:
+            regressions.append('%s: mean accuracy changed %.2f -> %.2f' % (
+                key, baseline_result['mean_accuracy'], result['mean_accuracy']))
+    return regressions
+
+
+def getEnvironment() -> dict:
+    return {'python': platform.python_version(), 'platform': platform.platform(),
+            'processor': platform.processor(), 'cpu_count': os.cpu_count(),
+            'numpy': np.__version__, 'torch': torch.__version__,
+            'torch_threads': torch.get_num_threads()}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--asr', choices=['fake', 'whisper'], default='fake')
+    parser.add_argument('--languages', nargs='+', default=['de', 'en'])
+    parser.add_argument('--sentences-per-category', type=int, default=20)
+    parser.add_argument('--error-rate', type=float, default=0.2,
+                        help='Word error rate the fake ASR simulates on the corpus')
+    parser.add_argument('--recording-format', choices=['ogg', 'wav'], default='ogg')
+    parser.add_argument('--repetitions', type=int, default=3)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help='Write the results to this json file')
+    parser.add_argument('--baseline', help='Compare with this result file')
+    parser.add_argument('--tolerance', type=float, default=0.2,
+                        help='Relative slowdown flagged as a regression')
+    parser.add_argument('--min-delta-ms', type=float, default=0.5,
+                        help='Smaller slowdowns are considered noise')
+    args = parser.parse_args()
+
+    config = {key: value for key, value in vars(args).items()
+              if key not in ['output', 'baseline', 'tolerance', 'min_delta_ms']}
+    cases = buildCases(args.languages, args.sentences_per_category, args.error_rate,
+                       args.recording_format, args.seed)
+    trainers = {language: buildTrainer(language, args.asr)
+                for language in args.languages}
+    results = runBenchmark(cases, trainers, args.repetitions)
+    benchmark = {'environment': getEnvironment(), 'config': config, 'results': results}
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(benchmark, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if baseline['config'] != config:
+            print('Warning: the baseline was run with a different configuration', baseline['config'])
+        regressions = compareWithBaseline(
+            results, baseline, args.tolerance, args.min_delta_ms)
+        for regression in regressions:
+            print('REGRESSION', regression)
+        print(str(len(regressions)) + ' regressions against ' + args.baseline)
+        sys.exit(1 if regressions else 0)
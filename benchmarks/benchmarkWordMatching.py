@@ -0,0 +1,280 @@
+#!/usr/bin/env python3
+"""Times the WordMetrics and WordMatching routines against the baseline
+(wordMatchingReference.py) across sentence lengths, and compares their outputs.
+
+Sentences of each length are built from databases/ and transcribed with
+ASR-style errors (fakeASR.corruptTranscript). Each side runs its own pipeline
+from the raw words: the optimized routines only see optimized outputs and the
+baseline routines baseline outputs.
+
+Edit distances and the distance matrix must be identical. The word mapping
+is an optimal alignment instead of the baseline DTW path, so on the timed
+sentences the mapped words, letters and pronunciation accuracy are reported
+as drift from the baseline per sentence (the json output lists every
+sentence). On the fixed corpus of wordMatchingReference.sampleReferenceCorpus
+the mapped words and accuracy must be the baseline ones except for the
+sentences listed in wordMatchingDifferences.json, with exactly the values
+listed there. The script exits with 1 if any of these checks fails. Run with:
+
+    python benchmarks/benchmarkWordMatching.py --output results.json
+
+After an intended change of the alignment, rewrite the list of differences
+with --write-differences and review its diff.
+"""
+
+import argparse
+import json
+import os
+import random
+import sys
+import time
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+import numpy as np
+
+import buildDatabases
+import pronunciationTrainer
+import WordMatching
+import WordMetrics
+import wordMatchingReference as reference
+from fakeASR import corruptTranscript
+
+sentence_lengths = [5, 10, 20, 40, 80]
+scoring_trainer = pronunciationTrainer.PronunciationTrainer(None, None)
+
+
+def makeSentencePairs(language: str, number_of_words: int, number_of_pairs: int,
+                      error_rate: float, seed: int) -> list:
+    """(real_text, transcript) of exactly number_of_words words, joining database sentences"""
+    rng = random.Random(seed)
+    words = [word for sentence in buildDatabases.readSentences(language)
+             for word in sentence.split() if reference.removePunctuation(word)]
+    sentence_pairs = []
+    for _ in range(number_of_pairs):
+        start = rng.randrange(len(words)-number_of_words)
+        real_text = ' '.join(words[start:start+number_of_words])
+        sentence_pairs.append(
+            (real_text, corruptTranscript(real_text, error_rate, rng)))
+    return sentence_pairs
+
+
+def prepareOptimizedInputs(words_real: list, words_estimated: list) -> dict:
+    word_distance_matrix = WordMatching.get_word_distance_matrix(
+        words_estimated, words_real)
+    mapped_words, mapped_words_indices = WordMatching.get_best_mapped_words(
+        words_estimated, words_real)
+    return {'words_real': words_real, 'words_estimated': words_estimated,
+            'word_distance_matrix': word_distance_matrix, 'mapped_words': mapped_words,
+            'mapped_words_indices': mapped_words_indices}
+
+
+def prepareReferenceInputs(words_real: list, words_estimated: list) -> dict:
+    word_distance_matrix = reference.get_word_distance_matrix(
+        words_estimated, words_real)
+    mapped_words, mapped_words_indices = reference.get_best_mapped_words(
+        words_estimated, words_real)
+    return {'words_real': words_real, 'words_estimated': words_estimated,
+            'word_distance_matrix': word_distance_matrix, 'mapped_words': mapped_words,
+            'mapped_words_indices': mapped_words_indices}
+
+
+def countDifferentWords(optimized_output, reference_output, reference_inputs) -> int:
+    return int(sum(optimized_index != reference_index for optimized_index, reference_index
+                   in zip(optimized_output[1], reference_output[1])))
+
+
+def getCostReduction(optimized_output, reference_output, reference_inputs) -> float:
+    """How much lower the cost of the optimal path is than the cost of the words
+    the baseline kept from its DTW path (never negative)"""
+    word_distance_matrix = reference_inputs['word_distance_matrix']
+    _, reference_mapped_words_indices = reference.get_resulting_string(
+        reference_output, reference_inputs['words_estimated'], reference_inputs['words_real'])
+    return float(reference.get_alignment_cost(word_distance_matrix, reference.get_mapped_indices(
+        reference_mapped_words_indices, len(reference_inputs['words_estimated']))) -
+        reference.get_alignment_cost(word_distance_matrix, optimized_output))
+
+
+def countDifferentLetters(optimized_output, reference_output, reference_inputs) -> int:
+    return int(sum(optimized_letter != reference_letter
+                   for optimized_word, reference_word in zip(optimized_output, reference_output)
+                   for optimized_letter, reference_letter in zip(optimized_word, reference_word)))
+
+
+def getAccuracyDifference(optimized_output, reference_output, reference_inputs) -> float:
+    """Optimized minus baseline pronunciation accuracy, in points"""
+    return float(optimized_output[0]-reference_output[0])
+
+
+# name: (optimized, reference, drift); optimized and reference are called with
+# the prepared inputs of their own side. drift gives the per-sentence difference
+# of the outputs, None if they must be identical
+routines = {
+    'edit_distance': (
+        lambda inputs: [WordMetrics.edit_distance(word_real, word_estimated)
+                        for word_real, word_estimated in zip(inputs['words_real'], inputs['words_estimated'])],
+        lambda inputs: [reference.edit_distance(word_real, word_estimated)
+                        for word_real, word_estimated in zip(inputs['words_real'], inputs['words_estimated'])],
+        None),
+    'one_vs_many': (
+        lambda inputs: [WordMetrics.one_vs_many(word_real, inputs['words_estimated'])
+                        for word_real in inputs['words_real']],
+        lambda inputs: [[reference.edit_distance(word_real, word_estimated) for word_estimated in inputs['words_estimated']]
+                        for word_real in inputs['words_real']],
+        None),
+    'word_distance_matrix': (
+        lambda inputs: WordMatching.get_word_distance_matrix(
+            inputs['words_estimated'], inputs['words_real']),
+        lambda inputs: reference.get_word_distance_matrix(
+            inputs['words_estimated'], inputs['words_real']),
+        None),
+    'best_path': (
+        lambda inputs: WordMatching.get_best_path_from_distance_matrix(
+            inputs['word_distance_matrix']),
+        lambda inputs: reference.get_dtw_warping_path(
+            inputs['word_distance_matrix'])[:len(inputs['words_estimated'])],
+        getCostReduction),
+    'best_mapped_words': (
+        lambda inputs: WordMatching.get_best_mapped_words(
+            inputs['words_estimated'], inputs['words_real']),
+        lambda inputs: reference.get_best_mapped_words(
+            inputs['words_estimated'], inputs['words_real']),
+        countDifferentWords),
+    'letters_correctness': (
+        lambda inputs: WordMatching.get_letters_correctness(
+            inputs['words_real'], inputs['mapped_words']),
+        lambda inputs: reference.get_letters_correctness(
+            inputs['words_real'], inputs['mapped_words']),
+        countDifferentLetters),
+    'pronunciation_accuracy': (
+        lambda inputs: scoring_trainer.getPronunciationAccuracy(
+            list(zip(inputs['words_real'], inputs['mapped_words']))),
+        lambda inputs: reference.getPronunciationAccuracy(
+            list(zip(inputs['words_real'], inputs['mapped_words']))),
+        getAccuracyDifference),
+}
+
+
+def checkReferenceCorpus(write_differences: bool) -> int:
+    """Number of corpus sentences that differ from the baseline other than as listed"""
+    differences = reference.getDifferencesFromReference(
+        reference.sampleReferenceCorpus(), scoring_trainer.getPronunciationAccuracy)
+    if write_differences:
+        reference.writeExpectedDifferences(differences)
+    expected_differences = reference.loadExpectedDifferences()
+
+    unexpected = [difference for difference in differences
+                  if difference not in expected_differences]
+    missing = [difference for difference in expected_differences
+               if difference not in differences]
+    for difference in unexpected:
+        print('UNEXPECTED DIFFERENCE %s: %r -> %r, accuracy %.0f instead of %.0f' % (
+            difference['language'], difference['real_text'], difference['mapped_words'],
+            difference['pronunciation_accuracy'], difference['reference_accuracy']))
+    for difference in missing:
+        print('LISTED DIFFERENCE NOT REPRODUCED %s: %r' % (
+            difference['language'], difference['real_text']))
+    print('Reference corpus: %d sentences differ from the baseline as listed, %d unexpected, %d missing' % (
+        len(differences)-len(unexpected), len(unexpected), len(missing)))
+    return len(unexpected)+len(missing)
+
+
+def toComparable(value):
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    if isinstance(value, np.generic):
+        return value.item()
+    if isinstance(value, (list, tuple)):
+        return [toComparable(item) for item in value]
+    return value
+
+
+def timeFunction(function, all_inputs: list, repetitions: int) -> float:
+    """Milliseconds per sentence"""
+    for inputs in all_inputs[:2]:
+        function(inputs)  # Warm-up
+    start = time.perf_counter()
+    for _ in range(repetitions):
+        for inputs in all_inputs:
+            function(inputs)
+    return (time.perf_counter()-start)/repetitions/len(all_inputs)*1000
+
+
+def benchmarkSentenceLength(language: str, number_of_words: int, number_of_pairs: int,
+                            error_rate: float, repetitions: int, seed: int) -> dict:
+    sentence_pairs = makeSentencePairs(
+        language, number_of_words, number_of_pairs, error_rate, seed)
+    optimized_inputs = [prepareOptimizedInputs(real_text.split(), transcript.split())
+                        for real_text, transcript in sentence_pairs]
+    reference_inputs = [prepareReferenceInputs(real_text.split(), transcript.split())
+                        for real_text, transcript in sentence_pairs]
+
+    results = {'language': language, 'words': number_of_words}
+    for name, (optimized, reference_function, drift) in routines.items():
+        optimized_ms = timeFunction(optimized, optimized_inputs, repetitions)
+        reference_ms = timeFunction(
+            reference_function, reference_inputs, repetitions)
+        results[name] = {'ms': optimized_ms, 'reference_ms': reference_ms,
+                         'speedup': reference_ms/optimized_ms}
+
+        outputs = [(optimized(sentence_optimized_inputs), reference_function(sentence_reference_inputs), sentence_reference_inputs)
+                   for sentence_optimized_inputs, sentence_reference_inputs in zip(optimized_inputs, reference_inputs)]
+        if drift is None:
+            results[name]['mismatches'] = sum(toComparable(optimized_output) != toComparable(reference_output)
+                                              for optimized_output, reference_output, _ in outputs)
+        else:
+            sentences_drift = [drift(*sentence_outputs)
+                               for sentence_outputs in outputs]
+            results[name]['drift'] = {'sentences_that_differ': int(sum(value != 0 for value in sentences_drift)),
+                                      'mean': float(np.mean(sentences_drift)),
+                                      'min': float(np.min(sentences_drift)),
+                                      'max': float(np.max(sentences_drift)),
+                                      'per_sentence': sentences_drift}
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--languages', nargs='+', default=['de', 'en'])
+    parser.add_argument('--sentence-lengths', nargs='+', type=int,
+                        default=sentence_lengths, help='Numbers of words')
+    parser.add_argument('--pairs', type=int, default=50,
+                        help='Sentences per language and length')
+    parser.add_argument('--error-rate', type=float, default=0.2)
+    parser.add_argument('--repetitions', type=int, default=3)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help='Write the results to this json file')
+    parser.add_argument('--write-differences', action='store_true',
+                        help='Rewrite wordMatchingDifferences.json from the current alignment')
+    args = parser.parse_args()
+
+    all_results = []
+    for language in args.languages:
+        for number_of_words in args.sentence_lengths:
+            results = benchmarkSentenceLength(language, number_of_words, args.pairs,
+                                              args.error_rate, args.repetitions, args.seed)
+            all_results.append(results)
+            print(language + ', ' + str(number_of_words) + ' words: ' + ', '.join(
+                '%s %.3f ms (x%.1f)' % (name, results[name]['ms'], results[name]['speedup'])
+                for name in routines))
+            print('    drift from the baseline: ' + ', '.join(
+                '%s %d/%d sentences (mean %.2f, min %.2f, max %.2f)' % (
+                    name, results[name]['drift']['sentences_that_differ'], args.pairs,
+                    results[name]['drift']['mean'], results[name]['drift']['min'],
+                    results[name]['drift']['max'])
+                for name in routines if 'drift' in results[name]))
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(all_results, f, indent=2)
+
+    total_mismatches = sum(results[name].get('mismatches', 0)
+                           for results in all_results for name in routines)
+    for results in all_results:
+        for name in routines:
+            if results[name].get('mismatches'):
+                print('MISMATCH %s, %s, %d words: %d sentences differ from the reference' % (
+                    name, results['language'], results['words'], results[name]['mismatches']))
+    corpus_mismatches = checkReferenceCorpus(args.write_differences)
+    sys.exit(1 if total_mismatches or corpus_mismatches else 0)
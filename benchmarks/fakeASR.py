@@ -0,0 +1,111 @@
+"""Deterministic stand-in for Whisper and ASR-style corruptions of text.
+
+FakeASRModel implements IASRModel without a neural network: it "transcribes"
+the reference text it was given, corrupted with a fixed seed, and spreads the
+words evenly over the audio. Benchmarks measure the rest of the pipeline with
+it on CPU-only machines, and get the same scores on every run.
+"""
+import os
+import random
+import sys
+import zlib
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+import torch
+
+from ModelInterfaces import IASRModel, ASRResult
+
+# Letters an ASR model typically confuses (voiced/unvoiced, similar vowels)
+letter_confusions = {'b': 'p', 'p': 'b', 'd': 't', 't': 'd', 'g': 'k', 'k': 'g',
+                     'v': 'f', 'f': 'v', 's': 'z', 'z': 's', 'e': 'a', 'a': 'e',
+                     'i': 'e', 'o': 'u', 'u': 'o', 'ä': 'e', 'ö': 'o', 'ü': 'u'}
+filler_words = ['äh', 'uh', 'hm']
+
+
+def corruptWord(word: str, rng: random.Random) -> str:
+    positions = [idx for idx, letter in enumerate(word.lower())
+                 if letter in letter_confusions]
+    corruption = rng.random()
+    if corruption < 0.5 and positions:
+        idx = rng.choice(positions)
+        return word[:idx] + letter_confusions[word[idx].lower()] + word[idx+1:]
+    if corruption < 0.8 and len(word) > 2:
+        idx = rng.randrange(len(word))
+        return word[:idx] + word[idx+1:]
+    return word + rng.choice('aeiou')
+
+
+def corruptTranscript(text: str, error_rate: float, rng: random.Random) -> str:
+    """Mistakes of a speech recognizer on a mispronounced text: changed letters,
+    dropped, merged and split words, inserted fillers. Each word is affected
+    with probability error_rate."""
+    words = text.split()
+    corrupted_words = []
+    idx = 0
+    while idx < len(words):
+        word = words[idx]
+        if rng.random() >= error_rate:
+            corrupted_words.append(word)
+            idx += 1
+            continue
+
+        error_type = rng.random()
+        if error_type < 0.6:
+            corrupted_words.append(corruptWord(word, rng))
+        elif error_type < 0.75:
+            pass  # Word not recognized
+        elif error_type < 0.85 and idx+1 < len(words):
+            corrupted_words.append(word + words[idx+1].lower())
+            idx += 1
+        elif error_type < 0.93 and len(word) > 5:
+            split_idx = rng.randrange(2, len(word)-2)
+            corrupted_words += [word[:split_idx], word[split_idx:]]
+        else:
+            corrupted_words += [word, rng.choice(filler_words)]
+        idx += 1
+    return ' '.join(corrupted_words)
+
+
+class FakeASRModel(IASRModel):
+    """Returns a corrupted copy of reference_text, the same for the same text.
+
+    Set reference_text before each call (setReferenceText). Word timestamps are
+    in samples at sampling_rate, like WhisperASRModel's.
+    """
+
+    def __init__(self, error_rate: float = 0.1, seed: int = 0, sampling_rate: int = 16000):
+        self.error_rate = error_rate
+        self.seed = seed
+        self.sampling_rate = sampling_rate
+        self.reference_text = ''
+        self.last_result = ASRResult('', ())
+
+    def setReferenceText(self, reference_text: str, error_rate: float = None):
+        self.reference_text = reference_text
+        if error_rate is not None:
+            self.error_rate = error_rate
+
+    def transcribeAudio(self, audio) -> ASRResult:
+        number_of_samples = audio.shape[-1]
+        # Seeded by the text, so that results don't depend on the order of calls
+        rng = random.Random(zlib.crc32(
+            self.reference_text.encode('utf-8')) ^ self.seed)
+        transcript = corruptTranscript(
+            self.reference_text, self.error_rate, rng)
+
+        words = transcript.split()
+        boundaries = np.linspace(0, number_of_samples, len(words)+1)
+        word_locations = tuple({'word': word, 'start_ts': float(boundaries[idx]),
+                                'end_ts': float(boundaries[idx+1]), 'tag': 'processed'}
+                               for idx, word in enumerate(words))
+        return ASRResult(transcript, word_locations)
+
+    def processAudio(self, audio: torch.Tensor):
+        self.last_result = self.transcribeAudio(audio)
+
+    def getTranscript(self) -> str:
+        return self.last_result.transcript
+
+    def getWordLocations(self) -> list:
+        return list(self.last_result.word_locations)
@@ -0,0 +1,269 @@
+"""The baseline word matching, to measure WordMetrics and WordMatching against.
+
+Plain Python copies of what the trainer did before the optimizations: words
+mapped along the dtwalign DTW warping path (get_best_mapped_words) and letters
+marked by DTW-mapping them and comparing them position by position
+(get_letters_correctness). The DTW is reimplemented here, with dtwalign's
+symmetric2 steps and tie-breaking, so that the reference has no dependency.
+
+The distances must match exactly. The word mapping of WordMatching is an
+optimal one-to-one alignment instead of the DTW path, and its letters are
+aligned with a Levenshtein DP (the baseline marks the second letter of a
+double letter wrong), so words, letters and scores may differ from the
+baseline. On the fixed corpus of sampleReferenceCorpus, the mapped words and
+the pronunciation accuracy must be the baseline ones, except for the sentences
+listed with both values in wordMatchingDifferences.json (written by
+benchmarkWordMatching.py --write-differences). get_best_path_brute_force tries
+every alignment and gives the optimal cost independently of any dynamic
+programming. sampleSentencePairs draws sentences from databases/ with a
+simulated ASR transcript of each.
+"""
+import itertools
+import json
+import os
+import random
+import sys
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from string import punctuation
+
+import numpy as np
+
+import buildDatabases
+import WordMatching
+import WordMetrics
+from fakeASR import corruptTranscript
+
+WORD_NOT_FOUND_TOKEN = '-'
+differences_path = os.path.join(os.path.dirname(
+    os.path.abspath(__file__)), 'wordMatchingDifferences.json')
+
+
+def edit_distance(seq1, seq2) -> int:
+    return int(WordMetrics.edit_distance_python(seq1, seq2))
+
+
+def get_word_distance_matrix(words_estimated: list, words_real: list) -> np.ndarray:
+    word_distance_matrix = np.zeros(
+        (len(words_estimated)+1, len(words_real)))
+    for idx_estimated, word_estimated in enumerate(words_estimated):
+        for idx_real, word_real in enumerate(words_real):
+            word_distance_matrix[idx_estimated, idx_real] = edit_distance(
+                word_estimated, word_real)
+    for idx_real, word_real in enumerate(words_real):
+        word_distance_matrix[len(words_estimated), idx_real] = len(word_real)
+    return word_distance_matrix
+
+
+def get_alignment_cost(word_distance_matrix: np.ndarray, mapped_indices, deletion_cost: float = 0.) -> float:
+    """Cost of a mapping as defined in WordMatching.get_best_path_from_distance_matrix"""
+    number_of_estimated_words = word_distance_matrix.shape[0]-1
+    cost = 0.
+    for idx_estimated, idx_real in enumerate(mapped_indices):
+        if idx_real < 0:
+            cost += deletion_cost
+        else:
+            cost += word_distance_matrix[idx_estimated, idx_real]
+    for idx_real in set(range(word_distance_matrix.shape[1])) - set(mapped_indices):
+        cost += word_distance_matrix[number_of_estimated_words, idx_real]
+    return cost
+
+
+def get_best_path_brute_force(word_distance_matrix: np.ndarray, deletion_cost: float = 0.) -> float:
+    """Lowest cost over every monotonic one-to-one mapping. Exponential, keep
+    the sentences below ~8 words."""
+    number_of_estimated_words = word_distance_matrix.shape[0]-1
+    number_of_real_words = word_distance_matrix.shape[1]
+    best_cost = float('inf')
+    for number_of_matches in range(min(number_of_estimated_words, number_of_real_words)+1):
+        for matched_estimated in itertools.combinations(range(number_of_estimated_words), number_of_matches):
+            for matched_real in itertools.combinations(range(number_of_real_words), number_of_matches):
+                mapped_indices = [-1]*number_of_estimated_words
+                for idx_estimated, idx_real in zip(matched_estimated, matched_real):
+                    mapped_indices[idx_estimated] = idx_real
+                best_cost = min(best_cost, get_alignment_cost(
+                    word_distance_matrix, mapped_indices, deletion_cost))
+    return best_cost
+
+
+def get_dtw_warping_path(word_distance_matrix: np.ndarray) -> list:
+    """dtwalign.dtw_from_distance_matrix(word_distance_matrix.T).get_warping_path():
+    for every estimated word (and the blank row), the real word it is aligned
+    with on the symmetric2 DTW path"""
+    distances = np.asarray(word_distance_matrix, dtype=float).T.tolist()
+    number_of_real_words, number_of_columns = len(distances), len(distances[0])
+
+    # Steps (real, estimated) in dtwalign's order, which decides ties
+    steps = [(-1, 0, 1), (-1, -1, 2), (0, -1, 1)]
+    accumulated_cost = [[float('inf')]*number_of_columns
+                        for _ in range(number_of_real_words)]
+    accumulated_cost[0][0] = distances[0][0]
+    for idx_real in range(number_of_real_words):
+        for idx_column in range(number_of_columns):
+            if idx_real == 0 and idx_column == 0:
+                continue
+            for step_real, step_column, weight in steps:
+                if idx_real+step_real >= 0 and idx_column+step_column >= 0:
+                    accumulated_cost[idx_real][idx_column] = min(
+                        accumulated_cost[idx_real][idx_column],
+                        accumulated_cost[idx_real+step_real][idx_column+step_column] +
+                        weight*distances[idx_real][idx_column])
+
+    # Backtracking follows the lowest accumulated cost, the first step on ties
+    idx_real, idx_column = number_of_real_words-1, number_of_columns-1
+    path = [(idx_real, idx_column)]
+    while idx_real > 0 or idx_column > 0:
+        best_cost = float('inf')
+        for step_real, step_column, _ in steps:
+            if idx_real+step_real >= 0 and idx_column+step_column >= 0 and \
+                    accumulated_cost[idx_real+step_real][idx_column+step_column] < best_cost:
+                best_cost = accumulated_cost[idx_real +
+                                             step_real][idx_column+step_column]
+                best_step = (step_real, step_column)
+        idx_real, idx_column = idx_real+best_step[0], idx_column+best_step[1]
+        path.append((idx_real, idx_column))
+
+    # dtwalign interpolates the path with np.interp, which gives the last real
+    # word of each column, except for the first column that starts at 0
+    warping_path = [0]*number_of_columns
+    for idx_real, idx_column in path:
+        warping_path[idx_column] = max(warping_path[idx_column], idx_real)
+    warping_path[0] = 0
+    return warping_path
+
+
+def get_resulting_string(mapped_indices, words_estimated: list, words_real: list) -> tuple:
+    mapped_words = []
+    mapped_words_indices = []
+    for idx_real, word_real in enumerate(words_real):
+        candidates = [idx_estimated for idx_estimated, mapped_index in enumerate(mapped_indices)
+                      if mapped_index == idx_real]
+        if not candidates:
+            mapped_words.append(WORD_NOT_FOUND_TOKEN)
+            mapped_words_indices.append(-1)
+            continue
+        # The first of the closest estimated words, '' if all are past the end
+        candidates = [idx_estimated for idx_estimated in candidates
+                      if idx_estimated < len(words_estimated)]
+        if not candidates:
+            mapped_words.append('')
+            mapped_words_indices.append(-1)
+            continue
+        best_idx = min(candidates, key=lambda idx_estimated: edit_distance(
+            words_estimated[idx_estimated], word_real))
+        mapped_words.append(words_estimated[best_idx])
+        mapped_words_indices.append(best_idx)
+    return mapped_words, mapped_words_indices
+
+
+def get_best_mapped_words(words_estimated, words_real) -> tuple:
+    """Words (or the letters of a word) mapped along the DTW warping path"""
+    mapped_indices = get_dtw_warping_path(get_word_distance_matrix(
+        words_estimated, words_real))[:len(words_estimated)]
+    return get_resulting_string(mapped_indices, words_estimated, words_real)
+
+
+def get_mapped_indices(mapped_words_indices: list, number_of_estimated_words: int) -> list:
+    """For each estimated word, the real word it was kept for, or -1. Turns the
+    output of get_best_mapped_words into a mapping for get_alignment_cost"""
+    mapped_indices = [-1]*number_of_estimated_words
+    for idx_real, idx_estimated in enumerate(mapped_words_indices):
+        if idx_estimated >= 0:
+            mapped_indices[idx_estimated] = idx_real
+    return mapped_indices
+
+
+def get_letters_correctness(words_real: list, words_transcribed: list) -> list:
+    letters_correctness = []
+    for word_real, word_transcribed in zip(words_real, words_transcribed):
+        mapped_letters, _ = get_best_mapped_words(word_transcribed, word_real)
+        letters_correctness.append(WordMatching.getWhichLettersWereTranscribedCorrectly(
+            word_real, mapped_letters))
+    return letters_correctness
+
+
+def removePunctuation(word: str) -> str:
+    return ''.join([char for char in word if char not in punctuation])
+
+
+def getPronunciationAccuracy(real_and_transcribed_words: list) -> tuple:
+    """Like PronunciationTrainer.getPronunciationAccuracy"""
+    total_mismatches = 0
+    number_of_letters = 0
+    words_accuracy = []
+    for word_real, word_transcribed in real_and_transcribed_words:
+        word_real = removePunctuation(word_real).lower()
+        mismatches = edit_distance(
+            word_real, removePunctuation(word_transcribed).lower())
+        total_mismatches += mismatches
+        number_of_letters += len(word_real)
+        words_accuracy.append(
+            float(len(word_real)-mismatches)/len(word_real)*100)
+    return np.round((number_of_letters-total_mismatches)/number_of_letters*100), words_accuracy
+
+
+def sampleSentencePairs(number_of_pairs: int, error_rate: float, seed: int = 0,
+                        languages: tuple = ('de', 'en'), max_words: int = None) -> list:
+    """(language, real_text, transcript) with transcript an ASR-style corruption
+    of real_text. Sentences whose words are only punctuation are skipped, as
+    the trainer cannot score them."""
+    rng = random.Random(seed)
+    sentences = {language: [sentence for sentence in buildDatabases.readSentences(language)
+                            if sentence.split() and all(removePunctuation(word) for word in sentence.split())
+                            and (max_words is None or len(sentence.split()) <= max_words)]
+                 for language in languages}
+    sentence_pairs = []
+    for _ in range(number_of_pairs):
+        language = rng.choice(languages)
+        real_text = rng.choice(sentences[language])
+        sentence_pairs.append(
+            (language, real_text, corruptTranscript(real_text, error_rate, rng)))
+    return sentence_pairs
+
+
+def sampleReferenceCorpus() -> list:
+    """The fixed corpus the optimized matching is compared on"""
+    return sampleSentencePairs(300, error_rate=0.3, seed=0)
+
+
+def getDifferencesFromReference(sentence_pairs: list, getOptimizedAccuracy) -> list:
+    """The sentences whose mapped words or pronunciation accuracy, scored with
+    getOptimizedAccuracy, differ from the baseline, with both values"""
+    differences = []
+    for language, real_text, transcript in sentence_pairs:
+        words_real, words_estimated = real_text.split(), transcript.split()
+        mapped_words, mapped_words_indices = WordMatching.get_best_mapped_words(
+            words_estimated, words_real)
+        reference_mapped_words, reference_mapped_words_indices = get_best_mapped_words(
+            words_estimated, words_real)
+        pronunciation_accuracy, _ = getOptimizedAccuracy(
+            list(zip(words_real, mapped_words)))
+        reference_accuracy, _ = getPronunciationAccuracy(
+            list(zip(words_real, reference_mapped_words)))
+
+        mapped_words_indices = [int(idx) for idx in mapped_words_indices]
+        if (mapped_words, mapped_words_indices, float(pronunciation_accuracy)) != \
+                (reference_mapped_words, reference_mapped_words_indices, float(reference_accuracy)):
+            differences.append({'language': language, 'real_text': real_text, 'transcript': transcript,
+                                'mapped_words': mapped_words,
+                                'mapped_words_indices': mapped_words_indices,
+                                'pronunciation_accuracy': float(pronunciation_accuracy),
+                                'reference_mapped_words': reference_mapped_words,
+                                'reference_mapped_words_indices': reference_mapped_words_indices,
+                                'reference_accuracy': float(reference_accuracy)})
+    return differences
+
+
+def loadExpectedDifferences() -> list:
+    with open(differences_path, encoding='utf-8') as f:
+        return json.load(f)
+
+
+def writeExpectedDifferences(differences: list):
+    """One key per line and the lists on one line, to keep the diffs readable"""
+    entries = ['  {\n' + ',\n'.join('    %s: %s' % (json.dumps(key), json.dumps(value, ensure_ascii=False))
+                                    for key, value in difference.items()) + '\n  }'
+               for difference in differences]
+    with open(differences_path, 'w', encoding='utf-8') as f:
+        f.write('[\n' + ',\n'.join(entries) + '\n]\n')
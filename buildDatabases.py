@@ -0,0 +1,112 @@
+import argparse
+import functools
+import csv
+import time
+import RuleBasedModels
+import utilsFileIO
+
+sample_folder = "./databases/"
+available_languages = ['de', 'en']
+
+
+def readSentences(language: str) -> list:
+    with open(sample_folder+'data_'+language+'.csv', encoding='utf-8', newline='') as f:
+        rows = csv.reader(f, delimiter=';')
+        sentence_column = next(rows).index('sentence')
+        return [row[sentence_column] for row in rows if len(row) > sentence_column]
+
+
+def getSentenceStorePath(language: str) -> str:
+    return sample_folder+'sentences_'+language+'.bin'
+
+
+def buildSentenceStore(language: str) -> str:
+    """Packs the sentences of the database into one memory-mappable file"""
+    store_path = getSentenceStorePath(language)
+    utilsFileIO.writePackedStrings(store_path, readSentences(language))
+    return store_path
+
+
+def getSentenceIpaStorePath(language: str) -> str:
+    return sample_folder+'sentences_ipa_'+language+'.bin'
+
+
+def buildSentenceIpaStore(language: str) -> str:
+    """Packs the IPA of every sentence of the database, in the order of the
+    sentence store, using the IPA lexicon if it was built"""
+    phonem_converter = RuleBasedModels.get_phonem_converter(language)
+    store_path = getSentenceIpaStorePath(language)
+    utilsFileIO.writePackedStrings(store_path, [phonem_converter.convertToPhonem(sentence)
+                                                for sentence in readSentences(language)])
+    return store_path
+
+
+def buildIpaLexicon(language: str) -> str:
+    """Precomputes the IPA of every sentence and every word of the database"""
+    phonem_converter = RuleBasedModels.get_base_phonem_converter(language)
+    word_converter = RuleBasedModels.CachedPhonemConverter(phonem_converter)
+
+    ipa_of_text = {}
+    for sentence in readSentences(language):
+        if sentence not in ipa_of_text:
+            ipa_of_text[sentence] = phonem_converter.convertToPhonem(sentence)
+        for word in sentence.split():
+            if word not in ipa_of_text:
+                ipa_of_text[word] = word_converter.convertToPhonem(word)
+
+    lexicon_path = RuleBasedModels.get_lexicon_path(language)
+    RuleBasedModels.IpaLexicon.write(lexicon_path, ipa_of_text)
+    return lexicon_path
+
+
+def renderTTSCorpus(language: str, audio_formats: list = ['wav']) -> str:
+    """Synthesizes every sentence of the database into the TTS cache, in each
+    of audio_formats, and every segment of it in the 'pcm' format that
+    streamSpeech reads, so that /tts and /tts/stream requests for database
+    sentences are cache hits"""
+    import pronunciationService
+    if pronunciationService.tts_cache.cache_folder is None:
+        raise ValueError('TTS_CACHE_FOLDER is empty, there is no disk cache to render into')
+
+    sentences = readSentences(language)
+    number_rendered = 0
+    for sentence_idx, sentence in enumerate(sentences):
+        formats_of_text = {sentence: list(audio_formats)}
+        for segment in pronunciationService.splitIntoSegments(sentence):
+            segment_formats = formats_of_text.setdefault(segment, [])
+            if 'pcm' not in segment_formats:
+                segment_formats.append('pcm')
+
+        for text, text_formats in formats_of_text.items():
+            number_rendered += pronunciationService.prerenderSpeech(
+                text, language, text_formats)
+        if (sentence_idx+1) % 500 == 0:
+            print('Rendered', sentence_idx+1, 'of', len(sentences), 'sentences in', language)
+
+    print('Added', number_rendered, 'files for', len(sentences), 'sentences in', language)
+    return pronunciationService.tts_cache.cache_folder
+
+
+builders = {'sentences': buildSentenceStore, 'ipa': buildIpaLexicon,
+            'sentences_ipa': buildSentenceIpaStore, 'tts': renderTTSCorpus}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description='Precompute the serving files of the sentence databases')
+    # The tts target runs the neural TTS over every sentence, so it is opt-in
+    parser.add_argument('targets', nargs='*', choices=list(builders),
+                        default=['sentences', 'ipa', 'sentences_ipa'])
+    parser.add_argument('--languages', nargs='+',
+                        default=available_languages)
+    parser.add_argument('--tts-formats', nargs='+', default=['wav'],
+                        help='Formats of the rendered sentences (wav, opus), streaming segments are always rendered')
+    args = parser.parse_args()
+    builders['tts'] = functools.partial(
+        renderTTSCorpus, audio_formats=args.tts_formats)
+
+    for target in args.targets:
+        for language in args.languages:
+            start = time.time()
+            output_path = builders[target](language)
+            print('Built', output_path, 'in', str(time.time()-start), 's')
@@ -1,7 +1,7 @@
 import requests
 import base64
 import json
-from typing import Optional
+from typing import Optional, Union
 
 class AITrainerClient:
     """AI发音训练器Python客户端"""
@@ -73,6 +73,33 @@ class AITrainerClient:
             response.raise_for_status()
             return response.json()
     
+    def analyze_pronunciation_raw(
+        self,
+        text: str,
+        audio: Union[str, bytes],
+        language: str = "de"
+    ) -> dict:
+        """
+        以原始字节上传音频分析发音 (无base64, 无JSON封装)
+
+        Args:
+            text: 要分析的文本
+            audio: 音频文件路径或音频字节
+            language: 语言代码 (de/en)
+        """
+        if isinstance(audio, str):
+            with open(audio, 'rb') as f:
+                audio = f.read()
+
+        response = self.session.post(
+            f"{self.base_url}/api/v1/pronunciation/raw",
+            params={"text": text, "language": language},
+            data=audio,
+            headers={"Content-Type": "application/octet-stream"}
+        )
+        response.raise_for_status()
+        return response.json()
+    
     def text_to_speech(
         self, 
         text: str, 
@@ -1,17 +1,18 @@
-from fastapi import FastAPI, HTTPException, File, UploadFile
+from fastapi import FastAPI, HTTPException, File, UploadFile, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, StreamingResponse, Response
 from pydantic import BaseModel
-from typing import Optional, List
-import base64
+from typing import List, Literal
+import asyncio
+import contextlib
 import json
 import os
 import uvicorn
+import inferenceExecutor
+import instrumentation
 
-# 导入原有的处理模块
-import lambdaTTS
-import lambdaSpeechToScore
-import lambdaGetSample
+# 进程内服务层 (直接调用, 不再经过lambda事件的JSON序列化)
+import pronunciationService as service
 
 app = FastAPI(
     title="AI发音训练器 API",
@@ -30,11 +31,56 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# 推理线程池: 阻塞的模型调用都在这里运行, 不会阻塞事件循环 (/health 等保持响应)
+# 通过环境变量配置: INFERENCE_WORKERS, INFERENCE_QUEUE_SIZE, INFERENCE_TIMEOUT (秒)
+inference_executor = inferenceExecutor.getExecutorFromEnvironment()
+
+def collect_executor_metrics():
+    stats = inference_executor.getStats()
+    return [("pronunciation_inference_queue_depth", "gauge", "Requests waiting for an inference thread",
+             [({}, stats["queued"])]),
+            ("pronunciation_inference_running", "gauge", "Requests running in the inference threads",
+             [({}, stats["running"])]),
+            ("pronunciation_inference_rejected_total", "counter", "Requests rejected with 503 because the queue was full",
+             [({}, stats["rejected"])]),
+            ("pronunciation_inference_timed_out_total", "counter", "Requests answered with 504",
+             [({}, stats["timed_out"])])]
+
+instrumentation.registerCollector(collect_executor_metrics)
+
+@app.on_event("startup")
+def load_sample_databases():
+    """启动时加载句子库、句子索引和音标, 第一个 /sample 请求不再读取数据库"""
+    service.loadSampleDatabases()
+
+@contextlib.contextmanager
+def inference_errors():
+    """推理线程池的错误转换为HTTP状态码: 队列已满返回503, 超时返回504"""
+    try:
+        yield
+    except inferenceExecutor.ExecutorSaturatedError:
+        raise HTTPException(status_code=503, detail="服务器繁忙, 请稍后重试",
+                            headers={"Retry-After": "1"})
+    except inferenceExecutor.InferenceTimeoutError:
+        raise HTTPException(status_code=504, detail="处理超时")
+
+async def run_inference(function, *args):
+    """在推理线程池中运行阻塞函数; 队列已满返回503, 超时返回504"""
+    with inference_errors():
+        return await inference_executor.run(function, *args)
+
 # 请求模型定义
 class TextToSpeechRequest(BaseModel):
     text: str
     language: str = "de"  # de(德语) 或 en(英语)
     voice_speed: float = 1.0
+    audio_format: Literal["wav", "opus"] = "wav"
+
+class TextToSpeechStreamRequest(BaseModel):
+    text: str
+    language: str = "de"
+    voice_speed: float = 1.0
+    stream_format: Literal["wav", "pcm"] = "wav"  # pcm: 16位单声道原始采样, 16 kHz
 
 class PronunciationRequest(BaseModel):
     text: str
@@ -69,6 +115,10 @@ class TTSResponse(BaseModel):
     audio_base64: str
     message: str
 
+@app.on_event("shutdown")
+async def shutdown_inference_executor():
+    inference_executor.shutdown()
+
 @app.get("/")
 async def root():
     """API根路径，返回基本信息"""
@@ -77,16 +127,35 @@ async def root():
         "version": "1.0.0",
         "endpoints": {
             "pronunciation": "/api/v1/pronunciation",
+            "pronunciation_raw": "/api/v1/pronunciation/raw",
             "tts": "/api/v1/tts", 
+            "tts_stream": "/api/v1/tts/stream",
             "sample": "/api/v1/sample",
+            "metrics": "/metrics",
             "docs": "/docs"
         }
     }
 
 @app.get("/health")
 async def health_check():
-    """健康检查接口"""
-    return {"status": "healthy", "message": "AI发音训练器运行正常"}
+    """健康检查接口: 推理队列已满时返回503 (busy), 并报告已加载的模型"""
+    stats = inference_executor.getStats()
+    models = [model["kind"] + ":" + model["language"] for model in service.model_registry.getState()]
+    if stats["queued"] >= stats["max_queue_size"]:
+        return JSONResponse(status_code=503, content={
+            "status": "busy", "message": "推理队列已满", "inference": stats, "models": models})
+    return {"status": "healthy", "message": "AI发音训练器运行正常", "inference": stats, "models": models}
+
+@app.get("/metrics")
+async def metrics():
+    """Prometheus格式的指标: 各处理阶段的延迟 (按语言的p50/p95/p99)、队列深度和模型加载状态"""
+    return Response(instrumentation.renderPrometheus(),
+                    media_type=instrumentation.prometheus_content_type)
+
+def score_base64_audio(text: str, audio_base64: str, language: str):
+    """在推理线程中解码base64音频并评分, 大录音的解码不会阻塞事件循环"""
+    return service.scorePronunciation(service.ScoreRequest(
+        real_text=text, audio=service.decodeBase64Audio(audio_base64), language=language))
 
 @app.post("/api/v1/pronunciation", response_model=PronunciationResponse)
 async def analyze_pronunciation(request: PronunciationRequest):
@@ -98,26 +167,13 @@ async def analyze_pronunciation(request: PronunciationRequest):
     - **language**: 语言代码 (de=德语, en=英语)
     """
     try:
-        # 构造lambda事件格式
-        event = {
-            'body': json.dumps({
-                'title': request.text,
-                'base64Audio': request.audio_base64,
-                'language': request.language
-            })
-        }
-        
-        # 调用原有的处理函数
-        result = lambdaSpeechToScore.lambda_handler(event, [])
-        
-        # 解析结果
-        if isinstance(result, str):
-            result_data = json.loads(result)
-        else:
-            result_data = result
-            
-        return PronunciationResponse(**result_data)
+        result = await run_inference(
+            score_base64_audio, request.text, request.audio_base64, request.language)
+
+        return PronunciationResponse(**result.toDict())
         
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"发音分析失败: {str(e)}")
 
@@ -131,25 +187,42 @@ async def analyze_pronunciation_file(
     通过上传音频文件分析发音 (支持WAV, MP3, OGG等格式)
     """
     try:
-        # 读取上传的文件
+        # 读取上传的文件, 直接交给解码器 (不再转换为base64)
         audio_content = await audio_file.read()
+
+        result = await run_inference(
+            service.scorePronunciation, service.ScoreRequest(text, audio_content, language))
+
+        return PronunciationResponse(**result.toDict())
         
-        # 转换为base64
-        audio_base64 = "data:audio/ogg;base64," + base64.b64encode(audio_content).decode('utf-8')
-        
-        # 创建请求对象
-        request = PronunciationRequest(
-            text=text,
-            audio_base64=audio_base64,
-            language=language
-        )
-        
-        # 调用分析函数
-        return await analyze_pronunciation(request)
-        
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"文件处理失败: {str(e)}")
 
+@app.post("/api/v1/pronunciation/raw", response_model=PronunciationResponse)
+async def analyze_pronunciation_raw(request: Request, text: str, language: str = "de"):
+    """
+    分析发音, 请求体为原始音频字节 (Content-Type: application/octet-stream)
+
+    - **text**: 要分析的文本 (查询参数)
+    - **language**: 语言代码 (查询参数, de=德语, en=英语)
+    """
+    audio_content = await request.body()
+    if len(audio_content) == 0:
+        raise HTTPException(status_code=400, detail="缺少音频数据")
+
+    try:
+        result = await run_inference(
+            service.scorePronunciation, service.ScoreRequest(text, audio_content, language))
+
+        return PronunciationResponse(**result.toDict())
+
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"发音分析失败: {str(e)}")
+
 @app.post("/api/v1/tts", response_model=TTSResponse)
 async def text_to_speech(request: TextToSpeechRequest):
     """
@@ -158,36 +231,64 @@ async def text_to_speech(request: TextToSpeechRequest):
     - **text**: 要转换的文本
     - **language**: 语言代码 (de=德语, en=英语)
     - **voice_speed**: 语音速度 (0.5-2.0)
+    - **audio_format**: 音频格式 (wav 或 opus)
+
+    相同的文本 (语言、说话人、速度相同) 直接从缓存返回, 不再重新合成
     """
     try:
-        # 构造lambda事件格式
-        event = {
-            'body': json.dumps({
-                'text': request.text,
-                'language': request.language,
-                'voice_speed': request.voice_speed
-            })
-        }
-        
-        # 调用TTS处理函数
-        result = lambdaTTS.lambda_handler(event, [])
-        
-        # 解析结果
-        if isinstance(result, dict) and 'body' in result:
-            result_data = json.loads(result['body'])
-        elif isinstance(result, str):
-            result_data = json.loads(result)
-        else:
-            result_data = result
-            
+        result = await run_inference(
+            service.synthesizeSpeech,
+            service.TTSRequest(text=request.text, language=request.language,
+                               speed=request.voice_speed, audio_format=request.audio_format))
+
         return TTSResponse(
-            audio_base64=result_data.get('audio_base64', ''),
+            audio_base64=result.toDataUrl(),
             message="语音生成成功"
         )
         
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"语音生成失败: {str(e)}")
 
+@app.post("/api/v1/tts/stream")
+async def text_to_speech_stream(request: TextToSpeechStreamRequest):
+    """
+    流式文本转语音: 文本按句子/分句切分, 每段合成后立即以分块传输 (chunked) 发送,
+    长句子不必等整段合成完就可以开始播放
+
+    - **text**: 要转换的文本
+    - **language**: 语言代码 (de=德语, en=英语)
+    - **stream_format**: wav (第一块带长度未知的WAV头) 或 pcm (16位单声道原始采样)
+    """
+    chunks = service.streamSpeech(service.TTSRequest(
+        text=request.text, language=request.language,
+        speed=request.voice_speed, audio_format=request.stream_format))
+
+    # 整个流在同一个推理线程中合成, 发送任何数据之前就占好线程池的位置, 开始后不会再被拒绝(503)。
+    # 第一段在返回响应之前合成, 这样繁忙(503)、超时(504)和合成错误仍然能作为状态码返回
+    try:
+        with inference_errors():
+            speech_stream = inference_executor.stream(chunks)
+            first_chunk = await speech_stream.next()
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"语音生成失败: {str(e)}")
+
+    async def generate_chunks():
+        # 之后某段超时或合成失败时异常继续抛出: 服务器中断连接而不发送结束块,
+        # 客户端得到不完整的分块传输错误, 而不是看起来完整的截断音频
+        try:
+            yield first_chunk or b""
+            while (chunk := await speech_stream.next()) is not None:
+                yield chunk
+        finally:
+            speech_stream.close()
+
+    return StreamingResponse(generate_chunks(),
+                             media_type=service.getStreamMimeType(request.stream_format))
+
 @app.post("/api/v1/sample", response_model=SampleResponse)
 async def get_sample(request: SampleRequest):
     """
@@ -197,27 +298,14 @@ async def get_sample(request: SampleRequest):
     - **language**: 语言代码 (de=德语, en=英语)
     """
     try:
-        # 构造lambda事件格式
-        event = {
-            'body': json.dumps({
-                'category': request.category,
-                'language': request.language
-            })
-        }
-        
-        # 调用样本生成函数
-        result = lambdaGetSample.lambda_handler(event, [])
-        
-        # 解析结果
-        if isinstance(result, dict) and 'body' in result:
-            result_data = json.loads(result['body'])
-        elif isinstance(result, str):
-            result_data = json.loads(result)
-        else:
-            result_data = result
-            
-        return SampleResponse(**result_data)
+        result = await run_inference(
+            service.getSample,
+            service.SampleRequest(category=int(request.category), language=request.language))
+
+        return SampleResponse(**result.toDict())
         
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"样本生成失败: {str(e)}")
 
@@ -244,31 +332,50 @@ async def get_difficulty_categories():
     }
 
 # 批量处理接口
+# 每个批次最多同时运行的请求数 (默认等于推理线程数), 其余请求在批次内排队
+batch_concurrency = int(os.environ.get("BATCH_CONCURRENCY", inference_executor.max_workers))
+
+async def run_batch(handler, requests: list, stream: bool):
+    """并行运行批量请求; stream=True 时按完成顺序以 NDJSON 流式返回结果"""
+    semaphore = asyncio.Semaphore(batch_concurrency)
+
+    async def run_item(index: int, req):
+        async with semaphore:
+            try:
+                result = await handler(req)
+                return {"index": index, "success": True, "data": result.model_dump()}
+            except HTTPException as e:
+                return {"index": index, "success": False, "error": str(e.detail)}
+            except Exception as e:
+                return {"index": index, "success": False, "error": str(e)}
+
+    tasks = [asyncio.ensure_future(run_item(index, req))
+             for index, req in enumerate(requests)]
+
+    if stream:
+        async def generate_results():
+            try:
+                for finished_task in asyncio.as_completed(tasks):
+                    yield json.dumps(await finished_task, ensure_ascii=False) + "\n"
+            finally:
+                # 客户端断开时取消还没开始的请求
+                for task in tasks:
+                    task.cancel()
+        return StreamingResponse(generate_results(), media_type="application/x-ndjson")
+
+    results = await asyncio.gather(*tasks)
+    return {"results": [{key: value for key, value in result.items() if key != "index"}
+                        for result in results]}
+
 @app.post("/api/v1/batch/pronunciation")
-async def batch_analyze_pronunciation(requests: List[PronunciationRequest]):
-    """批量分析发音"""
-    results = []
-    for req in requests:
-        try:
-            result = await analyze_pronunciation(req)
-            results.append({"success": True, "data": result})
-        except Exception as e:
-            results.append({"success": False, "error": str(e)})
-    
-    return {"results": results}
+async def batch_analyze_pronunciation(requests: List[PronunciationRequest], stream: bool = False):
+    """批量分析发音 (并行处理; stream=true 时返回 NDJSON 流, 每行一个带 index 的结果)"""
+    return await run_batch(analyze_pronunciation, requests, stream)
 
 @app.post("/api/v1/batch/tts")
-async def batch_text_to_speech(requests: List[TextToSpeechRequest]):
-    """批量文本转语音"""
-    results = []
-    for req in requests:
-        try:
-            result = await text_to_speech(req)
-            results.append({"success": True, "data": result})
-        except Exception as e:
-            results.append({"success": False, "error": str(e)})
-    
-    return {"results": results}
+async def batch_text_to_speech(requests: List[TextToSpeechRequest], stream: bool = False):
+    """批量文本转语音 (并行处理; stream=true 时返回 NDJSON 流, 每行一个带 index 的结果)"""
+    return await run_batch(text_to_speech, requests, stream)
 
 if __name__ == "__main__":
     print("🚀 启动 AI发音训练器 FastAPI 服务器...")
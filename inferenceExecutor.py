@@ -0,0 +1,155 @@
+import asyncio
+import functools
+import os
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Iterator
+
+
+class ExecutorSaturatedError(RuntimeError):
+    pass
+
+
+class InferenceTimeoutError(TimeoutError):
+    pass
+
+
+class InferenceExecutor:
+    """Runs blocking inference calls in a bounded thread pool for async servers.
+
+    At most max_workers calls run at once and at most max_queue_size more wait
+    for a worker; submitting beyond that raises ExecutorSaturatedError right away
+    instead of queueing. Awaiting a call longer than its timeout raises
+    InferenceTimeoutError. A call that already started keeps its worker until it
+    finishes, as threads can't be interrupted. stream() keeps one worker for
+    all the items of an iterator.
+    """
+
+    def __init__(self, max_workers: int = 2, max_queue_size: int = 16, timeout: float = 60.):
+        self.max_workers = max_workers
+        self.max_queue_size = max_queue_size
+        self.timeout = timeout
+        self._executor = ThreadPoolExecutor(
+            max_workers, thread_name_prefix='inference')
+        self._lock = threading.Lock()
+        self._in_flight = 0
+        self._running = 0
+        self._rejected = 0
+        self._timed_out = 0
+
+    async def run(self, function, *args, timeout: float = None, **kwargs):
+        future = self._submit(
+            functools.partial(self._call, function, *args, **kwargs))
+        try:
+            return await asyncio.wait_for(asyncio.wrap_future(future), timeout or self.timeout)
+        except asyncio.TimeoutError:
+            self._countTimeout()
+            raise InferenceTimeoutError('Inference took too long')
+
+    def stream(self, iterator: Iterator, timeout: float = None) -> 'InferenceStream':
+        """Runs the whole iterator in one worker and returns its items as they
+        come. The slot is taken here, so a stream that was accepted is never
+        rejected half way; timeout applies to each item. Must be called from
+        the event loop."""
+        inference_stream = InferenceStream(
+            self, asyncio.get_running_loop(), timeout or self.timeout)
+        self._submit(functools.partial(
+            self._call, inference_stream._produce, iterator))
+        return inference_stream
+
+    def _submit(self, call) -> Future:
+        with self._lock:
+            if self._in_flight >= self.max_workers + self.max_queue_size:
+                self._rejected += 1
+                raise ExecutorSaturatedError('Inference queue is full')
+            self._in_flight += 1
+
+        # The slot is released when the call really ends, not when the caller stops waiting
+        future = self._executor.submit(call)
+        future.add_done_callback(self._release)
+        return future
+
+    def _countTimeout(self):
+        with self._lock:
+            self._timed_out += 1
+
+    def _call(self, function, *args, **kwargs):
+        with self._lock:
+            self._running += 1
+        try:
+            return function(*args, **kwargs)
+        finally:
+            with self._lock:
+                self._running -= 1
+
+    def _release(self, future):
+        with self._lock:
+            self._in_flight -= 1
+
+    def getQueueDepth(self) -> int:
+        with self._lock:
+            return self._in_flight - self._running
+
+    def getStats(self) -> dict:
+        with self._lock:
+            return {'max_workers': self.max_workers, 'max_queue_size': self.max_queue_size,
+                    'running': self._running, 'queued': self._in_flight - self._running,
+                    'rejected': self._rejected, 'timed_out': self._timed_out}
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+
+class InferenceStream:
+    """Items of an iterator that runs in an InferenceExecutor worker.
+
+    next() returns None once the iterator is exhausted and raises what the
+    iterator raised. close() makes the worker stop at the next item, e.g.
+    when the client went away.
+    """
+
+    def __init__(self, executor: InferenceExecutor, loop: asyncio.AbstractEventLoop, timeout: float):
+        self._executor = executor
+        self._loop = loop
+        self._timeout = timeout
+        self._items = asyncio.Queue()
+        self._closed = False
+
+    async def next(self):
+        try:
+            item, error = await asyncio.wait_for(self._items.get(), self._timeout)
+        except asyncio.TimeoutError:
+            self._executor._countTimeout()
+            raise InferenceTimeoutError('Inference took too long')
+        if error is not None:
+            raise error
+        return item
+
+    def close(self):
+        self._closed = True
+
+    def _produce(self, iterator: Iterator):
+        try:
+            for item in iterator:
+                if self._closed:
+                    return
+                self._put(item, None)
+        except Exception as e:
+            self._put(None, e)
+            return
+        self._put(None, None)
+
+    def _put(self, item, error):
+        try:
+            self._loop.call_soon_threadsafe(
+                self._items.put_nowait, (item, error))
+        except RuntimeError:
+            # The event loop is closed, nobody is reading any more
+            self._closed = True
+
+
+def getExecutorFromEnvironment() -> InferenceExecutor:
+    return InferenceExecutor(max_workers=int(os.environ.get('INFERENCE_WORKERS', 2)),
+                             max_queue_size=int(
+                                 os.environ.get('INFERENCE_QUEUE_SIZE', 16)),
+                             timeout=float(os.environ.get('INFERENCE_TIMEOUT', 60)))
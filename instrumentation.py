@@ -0,0 +1,166 @@
+"""Per-stage latency instrumentation, exported in the Prometheus text format.
+
+Code is timed with spans:
+
+    with instrumentation.span('asr'):
+        ...
+
+Inside instrumentation.trace(language) (one per request) the spans of each
+stage are summed and recorded once per request, under that language. The
+latest observations of every (stage, language) are kept to report p50/p95/p99.
+Other components register collectors for gauges and counters, e.g. queue
+depths and loaded models. renderPrometheus() is served on /metrics.
+"""
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Callable
+
+import numpy as np
+
+# Stages recorded by the servers: decode, resample, preprocess, asr, ipa,
+# word_alignment, letter_alignment, serialization, total (scoring requests),
+# tts and tts_first_audio (speech synthesis)
+quantiles = (0.5, 0.95, 0.99)
+window_size = 1024
+
+# With INSTRUMENTATION_LOG=1 the stage times of every request are printed
+log_traces = os.environ.get('INSTRUMENTATION_LOG', '0') == '1'
+
+current_trace = ContextVar('current_trace', default=None)
+
+
+class LatencyWindow:
+    """Count and sum of all observations, and the latest window_size of them for quantiles"""
+
+    def __init__(self, max_samples: int = window_size):
+        self.samples = deque(maxlen=max_samples)
+        self.count = 0
+        self.sum = 0.
+
+    def observe(self, seconds: float):
+        self.samples.append(seconds)
+        self.count += 1
+        self.sum += seconds
+
+    def getQuantiles(self) -> list:
+        if not self.samples:
+            return [float('nan')]*len(quantiles)
+        return list(np.quantile(np.fromiter(self.samples, dtype=np.float64), quantiles))
+
+
+class Metrics:
+    def __init__(self):
+        self._windows = {}
+        self._collectors = []
+        self._lock = threading.Lock()
+
+    def observe(self, stage: str, language: str, seconds: float):
+        with self._lock:
+            window = self._windows.get((stage, language))
+            if window is None:
+                window = self._windows[(stage, language)] = LatencyWindow()
+            window.observe(seconds)
+
+    def getLatencies(self) -> dict:
+        """{(stage, language): {'count', 'sum', 'p50', 'p95', 'p99'}}"""
+        with self._lock:
+            latencies = {}
+            for key, window in self._windows.items():
+                p50, p95, p99 = window.getQuantiles()
+                latencies[key] = {'count': window.count, 'sum': window.sum,
+                                  'p50': p50, 'p95': p95, 'p99': p99}
+            return latencies
+
+    def registerCollector(self, collector: Callable[[], list]):
+        """collector() returns a list of (name, type, help, [(labels, value), ...])"""
+        self._collectors.append(collector)
+
+    def renderPrometheus(self) -> str:
+        lines = ['# HELP pronunciation_stage_seconds Time spent per request in each processing stage',
+                 '# TYPE pronunciation_stage_seconds summary']
+        for (stage, language), latency in sorted(self.getLatencies().items()):
+            labels = {'stage': stage, 'language': language}
+            for quantile, key in zip(quantiles, ['p50', 'p95', 'p99']):
+                lines.append(formatSample('pronunciation_stage_seconds', dict(
+                    labels, quantile=str(quantile)), latency[key]))
+            lines.append(formatSample(
+                'pronunciation_stage_seconds_sum', labels, latency['sum']))
+            lines.append(formatSample(
+                'pronunciation_stage_seconds_count', labels, latency['count']))
+
+        for collector in self._collectors:
+            try:
+                families = collector()
+            except Exception as e:
+                print('Metrics collector failed: ', str(e))
+                continue
+            for name, metric_type, help_text, samples in families:
+                lines.append('# HELP ' + name + ' ' + help_text)
+                lines.append('# TYPE ' + name + ' ' + metric_type)
+                for labels, value in samples:
+                    lines.append(formatSample(name, labels, value))
+        return '\n'.join(lines) + '\n'
+
+
+def formatSample(name: str, labels: dict, value: float) -> str:
+    if labels:
+        name += '{' + ','.join(key + '="' + str(label).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') + '"'
+                               for key, label in labels.items()) + '}'
+    value = float(value)
+    if np.isnan(value):
+        return name + ' NaN'
+    if np.isinf(value):
+        return name + (' +Inf' if value > 0 else ' -Inf')
+    return name + ' ' + repr(value)
+
+
+metrics = Metrics()
+
+
+@contextmanager
+def trace(language: str = ''):
+    """Groups the spans of one request; yields the {stage: seconds} of the request"""
+    stages = {}
+    token = current_trace.set((language, stages))
+    try:
+        yield stages
+    finally:
+        current_trace.reset(token)
+        for stage, seconds in stages.items():
+            metrics.observe(stage, language, seconds)
+        if log_traces:
+            print('[' + language + '] ' + ', '.join(stage + ': %.3f s' %
+                  seconds for stage, seconds in stages.items()))
+
+
+@contextmanager
+def span(stage: str):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record(stage, time.perf_counter()-start)
+
+
+def record(stage: str, seconds: float):
+    request_trace = current_trace.get()
+    if request_trace is None:
+        metrics.observe(stage, '', seconds)
+    else:
+        stages = request_trace[1]
+        stages[stage] = stages.get(stage, 0.) + seconds
+
+
+def registerCollector(collector: Callable[[], list]):
+    metrics.registerCollector(collector)
+
+
+def renderPrometheus() -> str:
+    return metrics.renderPrometheus()
+
+
+prometheus_content_type = 'text/plain; version=0.0.4; charset=utf-8'
@@ -0,0 +1,201 @@
+import gc
+import os
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Callable, Dict, Optional
+
+import torch
+
+
+@dataclass(frozen=True)
+class ModelEvent:
+    action: str  # 'load' or 'evict'
+    kind: str
+    language: str
+    size_mb: float
+    load_time: float = 0.
+
+
+class ModelRegistry:
+    """Loads models per (kind, language) the first time they are requested.
+
+    loaders maps a kind ('trainer', 'tts'...) to a function building the model
+    of a language. At most max_resident models, using at most memory_budget_mb
+    of weights in total, stay loaded; the least recently used ones are evicted
+    first (the model just requested is never evicted). Listeners are called
+    with a ModelEvent on every load and eviction.
+    """
+
+    def __init__(self, loaders: Dict[str, Callable], max_resident: Optional[int] = None,
+                 memory_budget_mb: Optional[float] = None):
+        self.loaders = loaders
+        self.max_resident = max_resident
+        self.memory_budget_mb = memory_budget_mb
+        self.listeners = []
+
+        self._models = OrderedDict()
+        self._sizes = {}
+        self._tensors = {}
+        self._lock = threading.Lock()
+        self._loading_locks = {}
+        self._loading = set()
+
+    def get(self, kind: str, language: str):
+        key = (kind, language)
+        with self._lock:
+            if key in self._models:
+                self._models.move_to_end(key)
+                return self._models[key]
+            if kind not in self.loaders:
+                raise ValueError('Unknown model kind ' + kind)
+            loading_lock = self._loading_locks.setdefault(
+                key, threading.Lock())
+
+        # Concurrent requests for the same model wait for a single load
+        with loading_lock:
+            with self._lock:
+                if key in self._models:
+                    self._models.move_to_end(key)
+                    return self._models[key]
+
+            with self._lock:
+                self._loading.add(key)
+            start = time.time()
+            try:
+                model = self.loaders[kind](language)
+            finally:
+                with self._lock:
+                    self._loading.discard(key)
+            load_time = time.time()-start
+            tensors = getModelTensors(model)
+            size_mb = sum(tensors.values())/2**20
+
+            with self._lock:
+                self._models[key] = model
+                self._sizes[key] = size_mb
+                self._tensors[key] = tensors
+                evicted = self._evictOverBudget(key)
+
+        self._notify(ModelEvent('load', kind, language, size_mb, load_time))
+        for evicted_key, evicted_size in evicted:
+            self._notify(ModelEvent('evict', *evicted_key, evicted_size))
+        if evicted:
+            gc.collect()
+        return model
+
+    def preload(self, kinds_and_languages: list):
+        for kind, language in kinds_and_languages:
+            self.get(kind, language)
+
+    def evict(self, kind: str, language: str) -> bool:
+        with self._lock:
+            if (kind, language) not in self._models:
+                return False
+            del self._models[(kind, language)]
+            size_mb = self._sizes.pop((kind, language))
+            del self._tensors[(kind, language)]
+        self._notify(ModelEvent('evict', kind, language, size_mb))
+        gc.collect()
+        return True
+
+    def isLoaded(self, kind: str, language: str) -> bool:
+        with self._lock:
+            return (kind, language) in self._models
+
+    def getState(self) -> list:
+        """Resident models, least recently used first"""
+        with self._lock:
+            return [{'kind': kind, 'language': language, 'size_mb': self._sizes[(kind, language)]}
+                    for kind, language in self._models]
+
+    def getLoading(self) -> list:
+        """(kind, language) of the models being loaded right now"""
+        with self._lock:
+            return sorted(self._loading)
+
+    def addListener(self, listener: Callable[[ModelEvent], None]):
+        self.listeners.append(listener)
+
+    def _evictOverBudget(self, keep_key) -> list:
+        evicted = []
+        while len(self._models) > 1 and self._isOverBudget():
+            key = next(iter(self._models))
+            if key == keep_key:
+                break
+            del self._models[key]
+            del self._tensors[key]
+            evicted.append((key, self._sizes.pop(key)))
+        return evicted
+
+    def _isOverBudget(self) -> bool:
+        if self.max_resident is not None and len(self._models) > self.max_resident:
+            return True
+        return self.memory_budget_mb is not None and self._getResidentSize() > self.memory_budget_mb
+
+    def _getResidentSize(self) -> float:
+        # Models can share weights (e.g. one Whisper pipeline for all languages)
+        resident_tensors = {}
+        for tensors in self._tensors.values():
+            resident_tensors.update(tensors)
+        return sum(resident_tensors.values())/2**20
+
+    def _notify(self, event: ModelEvent):
+        for listener in self.listeners:
+            try:
+                listener(event)
+            except Exception as e:
+                print('Model event listener failed: ', str(e))
+
+
+def getModelTensors(model, max_depth: int = 4) -> dict:
+    """Bytes of the torch weights reachable from model through its attributes,
+    by tensor data pointer"""
+    modules = []
+    seen = set()
+
+    def collect(obj, depth):
+        if id(obj) in seen or depth > max_depth:
+            return
+        seen.add(id(obj))
+        if isinstance(obj, torch.nn.Module):
+            modules.append(obj)
+        elif isinstance(obj, (list, tuple)):
+            for item in obj:
+                collect(item, depth+1)
+        elif isinstance(obj, dict):
+            for item in obj.values():
+                collect(item, depth+1)
+        elif hasattr(obj, '__dict__'):
+            for item in vars(obj).values():
+                collect(item, depth+1)
+
+    collect(model, 0)
+
+    tensors = {}
+    for module in modules:
+        for tensor in list(module.parameters()) + list(module.buffers()):
+            tensors[tensor.data_ptr()] = tensor.numel()*tensor.element_size()
+    return tensors
+
+
+def printModelEvent(event: ModelEvent):
+    if event.action == 'load':
+        print('Loaded %s model for %s (%.0f MB) in %.1f s' % (
+            event.kind, event.language, event.size_mb, event.load_time))
+    else:
+        print('Evicted %s model for %s (%.0f MB)' %
+              (event.kind, event.language, event.size_mb))
+
+
+def getRegistryFromEnvironment(loaders: Dict[str, Callable]) -> ModelRegistry:
+    """Limits from MODEL_MAX_RESIDENT and MODEL_MEMORY_BUDGET_MB (unset: no limit)"""
+    max_resident = os.environ.get('MODEL_MAX_RESIDENT')
+    memory_budget_mb = os.environ.get('MODEL_MEMORY_BUDGET_MB')
+    registry = ModelRegistry(
+        loaders,
+        max_resident=int(max_resident) if max_resident else None,
+        memory_budget_mb=float(memory_budget_mb) if memory_budget_mb else None)
+    registry.addListener(printModelEvent)
+    return registry
@@ -2,61 +2,43 @@ import torch
 import torch.nn as nn
 import pickle
 from ModelInterfaces import IASRModel
-from AIModels import NeuralASR 
+from AIModels import NeuralASR, ASRModelPool
 
-def getASRModel(language: str,use_whisper:bool=True) -> IASRModel:
+silero_asr_languages = ['de', 'en', 'fr']
+tts_speakers = {'de': 'thorsten_v2', 'en': 'lj_v2'}  # 16 kHz silero v2 speakers
+
+def getASRModel(language: str,use_whisper:bool=True,batching:bool=False,replicas:int=1,shared_pipeline:bool=True) -> IASRModel:
+
+    if replicas > 1:
+        # Whisper pipelines are not thread-safe, each replica gets its own
+        return ASRModelPool([getASRModel(language, use_whisper, batching, shared_pipeline=False) for _ in range(replicas)])
 
     if use_whisper:
         from whisper_wrapper import WhisperASRModel
         # 根据语言参数传递正确的语言代码
-        return WhisperASRModel(language=language)
+        return WhisperASRModel(language=language, batching=batching, shared_pipeline=shared_pipeline)
     
-    if language == 'de':
-
-        model, decoder, utils = torch.hub.load(repo_or_dir='snakers4/silero-models',
-                                               model='silero_stt',
-                                               language='de',
-                                               device=torch.device('cpu'))
-        model.eval()
-        return NeuralASR(model, decoder)
-
-    elif language == 'en':
-        model, decoder, utils = torch.hub.load(repo_or_dir='snakers4/silero-models',
-                                               model='silero_stt',
-                                               language='en',
-                                               device=torch.device('cpu'))
-        model.eval()
-        return NeuralASR(model, decoder)
-    elif language == 'fr':
-        model, decoder, utils = torch.hub.load(repo_or_dir='snakers4/silero-models',
-                                               model='silero_stt',
-                                               language='fr',
-                                               device=torch.device('cpu'))
-        model.eval()
-        return NeuralASR(model, decoder)
-    else:
+    if language not in silero_asr_languages:
         raise ValueError('Language not implemented')
 
+    model, decoder, utils = torch.hub.load(repo_or_dir='snakers4/silero-models',
+                                           model='silero_stt',
+                                           language=language,
+                                           device=torch.device('cpu'))
+    model.eval()
+    return NeuralASR(model, decoder)
 
-def getTTSModel(language: str) -> nn.Module:
-
-    if language == 'de':
 
-        speaker = 'thorsten_v2'  # 16 kHz
-        model, _ = torch.hub.load(repo_or_dir='snakers4/silero-models',
-                                  model='silero_tts',
-                                  language=language,
-                                  speaker=speaker)
+def getTTSModel(language: str) -> nn.Module:
 
-    elif language == 'en':
-        speaker = 'lj_16khz'  # 16 kHz
-        model = torch.hub.load(repo_or_dir='snakers4/silero-models',
-                               model='silero_tts',
-                               language=language,
-                               speaker=speaker)
-    else:
+    if language not in tts_speakers:
         raise ValueError('Language not implemented')
 
+    # v2 speakers return (model, example_text), the model has apply_tts
+    model, _ = torch.hub.load(repo_or_dir='snakers4/silero-models',
+                              model='silero_tts',
+                              language=language,
+                              speaker=tts_speakers[language])
     return model
 
 
@@ -0,0 +1,195 @@
+"""Production launcher: load the models once, then fork workers that share them.
+
+The parent process imports the server, loads the models listed in --preload
+through the model registry (other languages are loaded lazily by each worker
+on first use), freezes the loaded objects out of the garbage collector
+and forks the workers. The model weights are then shared copy-on-write between
+all workers instead of being loaded once per process. Every worker serves the
+same listening socket with its own uvicorn server.
+
+Usage (Linux/macOS, fork is required):
+    python preforkServer.py --app fastapi --workers 4 --torch-threads 2
+
+The Flask server is served through uvicorn's WSGI adapter with --app flask.
+The parent restarts workers that die and prints the RSS/PSS of every worker
+every --report-interval seconds (PSS splits shared pages between processes,
+so it shows how much memory each worker really adds).
+"""
+import argparse
+import gc
+import os
+import signal
+import socket
+import sys
+import time
+
+import uvicorn
+
+
+def loadApplication(app_name: str):
+    if app_name == 'fastapi':
+        import fastapi_server
+        return fastapi_server.app
+
+    import webApp
+    from uvicorn.middleware.wsgi import WSGIMiddleware
+    return WSGIMiddleware(webApp.app)
+
+
+def preloadModels(models_to_load: str):
+    """models_to_load is a comma separated list of kind:language, e.g. trainer:de,tts:de"""
+    import pronunciationService
+    kinds_and_languages = [tuple(item.strip().split(':'))
+                           for item in models_to_load.split(',') if item.strip()]
+    pronunciationService.model_registry.preload(kinds_and_languages)
+    # The sentence indexes are shared with the workers like the models
+    pronunciationService.loadSampleDatabases()
+
+
+def createSocket(host: str, port: int) -> socket.socket:
+    sock = socket.socket(socket.AF_INET6 if ':' in host else socket.AF_INET)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(2048)
+    sock.set_inheritable(True)
+    return sock
+
+
+def getMemoryUsage(pid: int) -> dict:
+    """RSS, PSS and shared memory of a process in MB, read from /proc"""
+    usage = {}
+    try:
+        with open('/proc/%d/smaps_rollup' % pid) as f:
+            for line in f:
+                fields = line.split()
+                if fields[0] in ('Rss:', 'Pss:', 'Shared_Clean:', 'Shared_Dirty:'):
+                    usage[fields[0][:-1]] = int(fields[1])/1024
+    except (FileNotFoundError, ProcessLookupError, PermissionError):
+        return {}
+    usage['Shared'] = usage.pop('Shared_Clean', 0) + \
+        usage.pop('Shared_Dirty', 0)
+    return usage
+
+
+def printMemoryReport(worker_pids: list):
+    total_pss = 0.
+    for pid in [os.getpid()] + worker_pids:
+        usage = getMemoryUsage(pid)
+        if not usage:
+            continue
+        total_pss += usage['Pss']
+        print('[prefork] %s %d: RSS %.0f MB, PSS %.0f MB, shared %.0f MB' % (
+            'parent' if pid == os.getpid() else 'worker', pid,
+            usage['Rss'], usage['Pss'], usage['Shared']))
+    print('[prefork] total PSS: %.0f MB' % total_pss)
+
+
+def runWorker(app, sock: socket.socket, torch_threads: int):
+    import torch
+    torch.set_num_threads(torch_threads)
+
+    # The parent's handlers forward signals to the workers, restore the defaults
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    signal.signal(signal.SIGINT, signal.SIG_DFL)
+
+    config = uvicorn.Config(app, log_level='info')
+    server = uvicorn.Server(config)
+    server.run(sockets=[sock])
+
+
+def forkWorker(app, sock: socket.socket, torch_threads: int) -> int:
+    pid = os.fork()
+    if pid == 0:
+        exit_code = 0
+        try:
+            runWorker(app, sock, torch_threads)
+        except BaseException as e:
+            print('[prefork] worker %d failed: %s' % (os.getpid(), e))
+            exit_code = 1
+        finally:
+            os._exit(exit_code)
+    return pid
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Serve the pronunciation trainer from pre-forked workers sharing one copy of the models')
+    parser.add_argument('--app', choices=['fastapi', 'flask'], default='fastapi')
+    parser.add_argument('--host', default='0.0.0.0')
+    parser.add_argument('--port', type=int, default=None,
+                        help='Defaults to 8000 for fastapi and 3000 for flask')
+    parser.add_argument('--workers', type=int,
+                        default=int(os.environ.get('WORKERS', 2)))
+    parser.add_argument('--torch-threads', type=int,
+                        default=int(os.environ.get('TORCH_THREADS', 1)),
+                        help='torch intra-op threads per worker')
+    parser.add_argument('--preload',
+                        default=os.environ.get('PRELOAD_MODELS', 'trainer:de,trainer:en,tts:de'),
+                        help='Models loaded before forking, as kind:language,...')
+    parser.add_argument('--report-interval', type=float, default=60.,
+                        help='Seconds between memory reports, 0 to disable')
+    args = parser.parse_args()
+
+    if not hasattr(os, 'fork'):
+        sys.exit('preforkServer.py needs os.fork, run webApp.py or fastapi_server.py instead')
+    port = args.port or (8000 if args.app == 'fastapi' else 3000)
+
+    # Keep the parent single-threaded for torch, OpenMP pools don't survive fork
+    import torch
+    torch.set_num_threads(1)
+
+    start = time.time()
+    app = loadApplication(args.app)
+    preloadModels(args.preload)
+    print('[prefork] models loaded in %.1f s' % (time.time()-start))
+
+    # Objects that survive collection are moved out of the collector's reach, so
+    # that collections in the workers don't write to (and copy) the shared pages
+    gc.collect()
+    gc.freeze()
+
+    sock = createSocket(args.host, port)
+    worker_pids = [forkWorker(app, sock, args.torch_threads)
+                   for _ in range(args.workers)]
+    print('[prefork] %d workers serving http://%s:%d' %
+          (args.workers, args.host, port))
+
+    stopping = False
+
+    def stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+        for pid in worker_pids:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+
+    last_report = time.time()
+    while worker_pids:
+        try:
+            pid, status = os.waitpid(-1, os.WNOHANG)
+        except ChildProcessError:
+            break
+        if pid:
+            worker_pids.remove(pid)
+            if not stopping:
+                print('[prefork] worker %d exited with status %d, restarting' %
+                      (pid, os.waitstatus_to_exitcode(status)))
+                time.sleep(1)
+                worker_pids.append(forkWorker(app, sock, args.torch_threads))
+            continue
+
+        if args.report_interval > 0 and time.time() - last_report >= args.report_interval:
+            printMemoryReport(worker_pids)
+            last_report = time.time()
+        time.sleep(0.5)
+
+    sock.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,471 @@
+"""In-process service used by the web servers and the lambda handlers.
+
+The servers call scorePronunciation, getSample, synthesizeSpeech and
+streamSpeech directly with typed requests; only the lambda handlers translate JSON events.
+"""
+import base64
+import os
+import random
+import re
+import sys
+import threading
+import time
+from dataclasses import dataclass, asdict
+from typing import Iterator
+
+import numpy as np
+import torch
+
+import AIModels
+import audioDecoder
+import buildDatabases
+import instrumentation
+import modelRegistry
+import models
+import pronunciationTrainer
+import ttsCache
+import utilsFileIO
+import WordMatching as wm
+
+
+# ======================== Requests and results ========================
+
+@dataclass(slots=True)
+class ScoreRequest:
+    real_text: str
+    audio: bytes  # Encoded recording (OGG, WAV, WebM...)
+    language: str = 'de'
+
+
+@dataclass(slots=True)
+class ScoreResult:
+    pronunciation_accuracy: str = '0'
+    ipa_transcript: str = ''
+    real_transcripts_ipa: str = ''
+    matched_transcripts_ipa: str = ''
+    pair_accuracy_category: str = ''
+    is_letter_correct_all_words: str = ''
+    start_time: str = ''
+    end_time: str = ''
+    real_transcript: str = ''
+    real_transcripts: str = ''
+    matched_transcripts: str = ''
+
+    def toDict(self) -> dict:
+        return asdict(self)
+
+
+@dataclass(slots=True)
+class SampleRequest:
+    category: int = 0
+    language: str = 'de'
+
+
+@dataclass(slots=True)
+class SampleResult:
+    real_transcript: str
+    ipa_transcript: str
+    transcript_translation: str = ''
+
+    def toDict(self) -> dict:
+        # The front end expects the sentence wrapped in a list
+        return {'real_transcript': [self.real_transcript],
+                'ipa_transcript': self.ipa_transcript,
+                'transcript_translation': self.transcript_translation}
+
+
+@dataclass(slots=True)
+class TTSRequest:
+    text: str
+    language: str = 'de'
+    speed: float = 1.0  # Part of the cache key, the silero models only speak at 1.0
+    audio_format: str = 'wav'  # 'wav' or 'opus'
+
+
+@dataclass(slots=True)
+class TTSResult:
+    audio: bytes  # Encoded in audio_format
+    audio_format: str = 'wav'
+    from_cache: bool = False
+
+    def getMimeType(self) -> str:
+        return ttsCache.audio_formats[self.audio_format][2]
+
+    def toBase64(self) -> str:
+        return base64.b64encode(self.audio).decode('ascii')
+
+    def toDataUrl(self) -> str:
+        return 'data:' + self.getMimeType() + ';base64,' + self.toBase64()
+
+
+def decodeBase64Audio(base64_audio: str) -> bytes:
+    """Decodes base64 audio, with or without a 'data:audio/...;base64,' prefix"""
+    if base64_audio.startswith('data:'):
+        base64_audio = base64_audio[base64_audio.find(',')+1:]
+    return base64.b64decode(base64_audio)
+
+
+# ======================== Models ========================
+
+# With ASR_BATCHING=1, concurrent requests are transcribed in Whisper micro-batches
+asr_batching = os.environ.get('ASR_BATCHING', '0') == '1'
+
+tts_sampling_rate = 16000
+
+
+def loadTrainer(language: str) -> pronunciationTrainer.PronunciationTrainer:
+    return pronunciationTrainer.getTrainer(language, asr_batching=asr_batching)
+
+
+def loadTTS(language: str) -> AIModels.NeuralTTS:
+    return AIModels.NeuralTTS(models.getTTSModel(language), tts_sampling_rate)
+
+
+def loadTranslator(language: str) -> AIModels.NeuralTranslator:
+    return AIModels.NeuralTranslator(*models.getTranslationModel(language))
+
+
+# Models are loaded on the first request of their language, see modelRegistry.py
+model_registry = modelRegistry.getRegistryFromEnvironment({
+    'trainer': loadTrainer,
+    'tts': loadTTS,
+    'translation': loadTranslator,
+})
+
+model_event_counts = {}
+
+
+def countModelEvent(event: modelRegistry.ModelEvent):
+    key = (event.action, event.kind, event.language)
+    model_event_counts[key] = model_event_counts.get(key, 0) + 1
+
+
+model_registry.addListener(countModelEvent)
+
+
+def collectServiceMetrics() -> list:
+    """Model, TTS cache and ASR batching state for /metrics"""
+    model_states = [({'kind': model['kind'], 'language': model['language'], 'state': 'loaded'}, 1)
+                    for model in model_registry.getState()]
+    model_states += [({'kind': kind, 'language': language, 'state': 'loading'}, 1)
+                     for kind, language in model_registry.getLoading()]
+    model_sizes = [({'kind': model['kind'], 'language': model['language']}, model['size_mb']*2**20)
+                   for model in model_registry.getState()]
+    model_events = [({'action': action, 'kind': kind, 'language': language}, count)
+                    for (action, kind, language), count in list(model_event_counts.items())]
+
+    tts_cache_stats = tts_cache.getStats()
+    tts_cache_lookups = [({'result': result}, tts_cache_stats[result])
+                         for result in ['memory_hits', 'disk_hits', 'misses']]
+
+    # Only once a Whisper model was loaded, scraping shouldn't import transformers
+    whisper_wrapper = sys.modules.get('whisper_wrapper')
+    whisper_backends = whisper_wrapper.whisper_backends if whisper_wrapper else {}
+    asr_queue_depths = [({'model': model_name}, backend.batch_scheduler.getMetrics()['pending'])
+                        for model_name, backend in list(whisper_backends.items())
+                        if backend.batch_scheduler is not None]
+
+    return [('pronunciation_model_state', 'gauge', 'Models being loaded or resident', model_states),
+            ('pronunciation_model_size_bytes', 'gauge', 'Weights of the resident models', model_sizes),
+            ('pronunciation_model_events_total', 'counter', 'Model loads and evictions', model_events),
+            ('pronunciation_tts_cache_lookups_total', 'counter', 'TTS cache lookups by result', tts_cache_lookups),
+            ('pronunciation_tts_cache_memory_bytes', 'gauge', 'Encoded audio in the TTS memory cache',
+             [({}, tts_cache_stats['memory_mb']*2**20)]),
+            ('pronunciation_asr_batch_queue_depth', 'gauge', 'Requests waiting for a Whisper batch', asr_queue_depths)]
+
+
+# ======================== Pronunciation scoring ========================
+
+
+def scorePronunciation(request: ScoreRequest) -> ScoreResult:
+    """Scores a recording against request.real_text. Failures give an empty result"""
+
+    if len(request.real_text) == 0:
+        return ScoreResult()
+
+    with instrumentation.trace(request.language), instrumentation.span('total'):
+        return scoreRecording(request)
+
+
+def scoreRecording(request: ScoreRequest) -> ScoreResult:
+    try:
+        try:
+            signal = audioDecoder.decodeAudio(request.audio)
+        except audioDecoder.AudioDecodingError as e:
+            print(f"Audio decoding failed: {e}")
+            return ScoreResult()
+
+        if len(signal) == 0:
+            print("Warning: Empty audio signal after decoding")
+            return ScoreResult()
+
+        signal = torch.from_numpy(signal).unsqueeze(0)
+
+        result = model_registry.get('trainer', request.language).processAudioForGivenText(
+            signal, request.real_text)
+
+    except Exception as e:
+        print(f"Error processing audio: {e}")
+        return ScoreResult()
+
+    real_transcripts = ' '.join(
+        [word[0] for word in result['real_and_transcribed_words']])
+    matched_transcripts = ' '.join(
+        [word[1] for word in result['real_and_transcribed_words']])
+
+    with instrumentation.span('letter_alignment'):
+        letters_correctness = wm.get_letters_correctness(
+            real_transcripts.lower().split(), matched_transcripts.split())
+
+    with instrumentation.span('serialization'):
+        real_transcripts_ipa = ' '.join(
+            [word[0] for word in result['real_and_transcribed_words_ipa']])
+        matched_transcripts_ipa = ' '.join(
+            [word[1] for word in result['real_and_transcribed_words_ipa']])
+
+        is_letter_correct_all_words = ''
+        for is_letter_correct in letters_correctness:
+            is_letter_correct_all_words += ''.join([str(is_correct)
+                                                    for is_correct in is_letter_correct]) + ' '
+
+        pair_accuracy_category = ' '.join(
+            [str(category) for category in result['pronunciation_categories']])
+
+        return ScoreResult(
+            pronunciation_accuracy=str(int(result['pronunciation_accuracy'])),
+            ipa_transcript=result['recording_ipa'],
+            real_transcripts_ipa=real_transcripts_ipa,
+            matched_transcripts_ipa=matched_transcripts_ipa,
+            pair_accuracy_category=pair_accuracy_category,
+            is_letter_correct_all_words=is_letter_correct_all_words,
+            start_time=result['start_time'],
+            end_time=result['end_time'],
+            real_transcript=result['recording_transcript'],
+            real_transcripts=real_transcripts,
+            matched_transcripts=matched_transcripts)
+
+
+# ======================== Sentence samples ========================
+
+class TextDataset():
+    """Sentences of one language and their IPA, read from the packed stores.
+
+    load() memory-maps both stores, building them from the csv database first
+    if they don't exist yet, and builds the SentenceIndex of the sentences, so
+    that a sample request only looks rows up.
+    """
+
+    def __init__(self, language: str):
+        self.language = language
+        self.sentences = None
+        self.sentences_ipa = None
+        self.index = None
+
+    def load(self):
+        with sample_database_lock:
+            if self.sentences is None:
+                store_path = buildDatabases.getSentenceStorePath(self.language)
+                if not os.path.exists(store_path):
+                    buildDatabases.buildSentenceStore(self.language)
+                sentences = utilsFileIO.PackedStrings(store_path)
+
+                ipa_store_path = buildDatabases.getSentenceIpaStorePath(
+                    self.language)
+                sentences_ipa = utilsFileIO.PackedStrings(
+                    ipa_store_path) if os.path.exists(ipa_store_path) else None
+                # A store left from an older database has a different number of rows
+                if sentences_ipa is None or len(sentences_ipa) != len(sentences):
+                    sentences_ipa = None  # Windows can't replace a mapped file
+                    buildDatabases.buildSentenceIpaStore(self.language)
+                    sentences_ipa = utilsFileIO.PackedStrings(ipa_store_path)
+                self.sentences_ipa = sentences_ipa
+
+                self.index = SentenceIndex(sentences)
+                self.sentences = sentences
+        return self.sentences
+
+    def getIpa(self, idx) -> str:
+        self.load()
+        return self.sentences_ipa[idx]
+
+    def __getitem__(self, idx):
+
+        line = [self.load()[idx]]
+        return line
+
+    def __len__(self):
+        return len(self.load())
+
+
+class SentenceIndex():
+    """Row ids of a list of sentences bucketed by difficulty category, for O(1)
+    sampling.
+
+    Category 0 holds every row. The word count of every row is kept next to it.
+    """
+
+    def __init__(self, sentences):
+        self.word_counts = np.zeros(len(sentences), dtype=np.int32)
+        sentence_categories = np.zeros(len(sentences), dtype=np.int32)
+        for idx in range(len(sentences)):
+            sentence = sentences[idx]
+            self.word_counts[idx] = len(sentence.split())
+            sentence_categories[idx] = getSentenceCategory(sentence) or 0
+
+        self.rows_in_category = {0: np.arange(len(sentences), dtype=np.int32)}
+        for category in range(1, len(categories_word_limits)):
+            self.rows_in_category[category] = np.flatnonzero(
+                sentence_categories == category).astype(np.int32)
+
+    def sample(self, category: int) -> int:
+        rows = self.rows_in_category.get(category)
+        if rows is None or len(rows) == 0:
+            raise ValueError('No sentences in category ' + str(category))
+        return int(rows[random.randrange(len(rows))])
+
+
+sample_database = {}
+sample_database_lock = threading.RLock()
+available_languages = ['de', 'en']
+categories_word_limits = [0, 8, 20, 100000]
+
+for language in available_languages:
+    sample_database[language] = TextDataset(language)
+
+
+def loadSampleDatabases(languages: list = available_languages):
+    """Loads the datasets up front, the servers call it at startup so that the
+    first sample request doesn't read the databases (importing this module doesn't)"""
+    for language in languages:
+        sample_database[language].load()
+
+
+def getSentenceIndex(language: str) -> SentenceIndex:
+    dataset = sample_database[language]
+    dataset.load()
+    return dataset.index
+
+
+def getSentenceCategory(sentence) -> int:
+    number_of_words = len(sentence.split())
+    for category in range(len(categories_word_limits)-1):
+        if number_of_words > categories_word_limits[category] and number_of_words <= categories_word_limits[category+1]:
+            return category+1
+
+
+def getSample(request: SampleRequest) -> SampleResult:
+    dataset = sample_database[request.language]
+    sample_idx = getSentenceIndex(request.language).sample(request.category)
+
+    return SampleResult(
+        real_transcript=dataset[sample_idx][0],
+        ipa_transcript=dataset.getIpa(sample_idx))
+
+
+# ======================== Text to speech ========================
+
+tts_linear_factor = 0.2
+tts_cache = ttsCache.getCacheFromEnvironment()
+instrumentation.registerCollector(collectServiceMetrics)
+
+
+def getTTSCacheKey(request: TTSRequest) -> str:
+    return ttsCache.getCacheKey(request.language, models.tts_speakers.get(request.language, ''),
+                                request.text, request.speed)
+
+
+def synthesizeSpeech(request: TTSRequest) -> TTSResult:
+    """Encoded speech for request.text, synthesized only if it isn't cached yet"""
+    if request.audio_format not in ttsCache.audio_formats:
+        raise ValueError('Unsupported audio format ' + request.audio_format)
+
+    cache_key = getTTSCacheKey(request)
+    audio_bytes = tts_cache.get(cache_key, request.audio_format)
+    if audio_bytes is not None:
+        return TTSResult(audio_bytes, request.audio_format, from_cache=True)
+
+    with instrumentation.trace(request.language), instrumentation.span('tts'):
+        audio_bytes = ttsCache.encodeAudio(
+            synthesizeAudio(request), tts_sampling_rate, request.audio_format)
+    tts_cache.put(cache_key, request.audio_format, audio_bytes)
+    return TTSResult(audio_bytes, request.audio_format)
+
+
+def synthesizeAudio(request: TTSRequest) -> np.ndarray:
+    tts_model = model_registry.get('tts', request.language)
+    return tts_model.getAudioFromSentence(request.text).detach().numpy()*tts_linear_factor
+
+
+def prerenderSpeech(text: str, language: str, audio_formats: list) -> int:
+    """Synthesizes text once into every audio format it is not cached in yet.
+    Returns the number of formats added to the cache."""
+    request = TTSRequest(text, language)
+    cache_key = getTTSCacheKey(request)
+    missing_formats = [audio_format for audio_format in audio_formats
+                       if not tts_cache.contains(cache_key, audio_format)]
+    if missing_formats:
+        audio = synthesizeAudio(request)
+        for audio_format in missing_formats:
+            tts_cache.put(cache_key, audio_format, ttsCache.encodeAudio(
+                audio, tts_sampling_rate, audio_format))
+    return len(missing_formats)
+
+
+# Segments shorter than this are merged with the next one, very short
+# utterances sound clipped
+tts_min_segment_characters = 20
+tts_stream_formats = ['wav', 'pcm']
+
+
+def splitIntoSegments(text: str, min_segment_characters: int = tts_min_segment_characters) -> list:
+    """Splits text after sentence and clause punctuation"""
+    segments = []
+    current_segment = ''
+    for piece in re.split(r'(?<=[.!?;:,])\s+', text.strip()):
+        current_segment = (current_segment + ' ' + piece).strip()
+        if len(current_segment) >= min_segment_characters:
+            segments.append(current_segment)
+            current_segment = ''
+    if current_segment:
+        segments.append(current_segment)
+    return segments
+
+
+def getStreamMimeType(audio_format: str) -> str:
+    if audio_format == 'pcm':
+        return 'audio/L16;rate=' + str(tts_sampling_rate) + ';channels=1'
+    return 'audio/wav'
+
+
+def streamSpeech(request: TTSRequest) -> Iterator[bytes]:
+    """Speech for request.text as audio chunks, one per sentence or clause.
+
+    Segments are synthesized (or read from the TTS cache) one after another, so
+    the first chunk is ready long before the whole text is. With the 'wav'
+    format the first chunk starts with a WAV header of unknown length, with
+    'pcm' the chunks are bare 16-bit samples.
+    """
+    if request.audio_format not in tts_stream_formats:
+        raise ValueError('Unsupported stream format ' + request.audio_format)
+    return generateSpeechChunks(request)
+
+
+def generateSpeechChunks(request: TTSRequest) -> Iterator[bytes]:
+    start = time.perf_counter()
+    header = ttsCache.getStreamingWavHeader(
+        tts_sampling_rate) if request.audio_format == 'wav' else b''
+
+    segments = splitIntoSegments(request.text)
+    if not segments:
+        yield header
+        return
+
+    for index, segment in enumerate(segments):
+        audio_bytes = synthesizeSpeech(TTSRequest(
+            segment, request.language, request.speed, 'pcm')).audio
+        if index == 0:
+            # The latency that matters for streaming: when playback can start
+            instrumentation.metrics.observe(
+                'tts_first_audio', request.language, time.perf_counter()-start)
+            audio_bytes = header + audio_bytes
+        yield audio_bytes
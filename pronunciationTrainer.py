@@ -9,20 +9,15 @@ import ModelInterfaces as mi
 import AIModels
 import RuleBasedModels
 from string import punctuation
-import time
+import instrumentation
 
 
-def getTrainer(language: str):
+def getTrainer(language: str, ipa_cache_path: str = None, asr_batching: bool = False):
 
-    asr_model = mo.getASRModel(language,use_whisper=True)
-    
-    if language == 'de':
-        phonem_converter = RuleBasedModels.EpitranPhonemConverter(
-            epitran.Epitran('deu-Latn'))
-    elif language == 'en':
-        phonem_converter = RuleBasedModels.EngPhonemConverter()
-    else:
-        raise ValueError('Language not implemented')
+    asr_model = mo.getASRModel(language,use_whisper=True,batching=asr_batching)
+
+    phonem_converter = RuleBasedModels.get_phonem_converter(
+        language, cache_path=ipa_cache_path)
 
     trainer = PronunciationTrainer(
         asr_model, phonem_converter)
@@ -31,14 +26,8 @@ def getTrainer(language: str):
 
 
 class PronunciationTrainer:
-    current_transcript: str
-    current_ipa: str
-
-    current_recorded_audio: torch.Tensor
-    current_recorded_transcript: str
-    current_recorded_word_locations: list
-    current_recorded_intonations: torch.tensor
-    current_words_pronunciation_accuracy = []
+    """Scores recordings against a text. Holds no per-request state, so one
+    trainer can serve concurrent requests if its ASR model can."""
     categories_thresholds = np.array([80, 60, 59])
 
     sampling_rate = 16000
@@ -47,10 +36,10 @@ class PronunciationTrainer:
         self.asr_model = asr_model
         self.ipa_converter = word_to_ipa_coverter
 
-    def getTranscriptAndWordsLocations(self, audio_length_in_samples: int):
+    def getTranscriptAndWordsLocations(self, asr_result: mi.ASRResult, audio_length_in_samples: int):
 
-        audio_transcript = self.asr_model.getTranscript()
-        word_locations_in_samples = self.asr_model.getWordLocations()
+        audio_transcript = asr_result.transcript
+        word_locations_in_samples = asr_result.word_locations
 
         fade_duration_in_samples = 0.05*self.sampling_rate
         word_locations_in_samples = [(int(np.maximum(0, word['start_ts']-fade_duration_in_samples)), int(np.minimum(
@@ -77,15 +66,11 @@ class PronunciationTrainer:
 
     def processAudioForGivenText(self, recordedAudio: torch.Tensor = None, real_text=None):
 
-        start = time.time()
         recording_transcript, recording_ipa, word_locations = self.getAudioTranscript(
             recordedAudio)
-        print('Time for NN to transcript audio: ', str(time.time()-start))
 
-        start = time.time()
         real_and_transcribed_words, real_and_transcribed_words_ipa, mapped_words_indices = self.matchSampleAndRecordedWords(
             real_text, recording_transcript)
-        print('Time for matching transcripts: ', str(time.time()-start))
 
         start_time, end_time = self.getWordLocationsFromRecordInSeconds(
             word_locations, mapped_words_indices)
@@ -107,15 +92,18 @@ class PronunciationTrainer:
     def getAudioTranscript(self, recordedAudio: torch.Tensor = None):
         current_recorded_audio = recordedAudio
 
-        current_recorded_audio = self.preprocessAudio(
-            current_recorded_audio)
+        with instrumentation.span('preprocess'):
+            current_recorded_audio = self.preprocessAudio(
+                current_recorded_audio)
 
-        self.asr_model.processAudio(current_recorded_audio)
+        with instrumentation.span('asr'):
+            asr_result = self.asr_model.transcribeAudio(current_recorded_audio)
 
         current_recorded_transcript, current_recorded_word_locations = self.getTranscriptAndWordsLocations(
-            current_recorded_audio.shape[1])
-        current_recorded_ipa = self.ipa_converter.convertToPhonem(
-            current_recorded_transcript)
+            asr_result, current_recorded_audio.shape[1])
+        with instrumentation.span('ipa'):
+            current_recorded_ipa = self.ipa_converter.convertToPhonem(
+                current_recorded_transcript)
 
         return current_recorded_transcript, current_recorded_ipa, current_recorded_word_locations
 
@@ -136,22 +124,23 @@ class PronunciationTrainer:
         words_estimated = recorded_transcript.split()
 
         if real_text is None:
-            words_real = self.current_transcript[0].split()
-        else:
-            words_real = real_text.split()
+            raise ValueError('The text to compare the recording with is missing')
+        words_real = real_text.split()
 
-        mapped_words, mapped_words_indices = wm.get_best_mapped_words(
-            words_estimated, words_real)
+        with instrumentation.span('word_alignment'):
+            mapped_words, mapped_words_indices = wm.get_best_mapped_words(
+                words_estimated, words_real)
 
         real_and_transcribed_words = []
         real_and_transcribed_words_ipa = []
-        for word_idx in range(len(words_real)):
-            if word_idx >= len(mapped_words)-1:
-                mapped_words.append('-')
-            real_and_transcribed_words.append(
-                (words_real[word_idx],    mapped_words[word_idx]))
-            real_and_transcribed_words_ipa.append((self.ipa_converter.convertToPhonem(words_real[word_idx]),
-                                                   self.ipa_converter.convertToPhonem(mapped_words[word_idx])))
+        with instrumentation.span('ipa'):
+            for word_idx in range(len(words_real)):
+                if word_idx >= len(mapped_words)-1:
+                    mapped_words.append('-')
+                real_and_transcribed_words.append(
+                    (words_real[word_idx],    mapped_words[word_idx]))
+                real_and_transcribed_words_ipa.append((self.ipa_converter.convertToPhonem(words_real[word_idx]),
+                                                       self.ipa_converter.convertToPhonem(mapped_words[word_idx])))
         return real_and_transcribed_words, real_and_transcribed_words_ipa, mapped_words_indices
 
     def getPronunciationAccuracy(self, real_and_transcribed_words_ipa) -> float:
@@ -161,7 +150,7 @@ class PronunciationTrainer:
         for pair in real_and_transcribed_words_ipa:
 
             real_without_punctuation = self.removePunctuation(pair[0]).lower()
-            number_of_word_mismatches = WordMetrics.edit_distance_python(
+            number_of_word_mismatches = WordMetrics.edit_distance(
                 real_without_punctuation, self.removePunctuation(pair[1]).lower())
             total_mismatches += number_of_word_mismatches
             number_of_phonemes_in_word = len(real_without_punctuation)
@@ -191,6 +180,9 @@ class PronunciationTrainer:
         return np.argmin(abs(self.categories_thresholds-accuracy))
 
     def preprocessAudio(self, audio: torch.tensor) -> torch.tensor:
-        audio = audio-torch.mean(audio)
-        audio = audio/torch.max(torch.abs(audio))
+        # Normalized in place, so the buffer shared with the decoder is not copied
+        audio -= torch.mean(audio)
+        peak = torch.maximum(torch.amax(audio), -torch.amin(audio))
+        if peak > 0:
+            audio /= peak
         return audio
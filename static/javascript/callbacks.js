@@ -33,6 +33,9 @@ let AILanguage = "de"; // Standard is German
 let STScoreAPIKey = 'rll5QsTiv83nti99BW6uCmvs9BDVxSB39SVFceYb'; // Public Key. If, for some reason, you would like a private one, send-me a message and we can discuss some possibilities
 let apiMainPathSample = 'http://127.0.0.1:3000';// 'http://127.0.0.1:3000';// 'https://a3hj0l2j2m.execute-api.eu-central-1.amazonaws.com/Prod';
 let apiMainPathSTS = 'http://127.0.0.1:3000';// 'https://wrg7ayuv7i.execute-api.eu-central-1.amazonaws.com/Prod';
+// Recordings are posted as raw bytes to the local servers. The AWS Lambda deployment
+// above only accepts the base64 JSON body, set this to false when using it
+let uploadRawAudio = true;
 
 
 // Variables to playback accuracy sounds
@@ -298,10 +301,14 @@ const mediaStreamConstraints = {
 }
 
 
+// The server reads OGG/Opus in memory; browsers that can't record it (Chrome) send WebM
+const recordingMimeType = 'audio/ogg;codecs=opus';
+
 const startMediaDevice = () => {
     navigator.mediaDevices.getUserMedia(mediaStreamConstraints).then(_stream => {
         stream = _stream
-        mediaRecorder = new MediaRecorder(stream);
+        const recorderOptions = MediaRecorder.isTypeSupported(recordingMimeType) ? { mimeType: recordingMimeType } : {};
+        mediaRecorder = new MediaRecorder(stream, recorderOptions);
 
         let currentSamples = 0
         mediaRecorder.ondataavailable = event => {
@@ -317,15 +324,13 @@ const startMediaDevice = () => {
             blockUI();
 
 
-            audioBlob = new Blob(audioChunks, { type: 'audio/ogg;' });
+            audioBlob = new Blob(audioChunks, { type: mediaRecorder.mimeType });
 
             let audioUrl = URL.createObjectURL(audioBlob);
             audioRecorded = new Audio(audioUrl);
 
-            let audioBase64 = await convertBlobToBase64(audioBlob);
-
             let minimumAllowedLength = 6;
-            if (audioBase64.length < minimumAllowedLength) {
+            if (audioBlob.size < minimumAllowedLength) {
                 setTimeout(UIRecordingError, 50); // Make sure this function finished after get called again
                 return;
             }
@@ -341,12 +346,27 @@ const startMediaDevice = () => {
                 text = text.replace(/\s\s+/g, ' ');
                 currentText = [text];
 
-                await fetch(apiMainPathSTS + '/GetAccuracyFromRecordedAudio', {
-                    method: "post",
-                    body: JSON.stringify({ "title": currentText[0], "base64Audio": audioBase64, "language": AILanguage }),
-                    headers: { "X-Api-Key": STScoreAPIKey }
-
-                }).then(res => res.json()).
+                let scoreUrl = apiMainPathSTS + '/GetAccuracyFromRecordedAudio';
+                let scoreRequest;
+                if (uploadRawAudio) {
+                    // Send the recording as raw bytes, the text and language go in the query string
+                    scoreUrl += '?' + new URLSearchParams({ "title": currentText[0], "language": AILanguage });
+                    scoreRequest = {
+                        method: "post",
+                        body: audioBlob,
+                        headers: { "X-Api-Key": STScoreAPIKey, "Content-Type": "application/octet-stream" }
+                    };
+                }
+                else {
+                    let audioBase64 = await convertBlobToBase64(audioBlob);
+                    scoreRequest = {
+                        method: "post",
+                        body: JSON.stringify({ "title": currentText[0], "base64Audio": audioBase64, "language": AILanguage }),
+                        headers: { "X-Api-Key": STScoreAPIKey }
+                    };
+                }
+
+                await fetch(scoreUrl, scoreRequest).then(res => res.json()).
                     then(data => {
 
                         if (playAnswerSounds)
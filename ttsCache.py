@@ -0,0 +1,132 @@
+import hashlib
+import io
+import os
+import struct
+import threading
+from collections import OrderedDict
+from typing import Optional
+
+import numpy as np
+import soundfile as sf
+
+import utilsFileIO
+
+# soundfile format and subtype of every supported encoding, with its MIME type
+audio_formats = {
+    'wav': ('WAV', 'PCM_16', 'audio/wav'),
+    'opus': ('OGG', 'OPUS', 'audio/ogg'),
+    'pcm': ('RAW', 'PCM_16', 'audio/L16'),  # Headerless mono 16-bit samples
+}
+
+
+def encodeAudio(audio: np.ndarray, sampling_rate: int, audio_format: str = 'wav') -> bytes:
+    """Encodes audio in memory, without going through a temporary file"""
+    if audio_format not in audio_formats:
+        raise ValueError('Unsupported audio format ' + audio_format)
+    file_format, subtype, _ = audio_formats[audio_format]
+    buffer = io.BytesIO()
+    sf.write(buffer, audio, sampling_rate, format=file_format, subtype=subtype)
+    return buffer.getvalue()
+
+
+def getStreamingWavHeader(sampling_rate: int) -> bytes:
+    """Header of a mono 16-bit WAV whose length is unknown, for streamed PCM"""
+    unknown_size = 0xFFFFFFFF
+    return struct.pack('<4sI4s4sIHHIIHH4sI', b'RIFF', unknown_size, b'WAVE',
+                       b'fmt ', 16, 1, 1, sampling_rate, sampling_rate*2, 2, 16,
+                       b'data', unknown_size)
+
+
+def getCacheKey(language: str, speaker: str, text: str, speed: float) -> str:
+    """Content address of a synthesized utterance"""
+    key_text = '\x1f'.join([language, speaker, text, repr(float(speed))])
+    return hashlib.sha256(key_text.encode('utf-8')).hexdigest()
+
+
+class TTSCache:
+    """Encoded TTS audio by content address, in a memory LRU and on disk.
+
+    The memory tier holds at most max_memory_mb of encoded audio. The disk tier
+    (if cache_folder is set) keeps everything; a disk hit is promoted to
+    memory. Files are written atomically, so several processes can share the
+    folder.
+    """
+
+    def __init__(self, max_memory_mb: float = 64., cache_folder: Optional[str] = None):
+        self.max_memory_bytes = int(max_memory_mb*2**20)
+        self.cache_folder = cache_folder
+        self._entries = OrderedDict()
+        self._memory_bytes = 0
+        self._lock = threading.Lock()
+
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+    def get(self, key: str, audio_format: str = 'wav') -> Optional[bytes]:
+        entry_key = (key, audio_format)
+        with self._lock:
+            if entry_key in self._entries:
+                self._entries.move_to_end(entry_key)
+                self.memory_hits += 1
+                return self._entries[entry_key]
+
+        file_path = self.getFilePath(key, audio_format)
+        if file_path is not None and os.path.exists(file_path):
+            with open(file_path, 'rb') as f:
+                audio_bytes = f.read()
+            self._putInMemory(entry_key, audio_bytes)
+            with self._lock:
+                self.disk_hits += 1
+            return audio_bytes
+
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def put(self, key: str, audio_format: str, audio_bytes: bytes):
+        self._putInMemory((key, audio_format), audio_bytes)
+
+        file_path = self.getFilePath(key, audio_format)
+        if file_path is not None and not os.path.exists(file_path):
+            os.makedirs(os.path.dirname(file_path), exist_ok=True)
+            utilsFileIO.replaceFile(file_path, [audio_bytes])
+
+    def contains(self, key: str, audio_format: str = 'wav') -> bool:
+        with self._lock:
+            if (key, audio_format) in self._entries:
+                return True
+        file_path = self.getFilePath(key, audio_format)
+        return file_path is not None and os.path.exists(file_path)
+
+    def getFilePath(self, key: str, audio_format: str) -> Optional[str]:
+        if self.cache_folder is None:
+            return None
+        return os.path.join(self.cache_folder, key[:2], key + '.' + audio_format)
+
+    def getStats(self) -> dict:
+        with self._lock:
+            return {'memory_entries': len(self._entries),
+                    'memory_mb': self._memory_bytes/2**20,
+                    'memory_hits': self.memory_hits,
+                    'disk_hits': self.disk_hits,
+                    'misses': self.misses}
+
+    def _putInMemory(self, entry_key: tuple, audio_bytes: bytes):
+        if len(audio_bytes) > self.max_memory_bytes:
+            return
+        with self._lock:
+            if entry_key in self._entries:
+                self._memory_bytes -= len(self._entries.pop(entry_key))
+            self._entries[entry_key] = audio_bytes
+            self._memory_bytes += len(audio_bytes)
+            while self._memory_bytes > self.max_memory_bytes:
+                _, evicted_bytes = self._entries.popitem(last=False)
+                self._memory_bytes -= len(evicted_bytes)
+
+
+def getCacheFromEnvironment() -> TTSCache:
+    """Configured by TTS_CACHE_MEMORY_MB and TTS_CACHE_FOLDER (empty: memory only)"""
+    return TTSCache(
+        max_memory_mb=float(os.environ.get('TTS_CACHE_MEMORY_MB', 64)),
+        cache_folder=os.environ.get('TTS_CACHE_FOLDER', './databases/tts_cache/') or None)
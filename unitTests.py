@@ -1,4 +1,5 @@
 import unittest
+import unittest.mock
 
 import ModelInterfaces
 import lambdaGetSample
@@ -6,6 +7,31 @@ import RuleBasedModels
 import epitran
 import json
 import pronunciationTrainer
+import WordMetrics
+import WordMatching
+import random
+import numpy as np
+import os
+import tempfile
+import dataclasses
+import AIModels
+import models
+import audioDecoder
+import soundfile as sf
+import io
+import torch
+import whisper_wrapper
+import inferenceExecutor
+import asyncio
+import time
+import threading
+import pronunciationService
+import modelRegistry
+import ttsCache
+import instrumentation
+import utilsFileIO
+import buildDatabases
+from benchmarks import wordMatchingReference
 
 
 def test_category(category: int, threshold_min: int, threshold_max: int):
@@ -64,6 +90,34 @@ class TestPhonemConverter(unittest.TestCase):
         self.assertTrue(check_phonem_converter(
             phonem_converter, 'Hallo, das ist ein Test', 'haloː, dɑːs ɪst ain tɛst'))
 
+    def test_cached_converter(self):
+        phonem_converter = RuleBasedModels.CachedPhonemConverter(
+            RuleBasedModels.EpitranPhonemConverter(epitran.Epitran('deu-Latn')), max_size=2)
+
+        self.assertTrue(check_phonem_converter(
+            phonem_converter, 'Hallo, das ist ein Test', 'haloː, dɑːs ɪst ain tɛst'))
+        self.assertTrue(check_phonem_converter(
+            phonem_converter, 'ein Test', 'ain tɛst'))
+
+        cache_info = phonem_converter.getCacheInfo()
+        self.assertEqual(cache_info['hits'], 2)
+        self.assertEqual(cache_info['misses'], 5)
+        self.assertEqual(cache_info['size'], 2)
+
+    def test_lexicon_converter(self):
+        with tempfile.TemporaryDirectory() as lexicon_folder:
+            lexicon_path = os.path.join(lexicon_folder, 'ipa_lexicon_de.bin')
+            RuleBasedModels.IpaLexicon.write(
+                lexicon_path, {'Hallo, das ist ein Test': 'precomputed', 'ist': 'ɪst'})
+            phonem_converter = RuleBasedModels.get_phonem_converter(
+                'de', lexicon_path=lexicon_path)
+
+            self.assertTrue(check_phonem_converter(
+                phonem_converter, 'Hallo, das ist ein Test', 'precomputed'))
+            self.assertTrue(check_phonem_converter(
+                phonem_converter, 'das ist ein Test', 'dɑːs ɪst ain tɛst'))
+            del phonem_converter
+
 
 trainer_SST_lambda = {}
 trainer_SST_lambda['de'] = pronunciationTrainer.getTrainer("de")
@@ -95,5 +149,843 @@ class TestScore(unittest.TestCase):
         self.assertTrue(int(pronunciation_accuracy) == 71)
 
 
+class TestEditDistance(unittest.TestCase):
+
+    def test_matches_reference(self):
+        random.seed(0)
+        for _ in range(2000):
+            word_a = ''.join(random.choice('abcd')
+                             for _ in range(random.randint(0, 12)))
+            word_b = ''.join(random.choice('abcd')
+                             for _ in range(random.randint(0, 12)))
+            self.assertEqual(WordMetrics.edit_distance(word_a, word_b),
+                             int(WordMetrics.edit_distance_python(word_a, word_b)))
+
+    def test_early_exit_bound(self):
+        self.assertEqual(WordMetrics.edit_distance('gesund', 'gesund', 0), 0)
+        self.assertEqual(WordMetrics.edit_distance('leben', 'lieben', 2), 1)
+        self.assertEqual(WordMetrics.edit_distance('leben', '', 2), 3)
+        self.assertEqual(WordMetrics.edit_distance('sehr', 'zeh', 1), 2)
+
+    def test_one_vs_many(self):
+        candidates = ['Ich', 'habe', '', 'glück,', 'ich']
+        distances = WordMetrics.one_vs_many('ich', candidates)
+        self.assertEqual(distances.tolist(), [int(WordMetrics.edit_distance_python(
+            'ich', candidate)) for candidate in candidates])
+
+
+class TestWordDistanceMatrix(unittest.TestCase):
+
+    def test_matches_pairwise_distances(self):
+        words_real = 'Ich habe sehr viel glück, am leben und gesund zu sein'.split()
+        words_estimated = 'Ic hab zeh viel guck am und gesund tu sein'.split()
+        word_distance_matrix = WordMatching.get_word_distance_matrix(
+            words_estimated, words_real)
+
+        self.assertEqual(word_distance_matrix.dtype, np.int32)
+        self.assertEqual(word_distance_matrix.shape,
+                         (len(words_estimated)+1, len(words_real)))
+        for idx_estimated, word_estimated in enumerate(words_estimated):
+            for idx_real, word_real in enumerate(words_real):
+                self.assertEqual(word_distance_matrix[idx_estimated, idx_real],
+                                 WordMetrics.edit_distance_python(word_estimated, word_real))
+        self.assertEqual(word_distance_matrix[-1].tolist(),
+                         [len(word) for word in words_real])
+
+    def test_vectorized_matches_rows(self):
+        words_real = 'Ich habe sehr viel glück, am leben und gesund zu sein'.split()*2
+        words_estimated = 'Ic hab zeh viel guck am und gesund tu sein'.split()*2
+        word_distance_matrix = WordMatching.get_word_distance_matrix(
+            words_estimated, words_real)
+
+        self.assertEqual(WordMatching.get_word_distance_matrix_vectorized(words_estimated, words_real)[:-1].tolist(),
+                         [WordMetrics.one_vs_many(word, words_real).tolist() for word in words_estimated])
+        self.assertEqual(word_distance_matrix[:-1].tolist(),
+                         [WordMetrics.one_vs_many(word, words_real).tolist() for word in words_estimated])
+
+
+class TestWordAlignment(unittest.TestCase):
+
+    def test_missing_real_word(self):
+        words_real = 'Ich habe sehr viel glück, am leben und gesund zu sein'.split()
+        words_estimated = 'Ic hab zeh viel guck am und gesund tu sein'.split()
+        mapped_words, mapped_words_indices = WordMatching.get_best_mapped_words(
+            words_estimated, words_real)
+
+        self.assertEqual(mapped_words, ['Ic', 'hab', 'zeh', 'viel', 'guck',
+                                        'am', '-', 'und', 'gesund', 'tu', 'sein'])
+        self.assertEqual(mapped_words_indices, [0, 1, 2, 3, 4, 5, -1, 6, 7, 8, 9])
+
+    def test_extra_estimated_word(self):
+        words_real = 'am leben und gesund'.split()
+        words_estimated = 'am am leben und und gesund'.split()
+        word_distance_matrix = WordMatching.get_word_distance_matrix(
+            words_estimated, words_real)
+        mapped_indices = WordMatching.get_best_path_from_distance_matrix(
+            word_distance_matrix)
+
+        matched_real_indices = [idx for idx in mapped_indices if idx >= 0]
+        self.assertEqual(matched_real_indices, [0, 1, 2, 3])
+
+
+class TestLetterCorrectness(unittest.TestCase):
+
+    def test_letters_of_sentence(self):
+        words_real = ['Ich', 'glück,', 'leben']
+        words_transcribed = ['ic', 'guck', '-']
+
+        letters_correctness = WordMatching.get_letters_correctness(
+            words_real, words_transcribed)
+
+        self.assertEqual(letters_correctness, [
+                         [1, 1, 0], [1, 0, 0, 1, 1, 1], [0, 0, 0, 0, 0]])
+
+    def test_batched_tables_match_per_word_tables(self):
+        words_real = ['ich', 'glück,', 'leben', 'gesund']
+        words_transcribed = ['ic', 'guck', '-', 'gesunde']
+
+        self.assertEqual(WordMatching.get_letter_distance_tables_batched(words_real, words_transcribed),
+                         [WordMatching.get_letter_distance_table(word_real, word_transcribed)
+                          for word_real, word_transcribed in zip(words_real, words_transcribed)])
+
+    def test_shorter_transcription_does_not_fail(self):
+        self.assertEqual(WordMatching.getWhichLettersWereTranscribedCorrectly(
+            'habe', ['h', 'a']), [1, 1, 0, 0])
+
+
+class EchoASRModel(ModelInterfaces.IASRModel):
+    def processAudio(self, audio):
+        self.transcript = ' '.join(['word']*len(audio))
+
+    def getTranscript(self) -> str:
+        return self.transcript
+
+    def getWordLocations(self) -> list:
+        return [{'word': 'word', 'start_ts': 0, 'end_ts': 1}]
+
+
+class TestWordMatchingReference(unittest.TestCase):
+    """Differential tests against the baseline DTW matching, on database
+    sentences with ASR-style transcription errors"""
+
+    def setUp(self):
+        self.sentence_pairs = wordMatchingReference.sampleReferenceCorpus()
+        self.trainer = pronunciationTrainer.PronunciationTrainer(
+            EchoASRModel(), unittest.mock.Mock(convertToPhonem=lambda text: text))
+
+    def test_distances_match_reference(self):
+        for _, real_text, transcript in self.sentence_pairs:
+            words_real, words_estimated = real_text.split(), transcript.split()
+            np.testing.assert_array_equal(
+                WordMatching.get_word_distance_matrix(
+                    words_estimated, words_real),
+                wordMatchingReference.get_word_distance_matrix(words_estimated, words_real))
+            self.assertEqual(WordMetrics.one_vs_many(words_real[0], words_estimated).tolist(), [
+                wordMatchingReference.edit_distance(words_real[0], word) for word in words_estimated])
+
+    def test_same_as_baseline_without_errors(self):
+        for _, real_text, transcript in wordMatchingReference.sampleSentencePairs(100, error_rate=0., seed=2):
+            words_real, words_estimated = real_text.split(), transcript.split()
+            mapped_words, mapped_words_indices = WordMatching.get_best_mapped_words(
+                words_estimated, words_real)
+            self.assertEqual((mapped_words, [int(idx) for idx in mapped_words_indices]),
+                             wordMatchingReference.get_best_mapped_words(words_estimated, words_real))
+
+            # The baseline DTW maps both letters of a double letter to the first
+            # one, marking the last letter of e.g. 'dass' wrong; other words agree
+            letters_correctness = WordMatching.get_letters_correctness(
+                words_real, mapped_words)
+            reference_letters_correctness = wordMatchingReference.get_letters_correctness(
+                words_real, mapped_words)
+            for word_real, is_letter_correct, reference_is_letter_correct in zip(
+                    words_real, letters_correctness, reference_letters_correctness):
+                self.assertEqual(is_letter_correct, [1]*len(word_real))
+                if not any(letter == next_letter for letter, next_letter in zip(word_real, word_real[1:])):
+                    self.assertEqual(is_letter_correct,
+                                     reference_is_letter_correct)
+
+    def test_alignment_is_not_worse_than_baseline(self):
+        # The baseline DTW path can give several estimated words to one real word
+        # and drop the others, the optimal alignment never costs more. The score
+        # ignores punctuation, which the alignment cost doesn't, so it can only
+        # be lower than the baseline when both alignments cost the same
+        accuracy_drift = []
+        for _, real_text, transcript in self.sentence_pairs:
+            words_real, words_estimated = real_text.split(), transcript.split()
+            word_distance_matrix = wordMatchingReference.get_word_distance_matrix(
+                words_estimated, words_real)
+            mapped_indices = WordMatching.get_best_path_from_distance_matrix(
+                word_distance_matrix)
+            reference_mapped_words, reference_mapped_words_indices = wordMatchingReference.get_best_mapped_words(
+                words_estimated, words_real)
+            alignment_cost = wordMatchingReference.get_alignment_cost(
+                word_distance_matrix, mapped_indices)
+            reference_alignment_cost = wordMatchingReference.get_alignment_cost(
+                word_distance_matrix, wordMatchingReference.get_mapped_indices(
+                    reference_mapped_words_indices, len(words_estimated)))
+            self.assertLessEqual(alignment_cost, reference_alignment_cost)
+
+            real_and_transcribed_words, _, _ = self.trainer.matchSampleAndRecordedWords(
+                real_text, transcript)
+            pronunciation_accuracy, _ = self.trainer.getPronunciationAccuracy(
+                real_and_transcribed_words)
+            reference_accuracy, _ = wordMatchingReference.getPronunciationAccuracy(
+                list(zip(words_real, reference_mapped_words)))
+            if alignment_cost < reference_alignment_cost:
+                self.assertGreaterEqual(
+                    pronunciation_accuracy, reference_accuracy)
+            accuracy_drift.append(pronunciation_accuracy-reference_accuracy)
+
+        self.assertGreater(np.mean(accuracy_drift), 0)
+
+    def test_alignment_is_optimal(self):
+        rng = np.random.default_rng(0)
+        word_distance_matrices = [WordMatching.get_word_distance_matrix(transcript.split(), real_text.split())
+                                  for _, real_text, transcript in wordMatchingReference.sampleSentencePairs(
+                                      100, error_rate=0.4, seed=1, max_words=6)]
+        word_distance_matrices += [rng.integers(0, 6, size=(rng.integers(1, 7), rng.integers(1, 6)))
+                                   for _ in range(100)]
+        for word_distance_matrix in word_distance_matrices:
+            for deletion_cost in [0., 1.5]:
+                mapped_indices = WordMatching.get_best_path_from_distance_matrix(
+                    word_distance_matrix, deletion_cost)
+                self.assertAlmostEqual(
+                    wordMatchingReference.get_alignment_cost(
+                        word_distance_matrix, mapped_indices, deletion_cost),
+                    wordMatchingReference.get_best_path_brute_force(word_distance_matrix, deletion_cost))
+
+    def test_mapping_and_accuracy_match_reference(self):
+        # The baseline words and score for every sentence, except those listed
+        # with both values in wordMatchingDifferences.json, where the optimal
+        # alignment keeps other words. Their scores are higher than the baseline
+        # but for two cost ties broken on punctuation ('Tom kann genauso schnell
+        # schwimmen wie du.' scores 77 instead of 83)
+        self.assertEqual(wordMatchingReference.getDifferencesFromReference(
+            self.sentence_pairs, self.trainer.getPronunciationAccuracy),
+            wordMatchingReference.loadExpectedDifferences())
+
+    def test_pronunciation_accuracy_matches_reference(self):
+        for _, real_text, transcript in self.sentence_pairs:
+            real_and_transcribed_words, _, _ = self.trainer.matchSampleAndRecordedWords(
+                real_text, transcript)
+            mapped_words, _ = WordMatching.get_best_mapped_words(
+                transcript.split(), real_text.split())
+            self.assertEqual(real_and_transcribed_words,
+                             list(zip(real_text.split(), mapped_words)))
+
+            # Same pairs, same score: only the mapping differs from the baseline
+            pronunciation_accuracy, words_accuracy = self.trainer.getPronunciationAccuracy(
+                real_and_transcribed_words)
+            reference_accuracy, reference_words_accuracy = wordMatchingReference.getPronunciationAccuracy(
+                real_and_transcribed_words)
+            self.assertEqual(pronunciation_accuracy, reference_accuracy)
+            self.assertEqual(words_accuracy, reference_words_accuracy)
+
+
+class TestASRResult(unittest.TestCase):
+
+    def test_default_transcribe_audio(self):
+        result = EchoASRModel().transcribeAudio([0, 0])
+
+        self.assertEqual(result.transcript, 'word word')
+        self.assertEqual(len(result.word_locations), 1)
+        with self.assertRaises(dataclasses.FrozenInstanceError):
+            result.transcript = ''
+
+    def test_model_pool(self):
+        asr_model = AIModels.ASRModelPool([EchoASRModel(), EchoASRModel()])
+
+        self.assertEqual(asr_model.transcribeAudio([0]).transcript, 'word')
+        self.assertEqual(asr_model.available_replicas.qsize(), 2)
+
+
+class TestAudioDecoder(unittest.TestCase):
+
+    def test_decode_in_memory(self):
+        signal = np.sin(np.arange(16000)/10).astype(np.float32)
+        for file_format, subtype in [('WAV', 'PCM_16'), ('OGG', 'VORBIS')]:
+            file_buffer = io.BytesIO()
+            sf.write(file_buffer, np.stack([signal, signal], axis=1),
+                     16000, format=file_format, subtype=subtype)
+
+            decoded_signal = audioDecoder.decodeAudio(file_buffer.getvalue())
+
+            self.assertEqual(decoded_signal.dtype, np.float32)
+            self.assertEqual(decoded_signal.ndim, 1)
+            self.assertAlmostEqual(len(decoded_signal), len(signal), delta=50)
+
+    def test_empty_audio(self):
+        with self.assertRaises(audioDecoder.AudioDecodingError):
+            audioDecoder.decodeAudio(b'')
+
+    def test_webm_without_ffmpeg(self):
+        # A WebM/Opus recording like the one Chrome's MediaRecorder uploads
+        file_buffer = io.BytesIO()
+        with audioDecoder.av.open(file_buffer, mode='w', format='webm') as container:
+            audio_stream = container.add_stream('libopus', rate=48000, layout='mono')
+            signal = np.sin(np.arange(48000)/10).astype(np.float32)[None, :]
+            frame = audioDecoder.av.AudioFrame.from_ndarray(signal, format='flt', layout='mono')
+            frame.sample_rate = 48000
+            for packet in audio_stream.encode(frame):
+                container.mux(packet)
+            for packet in audio_stream.encode(None):
+                container.mux(packet)
+
+        with unittest.mock.patch.object(audioDecoder.subprocess, 'run') as run_subprocess:
+            decoded_signal = audioDecoder.decodeAudio(file_buffer.getvalue())
+
+        run_subprocess.assert_not_called()
+        self.assertEqual(decoded_signal.dtype, np.float32)
+        self.assertAlmostEqual(len(decoded_signal), 16000, delta=400)
+
+
+class TestZeroCopyAudio(unittest.TestCase):
+
+    def test_decoder_to_trainer_without_copies(self):
+        file_buffer = io.BytesIO()
+        sf.write(file_buffer, np.random.randn(16000).astype(np.float32)*0.1,
+                 16000, format='WAV', subtype='FLOAT')
+        signal = audioDecoder.decodeAudio(file_buffer.getvalue())
+        self.assertTrue(signal.flags['C_CONTIGUOUS'] and signal.flags['WRITEABLE'])
+
+        audio = torch.from_numpy(signal).unsqueeze(0)
+        trainer = pronunciationTrainer.PronunciationTrainer(None, None)
+        processed_audio = trainer.preprocessAudio(audio)
+
+        self.assertTrue(np.shares_memory(processed_audio.numpy(), signal))
+        self.assertAlmostEqual(float(processed_audio.abs().max()), 1., places=5)
+        self.assertAlmostEqual(float(processed_audio.mean()), 0., places=5)
+
+    def test_whisper_input_is_a_view(self):
+        received_audios = []
+        asr_model = whisper_wrapper.WhisperASRModel.__new__(
+            whisper_wrapper.WhisperASRModel)
+        asr_model.backend = whisper_wrapper.WhisperBackend.__new__(
+            whisper_wrapper.WhisperBackend)
+        asr_model.backend.asr = lambda audio, generate_kwargs: received_audios.append(
+            audio) or {'text': '', 'chunks': []}
+        asr_model.language = 'de'
+        asr_model.batch_scheduler = None
+        asr_model.sample_rate = 16000
+
+        signal = np.zeros(16000, dtype=np.float32)
+        asr_model.transcribeAudio(torch.from_numpy(signal).unsqueeze(0))
+
+        self.assertTrue(np.shares_memory(received_audios[0], signal))
+
+
+class FakeBatchPipeline:
+    """Stands in for the HF pipeline: 'transcribes' each audio to its first sample"""
+
+    def __init__(self, error: Exception = None):
+        self.calls = []
+        self.error = error
+        self.release = threading.Event()
+        self.release.set()
+
+    def __call__(self, audios, batch_size, generate_kwargs):
+        self.release.wait()
+        self.calls.append(
+            (generate_kwargs['language'], [float(audio[0]) for audio in audios]))
+        if self.error is not None:
+            raise self.error
+        return [{'text': generate_kwargs['language'] + str(float(audio[0])), 'chunks': []}
+                for audio in audios]
+
+
+class TestWhisperBatchScheduler(unittest.TestCase):
+
+    def test_groups_requests_by_language(self):
+        asr = FakeBatchPipeline()
+        scheduler = whisper_wrapper.WhisperBatchScheduler(
+            asr, max_batch_size=4, max_wait_ms=100)
+        futures = [scheduler.submit(np.full(10, idx, dtype=np.float32), language)
+                   for idx, language in enumerate(['de', 'en', 'de', 'en'])]
+        for future in futures:
+            future.result(timeout=5)
+        scheduler.close()
+
+        self.assertEqual(asr.calls, [('de', [0., 2.]), ('en', [1., 3.])])
+
+    def test_partial_batch_is_flushed_after_max_wait(self):
+        asr = FakeBatchPipeline()
+        scheduler = whisper_wrapper.WhisperBatchScheduler(
+            asr, max_batch_size=8, max_wait_ms=50)
+        start = time.time()
+        futures = [scheduler.submit(np.full(10, idx, dtype=np.float32), 'de')
+                   for idx in range(2)]
+        for future in futures:
+            future.result(timeout=5)
+        elapsed = time.time()-start
+        scheduler.close()
+
+        self.assertGreaterEqual(elapsed, 0.045)
+        self.assertLess(elapsed, 2.)
+        self.assertEqual(asr.calls, [('de', [0., 1.])])
+
+    def test_each_future_gets_its_own_result(self):
+        asr = FakeBatchPipeline()
+        scheduler = whisper_wrapper.WhisperBatchScheduler(
+            asr, max_batch_size=4, max_wait_ms=1000)
+        futures = [scheduler.submit(np.full(10, idx, dtype=np.float32), 'en')
+                   for idx in range(4)]
+        results = [future.result(timeout=5)['text'] for future in futures]
+        scheduler.close()
+
+        self.assertEqual(results, ['en0.0', 'en1.0', 'en2.0', 'en3.0'])
+        self.assertEqual(asr.calls, [('en', [0., 1., 2., 3.])])
+
+    def test_pipeline_error_reaches_every_future(self):
+        error = RuntimeError('out of memory')
+        scheduler = whisper_wrapper.WhisperBatchScheduler(
+            FakeBatchPipeline(error), max_batch_size=3, max_wait_ms=1000)
+        futures = [scheduler.submit(np.zeros(10, dtype=np.float32), 'de')
+                   for _ in range(3)]
+        for future in futures:
+            self.assertIs(future.exception(timeout=5), error)
+        scheduler.close()
+
+    def test_close_drains_pending_requests(self):
+        asr = FakeBatchPipeline()
+        asr.release.clear()
+        scheduler = whisper_wrapper.WhisperBatchScheduler(
+            asr, max_batch_size=1, max_wait_ms=0)
+        futures = [scheduler.submit(np.full(10, idx, dtype=np.float32), 'de')
+                   for idx in range(3)]
+
+        closing = threading.Thread(target=scheduler.close)
+        closing.start()
+        with self.assertRaises(RuntimeError):
+            while True:  # Until close() has marked the scheduler closed
+                scheduler.submit(np.zeros(10, dtype=np.float32), 'de')
+                time.sleep(0.001)
+        asr.release.set()
+        closing.join(timeout=5)
+
+        self.assertFalse(closing.is_alive())
+        self.assertEqual([future.result(timeout=0)['text'] for future in futures],
+                         ['de0.0', 'de1.0', 'de2.0'])
+
+    def test_metrics(self):
+        scheduler = whisper_wrapper.WhisperBatchScheduler(
+            FakeBatchPipeline(), max_batch_size=2, max_wait_ms=30)
+        for future in [scheduler.submit(np.zeros(10, dtype=np.float32), 'de') for _ in range(2)]:
+            future.result(timeout=5)
+        scheduler.submit(np.zeros(10, dtype=np.float32), 'de').result(timeout=5)
+        metrics = scheduler.getMetrics()
+        scheduler.close()
+
+        self.assertEqual(metrics['batches'], 2)
+        self.assertEqual(metrics['requests'], 3)
+        self.assertEqual(metrics['pending'], 0)
+        self.assertEqual(metrics['mean_batch_size'], 1.5)
+        self.assertEqual(metrics['mean_batch_fill'], 0.75)
+        self.assertGreaterEqual(metrics['max_queue_delay_ms'], 25)
+        self.assertLessEqual(metrics['mean_queue_delay_ms'],
+                             metrics['max_queue_delay_ms'])
+
+
+class TestWhisperBackend(unittest.TestCase):
+
+    def test_languages_share_one_pipeline(self):
+        calls = []
+
+        def fake_asr(audio, generate_kwargs):
+            calls.append(generate_kwargs['language'])
+            return {'text': '', 'chunks': []}
+
+        with unittest.mock.patch.object(whisper_wrapper, 'pipeline', return_value=fake_asr) as pipeline:
+            model_de = whisper_wrapper.WhisperASRModel(
+                model_name='test-whisper', language='de')
+            model_en = whisper_wrapper.WhisperASRModel(
+                model_name='test-whisper', language='en')
+
+        self.assertEqual(pipeline.call_count, 1)
+        self.assertIs(model_de.backend, model_en.backend)
+
+        audio = torch.zeros((1, 16000))
+        model_de.transcribeAudio(audio)
+        model_en.transcribeAudio(audio)
+        self.assertEqual(calls, ['de', 'en'])
+
+    def test_shared_pipeline_runs_one_call_at_a_time(self):
+        running_calls = []
+        max_running_calls = []
+
+        def fake_asr(audio, generate_kwargs):
+            running_calls.append(1)
+            max_running_calls.append(len(running_calls))
+            time.sleep(0.01)
+            running_calls.pop()
+            return {'text': '', 'chunks': []}
+
+        with unittest.mock.patch.object(whisper_wrapper, 'pipeline', return_value=fake_asr):
+            asr_models = [whisper_wrapper.WhisperASRModel(model_name='test-whisper-threads', language=language)
+                          for language in ['de', 'en']]
+
+        threads = [threading.Thread(target=asr_model.transcribeAudio, args=(torch.zeros((1, 1600)),))
+                   for asr_model in asr_models*4]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(max_running_calls), 8)
+        self.assertEqual(max(max_running_calls), 1)
+
+    def test_pool_replicas_have_their_own_pipeline(self):
+        with unittest.mock.patch.object(whisper_wrapper, 'pipeline', side_effect=lambda *args, **kwargs: object()):
+            shared_model = whisper_wrapper.WhisperASRModel(
+                model_name='test-whisper', language='de')
+            asr_pool = models.getASRModel('de', replicas=2)
+
+        replicas = list(asr_pool.available_replicas.queue)
+        self.assertEqual(len(replicas), 2)
+        self.assertIsNot(replicas[0].asr, replicas[1].asr)
+        for replica in replicas:
+            self.assertIsNot(replica.asr, shared_model.asr)
+
+
+class TestInferenceExecutor(unittest.TestCase):
+
+    def test_saturation_and_timeout(self):
+        async def run_requests():
+            executor = inferenceExecutor.InferenceExecutor(
+                max_workers=1, max_queue_size=1, timeout=0.5)
+
+            async def request(duration):
+                try:
+                    await executor.run(time.sleep, duration)
+                    return 'ok'
+                except Exception as e:
+                    return type(e).__name__
+            results = await asyncio.gather(request(0.1), request(0.1), request(0.1))
+            results.append(await request(1.))
+            executor.shutdown()
+            return results
+
+        self.assertEqual(asyncio.run(run_requests()), [
+                         'ok', 'ok', 'ExecutorSaturatedError', 'InferenceTimeoutError'])
+
+    def test_stream_keeps_its_worker_until_the_end(self):
+        def slow_items(error=None):
+            for item in [b'a', b'b', b'c']:
+                time.sleep(0.05)
+                yield item
+            if error is not None:
+                raise error
+
+        async def run_streams():
+            executor = inferenceExecutor.InferenceExecutor(
+                max_workers=1, max_queue_size=0, timeout=0.5)
+            stream = executor.stream(slow_items())
+            self.assertEqual(await stream.next(), b'a')
+            # Between items the worker is still reserved for the stream
+            with self.assertRaises(inferenceExecutor.ExecutorSaturatedError):
+                await executor.run(time.sleep, 0)
+            items = [b'a']
+            while (item := await stream.next()) is not None:
+                items.append(item)
+            self.assertEqual(items, [b'a', b'b', b'c'])
+
+            stream = executor.stream(slow_items(ValueError('synthesis failed')))
+            with self.assertRaises(ValueError):
+                while await stream.next() is not None:
+                    pass
+            executor.shutdown()
+
+        asyncio.run(run_streams())
+
+
+class TestPronunciationService(unittest.TestCase):
+
+    def test_empty_text_gives_empty_result(self):
+        result = pronunciationService.scorePronunciation(
+            pronunciationService.ScoreRequest(real_text='', audio=b''))
+        self.assertEqual(result, pronunciationService.ScoreResult())
+        self.assertEqual(result.toDict()['pronunciation_accuracy'], '0')
+        self.assertFalse(hasattr(result, '__dict__'))
+
+    def test_base64_audio_with_data_url_prefix(self):
+        self.assertEqual(pronunciationService.decodeBase64Audio(
+            'data:audio/ogg;base64,aGVsbG8='), b'hello')
+        self.assertEqual(
+            pronunciationService.decodeBase64Audio('aGVsbG8='), b'hello')
+
+    def test_sample_result_wire_format(self):
+        result = pronunciationService.getSample(
+            pronunciationService.SampleRequest(category=1, language='de'))
+        self.assertEqual(result.toDict()['real_transcript'], [
+                         result.real_transcript])
+
+    def test_sample_ipa_is_read_from_the_store(self):
+        with tempfile.TemporaryDirectory() as database_folder, \
+                unittest.mock.patch.object(buildDatabases, 'sample_folder', database_folder + '/'):
+            utilsFileIO.writePackedStrings(buildDatabases.getSentenceStorePath('de'), [
+                'Hallo Welt', 'Das ist ein Satz mit ganz genau zehn Wörtern darin'])
+            utilsFileIO.writePackedStrings(buildDatabases.getSentenceIpaStorePath('de'), [
+                'stored 0', 'stored 1'])
+            dataset = pronunciationService.TextDataset('de')
+            with unittest.mock.patch.dict(pronunciationService.sample_database, {'de': dataset}):
+                pronunciationService.loadSampleDatabases(['de'])
+                self.assertIsNotNone(dataset.index)
+
+                # Nothing is converted or indexed per request
+                with unittest.mock.patch.object(RuleBasedModels, 'get_phonem_converter', side_effect=AssertionError), \
+                        unittest.mock.patch.object(pronunciationService, 'SentenceIndex', side_effect=AssertionError):
+                    result = pronunciationService.getSample(
+                        pronunciationService.SampleRequest(category=2, language='de'))
+            self.assertEqual((result.real_transcript, result.ipa_transcript),
+                             ('Das ist ein Satz mit ganz genau zehn Wörtern darin', 'stored 1'))
+            del dataset
+
+
+class TestModelRegistry(unittest.TestCase):
+
+    def get_registry(self, **limits):
+        loaded = []
+
+        def load_linear(language):
+            loaded.append(language)
+            return torch.nn.Linear(256, 256, bias=False)  # 256 KB of float32
+
+        registry = modelRegistry.ModelRegistry(
+            {'linear': load_linear}, **limits)
+        events = []
+        registry.addListener(events.append)
+        return registry, loaded, events
+
+    def test_loads_once_on_first_request(self):
+        registry, loaded, events = self.get_registry()
+        self.assertFalse(registry.isLoaded('linear', 'de'))
+        model = registry.get('linear', 'de')
+        self.assertIs(registry.get('linear', 'de'), model)
+        self.assertEqual(loaded, ['de'])
+        self.assertEqual([(event.action, event.language)
+                         for event in events], [('load', 'de')])
+        self.assertAlmostEqual(events[0].size_mb, 0.25)
+
+    def test_evicts_least_recently_used(self):
+        registry, loaded, events = self.get_registry(max_resident=2)
+        registry.get('linear', 'de')
+        registry.get('linear', 'en')
+        registry.get('linear', 'de')
+        registry.get('linear', 'fr')
+        self.assertEqual([model['language'] for model in registry.getState()], [
+                         'de', 'fr'])
+        self.assertEqual(events[-1].action, 'evict')
+        self.assertEqual(events[-1].language, 'en')
+
+    def test_memory_budget(self):
+        registry, loaded, events = self.get_registry(memory_budget_mb=0.6)
+        for language in ['de', 'en', 'fr']:
+            registry.get('linear', language)
+        self.assertEqual(len(registry.getState()), 2)
+        registry.get('linear', 'de')
+        self.assertEqual(loaded, ['de', 'en', 'fr', 'de'])
+
+    def test_shared_weights_count_once(self):
+        shared = torch.nn.Linear(256, 256, bias=False)
+        registry = modelRegistry.ModelRegistry(
+            {'shared': lambda language: [shared]}, memory_budget_mb=0.3)
+        registry.get('shared', 'de')
+        registry.get('shared', 'en')
+        self.assertEqual(len(registry.getState()), 2)
+
+
+class CountingTTSModel:
+    def __init__(self):
+        self.sentences = []
+
+    def getAudioFromSentence(self, sentence):
+        self.sentences.append(sentence)
+        return torch.zeros(1600)
+
+
+class TestReplaceFile(unittest.TestCase):
+
+    def test_interleaved_writers_of_one_path(self):
+        first_chunk_written = threading.Event()
+        second_writer_done = threading.Event()
+
+        def slow_chunks():
+            yield b'first '
+            first_chunk_written.set()
+            second_writer_done.wait(5)
+            yield b'writer'
+
+        with tempfile.TemporaryDirectory() as folder:
+            file_path = os.path.join(folder, 'audio.wav')
+            errors = []
+
+            def first_writer():
+                try:
+                    utilsFileIO.replaceFile(file_path, slow_chunks())
+                except Exception as e:
+                    errors.append(e)
+            thread = threading.Thread(target=first_writer)
+            thread.start()
+            first_chunk_written.wait(5)
+            # Same process, same path, while the first file is half written
+            utilsFileIO.replaceFile(file_path, [b'second writer'])
+            with open(file_path, 'rb') as f:
+                self.assertEqual(f.read(), b'second writer')
+            second_writer_done.set()
+            thread.join()
+
+            self.assertEqual(errors, [])
+            with open(file_path, 'rb') as f:
+                self.assertEqual(f.read(), b'first writer')
+            self.assertEqual(os.listdir(folder), ['audio.wav'])
+
+
+class TestTTSCache(unittest.TestCase):
+
+    def test_memory_and_disk_tiers(self):
+        audio_bytes = ttsCache.encodeAudio(
+            np.zeros(1600, dtype=np.float32), 16000, 'wav')
+        key = ttsCache.getCacheKey('de', 'thorsten_v2', 'Hallo', 1.0)
+        self.assertNotEqual(
+            key, ttsCache.getCacheKey('de', 'thorsten_v2', 'Hallo', 1.5))
+
+        with tempfile.TemporaryDirectory() as cache_folder:
+            cache = ttsCache.TTSCache(cache_folder=cache_folder)
+            self.assertIsNone(cache.get(key))
+            cache.put(key, 'wav', audio_bytes)
+            self.assertEqual(cache.get(key), audio_bytes)
+
+            # A new process only has the disk tier
+            cache = ttsCache.TTSCache(cache_folder=cache_folder)
+            self.assertEqual(cache.get(key), audio_bytes)
+            self.assertEqual(cache.get(key), audio_bytes)
+            self.assertEqual(cache.getStats()['disk_hits'], 1)
+            self.assertEqual(cache.getStats()['memory_hits'], 1)
+
+    def test_memory_limit(self):
+        cache = ttsCache.TTSCache(max_memory_mb=1.5/1024)
+        for text in ['a', 'b']:
+            cache.put(ttsCache.getCacheKey('de', '', text, 1.), 'wav', bytes(1024))
+        self.assertEqual(cache.getStats()['memory_entries'], 1)
+        self.assertIsNone(cache.get(ttsCache.getCacheKey('de', '', 'a', 1.)))
+
+    def test_repeated_request_is_not_synthesized_again(self):
+        tts_model = CountingTTSModel()
+        with unittest.mock.patch.object(pronunciationService, 'tts_cache', ttsCache.TTSCache()), \
+                unittest.mock.patch.object(pronunciationService.model_registry, 'get', return_value=tts_model):
+            request = pronunciationService.TTSRequest('Hallo Welt', 'de')
+            first_result = pronunciationService.synthesizeSpeech(request)
+            second_result = pronunciationService.synthesizeSpeech(request)
+
+        self.assertEqual(tts_model.sentences, ['Hallo Welt'])
+        self.assertFalse(first_result.from_cache)
+        self.assertTrue(second_result.from_cache)
+        self.assertEqual(first_result.audio, second_result.audio)
+        self.assertTrue(first_result.toDataUrl().startswith('data:audio/wav;base64,'))
+
+
+class FakeSileroTTS:
+    def apply_tts(self, texts, sample_rate):
+        return [torch.zeros(sample_rate//10) for _ in texts]
+
+
+class TestTTSLanguages(unittest.TestCase):
+
+    def test_english_request_uses_english_model(self):
+        hub_calls = []
+
+        def load(**kwargs):
+            hub_calls.append(kwargs)
+            return FakeSileroTTS(), 'example text'
+
+        with unittest.mock.patch.object(models.torch.hub, 'load', side_effect=load), \
+                unittest.mock.patch.object(pronunciationService, 'tts_cache', ttsCache.TTSCache()), \
+                unittest.mock.patch.object(pronunciationService, 'model_registry',
+                                           modelRegistry.ModelRegistry({'tts': pronunciationService.loadTTS})):
+            result = pronunciationService.synthesizeSpeech(
+                pronunciationService.TTSRequest('Hello world', language='en'))
+
+        self.assertEqual([(call['language'], call['speaker']) for call in hub_calls],
+                         [('en', models.tts_speakers['en'])])
+        self.assertTrue(result.audio.startswith(b'RIFF'))
+
+
+class TestStreamingTTS(unittest.TestCase):
+
+    def test_split_at_sentences_and_clauses(self):
+        segments = pronunciationService.splitIntoSegments(
+            'Hallo. Guten Tag, wie geht es Ihnen heute? Mir geht es gut, danke; und 3,5 Euro!')
+        self.assertEqual(segments, ['Hallo. Guten Tag, wie geht es Ihnen heute?',
+                                    'Mir geht es gut, danke;', 'und 3,5 Euro!'])
+        self.assertEqual(pronunciationService.splitIntoSegments(''), [])
+
+    def test_one_chunk_per_segment(self):
+        tts_model = CountingTTSModel()
+        with unittest.mock.patch.object(pronunciationService, 'tts_cache', ttsCache.TTSCache()), \
+                unittest.mock.patch.object(pronunciationService.model_registry, 'get', return_value=tts_model):
+            chunks = list(pronunciationService.streamSpeech(pronunciationService.TTSRequest(
+                'Guten Tag, wie geht es Ihnen? Mir geht es gut, danke.', 'de')))
+
+        self.assertEqual(len(tts_model.sentences), 2)
+        self.assertEqual(len(chunks), 2)
+        self.assertTrue(chunks[0].startswith(b'RIFF'))
+        self.assertEqual([len(chunk) for chunk in chunks], [44+3200, 3200])
+
+        with self.assertRaises(ValueError):
+            pronunciationService.streamSpeech(
+                pronunciationService.TTSRequest('Hallo', audio_format='opus'))
+
+    def test_rendered_corpus_serves_the_stream_from_cache(self):
+        sentence = 'Guten Tag, wie geht es Ihnen? Mir geht es gut, danke.'
+        tts_model = CountingTTSModel()
+        with tempfile.TemporaryDirectory() as cache_folder, \
+                unittest.mock.patch.object(pronunciationService, 'tts_cache', ttsCache.TTSCache(cache_folder=cache_folder)), \
+                unittest.mock.patch.object(pronunciationService.model_registry, 'get', return_value=tts_model), \
+                unittest.mock.patch.object(buildDatabases, 'readSentences', return_value=[sentence]):
+            buildDatabases.renderTTSCorpus('de', audio_formats=['wav', 'opus'])
+            self.assertEqual(len(tts_model.sentences), 3)
+
+            buildDatabases.renderTTSCorpus('de', audio_formats=['wav', 'opus'])
+            list(pronunciationService.streamSpeech(
+                pronunciationService.TTSRequest(sentence, 'de', audio_format='pcm')))
+            for audio_format in ['wav', 'opus']:
+                self.assertTrue(pronunciationService.synthesizeSpeech(
+                    pronunciationService.TTSRequest(sentence, 'de', audio_format=audio_format)).from_cache)
+        self.assertEqual(len(tts_model.sentences), 3)
+
+
+class TestInstrumentation(unittest.TestCase):
+
+    def test_spans_are_summed_per_request(self):
+        metrics = instrumentation.Metrics()
+        with unittest.mock.patch.object(instrumentation, 'metrics', metrics):
+            for _ in range(3):
+                with instrumentation.trace('de') as stages:
+                    with instrumentation.span('ipa'):
+                        time.sleep(0.001)
+                    with instrumentation.span('ipa'):
+                        time.sleep(0.001)
+                self.assertGreaterEqual(stages['ipa'], 0.002)
+            with instrumentation.span('decode'):
+                pass
+
+        latencies = metrics.getLatencies()
+        self.assertEqual(latencies[('ipa', 'de')]['count'], 3)
+        self.assertGreaterEqual(latencies[('ipa', 'de')]['p50'], 0.002)
+        self.assertEqual(latencies[('decode', '')]['count'], 1)
+
+    def test_prometheus_format(self):
+        metrics = instrumentation.Metrics()
+        metrics.observe('asr', 'en', 0.5)
+        metrics.registerCollector(lambda: [(
+            'queue_depth', 'gauge', 'Waiting requests', [({'model': 'a"b'}, 3)])])
+        lines = metrics.renderPrometheus().splitlines()
+
+        self.assertIn(
+            'pronunciation_stage_seconds{stage="asr",language="en",quantile="0.95"} 0.5', lines)
+        self.assertIn(
+            'pronunciation_stage_seconds_count{stage="asr",language="en"} 1.0', lines)
+        self.assertIn('# TYPE queue_depth gauge', lines)
+        self.assertIn('queue_depth{model="a\\"b"} 3.0', lines)
+
+
 if __name__ == '__main__':
     unittest.main()
@@ -1,9 +1,79 @@
 import string 
 import random 
+import mmap
+import os
+import struct
+import tempfile
+from array import array
 
 
 def generateRandomString(str_length: int = 20):
 
     # printing lowercase
     letters = string.ascii_lowercase
-    return ''.join(random.choice(letters) for i in range(str_length))
\ No newline at end of file
+    return ''.join(random.choice(letters) for i in range(str_length))
+
+
+def replaceFile(file_path: str, data_chunks: list):
+    """Writes data_chunks to a new temporary file next to file_path, then renames
+    it over file_path, so readers never see a partial file. Every call gets its
+    own temporary file, so concurrent writers of the same path don't collide."""
+    file_descriptor, temporary_path = tempfile.mkstemp(
+        dir=os.path.dirname(file_path) or '.', prefix=os.path.basename(file_path) + '.', suffix='.tmp')
+    try:
+        with os.fdopen(file_descriptor, 'wb') as f:
+            for data in data_chunks:
+                f.write(data)
+        # mkstemp creates the file readable by its owner only
+        os.chmod(temporary_path, 0o644)
+        os.replace(temporary_path, file_path)
+    except BaseException:
+        if os.path.exists(temporary_path):
+            os.remove(temporary_path)
+        raise
+
+
+# Packed string table: 16 bytes header (magic, reserved, number of strings),
+# number_of_strings+1 uint64 offsets and one UTF-8 blob with all the strings
+PACKED_STRINGS_MAGIC = b'PKST'
+PACKED_STRINGS_HEADER = struct.Struct('<4sIQ')
+
+
+def writePackedStrings(file_path: str, strings: list):
+    encoded_strings = [text.encode('utf-8') for text in strings]
+    offsets = array('Q', [0]*(len(encoded_strings)+1))
+    for idx, encoded_string in enumerate(encoded_strings):
+        offsets[idx+1] = offsets[idx]+len(encoded_string)
+
+    replaceFile(file_path, [PACKED_STRINGS_HEADER.pack(PACKED_STRINGS_MAGIC, 0, len(encoded_strings)),
+                            offsets.tobytes()] + encoded_strings)
+
+
+class PackedStrings():
+    """Read-only, memory-mapped view of a file written by writePackedStrings"""
+
+    def __init__(self, file_path: str):
+        with open(file_path, 'rb') as f:
+            self._buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, _, number_of_strings = PACKED_STRINGS_HEADER.unpack_from(
+            self._buffer, 0)
+        if magic != PACKED_STRINGS_MAGIC:
+            raise ValueError(file_path + ' is not a packed string file')
+
+        offsets_start = PACKED_STRINGS_HEADER.size
+        self._data_start = offsets_start + 8*(number_of_strings+1)
+        self._offsets = memoryview(self._buffer)[
+            offsets_start:self._data_start].cast('Q')
+        self.number_of_strings = number_of_strings
+
+    def __getitem__(self, idx: int) -> str:
+        if idx < 0:
+            idx += self.number_of_strings
+        if idx < 0 or idx >= self.number_of_strings:
+            raise IndexError('Packed string index out of range')
+        return self._buffer[self._data_start+self._offsets[idx]:
+                            self._data_start+self._offsets[idx+1]].decode('utf-8')
+
+    def __len__(self):
+        return self.number_of_strings
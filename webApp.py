@@ -1,4 +1,4 @@
-from flask import Flask, render_template, request, jsonify
+from flask import Flask, render_template, request, jsonify, Response, stream_with_context
 import webbrowser
 import os
 from flask_cors import CORS
@@ -6,9 +6,8 @@ import json
 import base64
 from typing import Optional
 
-import lambdaTTS
-import lambdaSpeechToScore
-import lambdaGetSample
+import pronunciationService as service
+import instrumentation
 
 app = Flask(__name__)
 cors = CORS(app)
@@ -24,73 +23,44 @@ def main():
 
 @app.route(rootPath+'/getAudioFromText', methods=['POST'])
 def getAudioFromText():
-    event = {'body': json.dumps(request.get_json(force=True))}
-    lambda_output = lambdaTTS.lambda_handler(event, [])
-    
-    # Extract the body from lambda response and return it directly
-    if isinstance(lambda_output, dict) and 'body' in lambda_output:
-        response_body = json.loads(lambda_output['body'])
-        return response_body
-    else:
-        return lambda_output
+    data = request.get_json(force=True)
+    result = service.synthesizeSpeech(service.TTSRequest(text=data['value']))
+    return {'wavBase64': result.toBase64()}
 
 @app.route(rootPath+'/getSample', methods=['POST'])
 def getNext():
-    event = {'body':  json.dumps(request.get_json(force=True))}
-    lambda_output = lambdaGetSample.lambda_handler(event, [])
-    
-    # Extract the body from lambda response and return it directly
-    if isinstance(lambda_output, dict) and 'body' in lambda_output:
-        response_body = json.loads(lambda_output['body'])
-        return response_body
-    else:
-        return lambda_output
+    data = request.get_json(force=True)
+    result = service.getSample(service.SampleRequest(
+        category=int(data['category']), language=data['language']))
+    return result.toDict()
 
 @app.route(rootPath+'/GetAccuracyFromRecordedAudio', methods=['POST'])
 def GetAccuracyFromRecordedAudio():
     print("=== GetAccuracyFromRecordedAudio called ===")
     
     try:
-        request_data = request.get_json(force=True)
-        print(f"Request data keys: {list(request_data.keys()) if request_data else 'None'}")
-        
-        if request_data:
-            print(f"Title: '{request_data.get('title', '')}'")
-            print(f"Language: '{request_data.get('language', '')}'")
-            audio_data = request_data.get('base64Audio', '')
-            print(f"Audio data length: {len(audio_data)}")
-        
-        event = {'body': json.dumps(request_data)}
-        print("Calling lambdaSpeechToScore.lambda_handler...")
-        lambda_output = lambdaSpeechToScore.lambda_handler(event, [])
-        print(f"Lambda output type: {type(lambda_output)}")
-        print(f"Lambda output: {lambda_output}")
-        
-        # Extract the body from lambda response and return it directly
-        if isinstance(lambda_output, dict) and 'body' in lambda_output:
-            response_body = json.loads(lambda_output['body'])
-            print(f"Returning response body: {response_body}")
-            return response_body
-        elif isinstance(lambda_output, str):
-            response_body = json.loads(lambda_output)
-            return response_body
+        # Binary upload: raw audio in the body, text and language in the query string
+        if request.mimetype == 'application/octet-stream' or request.mimetype.startswith('audio/'):
+            score_request = service.ScoreRequest(
+                real_text=request.args.get('title', ''),
+                audio=request.get_data(),
+                language=request.args.get('language', 'de'))
         else:
-            return lambda_output
-        
+            request_data = request.get_json(force=True)
+            score_request = service.ScoreRequest(
+                real_text=request_data.get('title', ''),
+                audio=service.decodeBase64Audio(request_data.get('base64Audio', '')),
+                language=request_data.get('language', 'de'))
+
+        print(f"Title: '{score_request.real_text}', language: '{score_request.language}', "
+              f"audio bytes: {len(score_request.audio)}")
+        return service.scorePronunciation(score_request).toDict()
+
     except Exception as e:
         print('Error: ', str(e))
         import traceback
         traceback.print_exc()
-        return {
-            'pronunciation_accuracy': '0',
-            'ipa_transcript': '',
-            'real_transcripts_ipa': '',
-            'matched_transcripts_ipa': '',
-            'pair_accuracy_category': '',
-            'is_letter_correct_all_words': '',
-            'start_time': '',
-            'end_time': ''
-        }
+        return service.ScoreResult().toDict()
 
     print("=== GetAccuracyFromRecordedAudio completed ===")
 
@@ -99,7 +69,14 @@ def GetAccuracyFromRecordedAudio():
 @app.route('/api/health')
 def health_check():
     """健康检查接口"""
-    return jsonify({"status": "healthy", "message": "AI发音训练器运行正常"})
+    models = [model["kind"] + ":" + model["language"] for model in service.model_registry.getState()]
+    return jsonify({"status": "healthy", "message": "AI发音训练器运行正常", "models": models})
+
+@app.route('/metrics')
+def metrics():
+    """Prometheus格式的指标: 各处理阶段的延迟 (按语言的p50/p95/p99) 和模型加载状态"""
+    return Response(instrumentation.renderPrometheus(),
+                    content_type=instrumentation.prometheus_content_type)
 
 @app.route('/api/info')
 def api_info():
@@ -130,25 +107,12 @@ def api_analyze_pronunciation():
         if not data.get('text') or not data.get('audio_base64'):
             return jsonify({"error": "缺少必需参数: text 或 audio_base64"}), 400
         
-        # 构造请求数据
-        event_data = {
-            'title': data.get('text'),
-            'base64Audio': data.get('audio_base64'),
-            'language': data.get('language', 'de')
-        }
-        
-        event = {'body': json.dumps(event_data)}
-        result = lambdaSpeechToScore.lambda_handler(event, [])
-        
-        # 解析结果
-        if isinstance(result, str):
-            result_data = json.loads(result)
-        elif isinstance(result, dict) and 'body' in result:
-            result_data = json.loads(result['body'])
-        else:
-            result_data = result
-            
-        return jsonify(result_data)
+        result = service.scorePronunciation(service.ScoreRequest(
+            real_text=data.get('text'),
+            audio=service.decodeBase64Audio(data.get('audio_base64')),
+            language=data.get('language', 'de')))
+
+        return jsonify(result.toDict())
         
     except Exception as e:
         return jsonify({"error": f"发音分析失败: {str(e)}"}), 500
@@ -165,32 +129,41 @@ def api_text_to_speech():
         if not data.get('text'):
             return jsonify({"error": "缺少必需参数: text"}), 400
         
-        # 构造请求数据
-        event_data = {
-            'text': data.get('text'),
-            'language': data.get('language', 'de'),
-            'voice_speed': data.get('voice_speed', 1.0)
-        }
-        
-        event = {'body': json.dumps(event_data)}
-        result = lambdaTTS.lambda_handler(event, [])
-        
-        # 解析结果
-        if isinstance(result, str):
-            result_data = json.loads(result)
-        elif isinstance(result, dict) and 'body' in result:
-            result_data = json.loads(result['body'])
-        else:
-            result_data = result
-            
+        result = service.synthesizeSpeech(service.TTSRequest(
+            text=data.get('text'), language=data.get('language', 'de'),
+            speed=float(data.get('voice_speed', 1.0)), audio_format=data.get('audio_format', 'wav')))
+
         return jsonify({
-            "audio_base64": result_data.get('audio_base64', ''),
+            "audio_base64": result.toDataUrl(),
             "message": "语音生成成功"
         })
         
     except Exception as e:
         return jsonify({"error": f"语音生成失败: {str(e)}"}), 500
 
+@app.route('/api/v1/tts/stream', methods=['POST'])
+def api_text_to_speech_stream():
+    """
+    API: 流式文本转语音, 按句子/分句分块返回音频
+    请求格式: {"text": "文本", "language": "de", "voice_speed": 1.0, "stream_format": "wav"}
+    """
+    try:
+        data = request.get_json(force=True)
+
+        if not data.get('text'):
+            return jsonify({"error": "缺少必需参数: text"}), 400
+
+        stream_format = data.get('stream_format', 'wav')
+        chunks = service.streamSpeech(service.TTSRequest(
+            text=data.get('text'), language=data.get('language', 'de'),
+            speed=float(data.get('voice_speed', 1.0)), audio_format=stream_format))
+
+        return Response(stream_with_context(chunks),
+                        mimetype=service.getStreamMimeType(stream_format))
+
+    except Exception as e:
+        return jsonify({"error": f"语音生成失败: {str(e)}"}), 500
+
 @app.route('/api/v1/sample', methods=['POST'])
 def api_get_sample():
     """
@@ -200,24 +173,10 @@ def api_get_sample():
     try:
         data = request.get_json(force=True)
         
-        # 构造请求数据
-        event_data = {
-            'category': data.get('category', '0'),
-            'language': data.get('language', 'de')
-        }
-        
-        event = {'body': json.dumps(event_data)}
-        result = lambdaGetSample.lambda_handler(event, [])
-        
-        # 解析结果
-        if isinstance(result, str):
-            result_data = json.loads(result)
-        elif isinstance(result, dict) and 'body' in result:
-            result_data = json.loads(result['body'])
-        else:
-            result_data = result
-            
-        return jsonify(result_data)
+        result = service.getSample(service.SampleRequest(
+            category=int(data.get('category', '0')), language=data.get('language', 'de')))
+
+        return jsonify(result.toDict())
         
     except Exception as e:
         return jsonify({"error": f"样本生成失败: {str(e)}"}), 500
@@ -266,33 +225,41 @@ def api_analyze_pronunciation_file():
         if audio_file.filename == '':
             return jsonify({"error": "未选择文件"}), 400
         
-        # 读取文件内容并转换为base64
+        # 直接把文件内容交给解码器, 不再转换为base64
         audio_content = audio_file.read()
-        audio_base64 = "data:audio/ogg;base64," + base64.b64encode(audio_content).decode('utf-8')
-        
-        # 调用发音分析
-        event_data = {
-            'title': text,
-            'base64Audio': audio_base64,
-            'language': language
-        }
-        
-        event = {'body': json.dumps(event_data)}
-        result = lambdaSpeechToScore.lambda_handler(event, [])
-        
-        # 解析结果
-        if isinstance(result, str):
-            result_data = json.loads(result)
-        elif isinstance(result, dict) and 'body' in result:
-            result_data = json.loads(result['body'])
-        else:
-            result_data = result
-            
-        return jsonify(result_data)
+        result = service.scorePronunciation(
+            service.ScoreRequest(text, audio_content, language))
+
+        return jsonify(result.toDict())
         
     except Exception as e:
         return jsonify({"error": f"文件处理失败: {str(e)}"}), 500
 
+@app.route('/api/v1/pronunciation/raw', methods=['POST'])
+def api_analyze_pronunciation_raw():
+    """
+    API: 分析发音, 请求体为原始音频字节 (application/octet-stream)
+    查询参数: ?text=文本&language=de
+    """
+    try:
+        text = request.args.get('text')
+        language = request.args.get('language', 'de')
+
+        if not text:
+            return jsonify({"error": "缺少必需参数: text"}), 400
+
+        audio_content = request.get_data()
+        if len(audio_content) == 0:
+            return jsonify({"error": "缺少音频数据"}), 400
+
+        result = service.scorePronunciation(
+            service.ScoreRequest(text, audio_content, language))
+
+        return jsonify(result.toDict())
+
+    except Exception as e:
+        return jsonify({"error": f"发音分析失败: {str(e)}"}), 500
+
 
 if __name__ == "__main__":
     language = 'de'
@@ -300,6 +267,7 @@ if __name__ == "__main__":
     print("Current directory:", os.getcwd())
     print("Server will be available at: http://127.0.0.1:3000/")
     print("Loading models... This may take a few minutes on first run.")
+    service.loadSampleDatabases()
     
     try:
         app.run(host="0.0.0.0", port=3000, debug=True)
@@ -1,32 +1,223 @@
 import torch 
 from transformers import pipeline
-from ModelInterfaces import IASRModel
+from ModelInterfaces import IASRModel, ASRResult
 from typing import Union
+from concurrent.futures import Future
+from collections import deque
+import threading
+import weakref
+import time
 import numpy as np 
 
+
+class WhisperBatchScheduler:
+    """Micro-batches concurrent transcription requests for one Whisper pipeline.
+
+    Audios submitted within max_wait_ms of the first waiting one (and with the same
+    language) are run through the pipeline as one padded batch of at most
+    max_batch_size items. Each caller gets its own pipeline output back through
+    a Future. getMetrics() reports batch fill and queueing delay.
+    """
+
+    def __init__(self, asr_pipeline, max_batch_size: int = 8, max_wait_ms: float = 20.):
+        self.asr = asr_pipeline
+        self.max_batch_size = max_batch_size
+        self.max_wait_ms = max_wait_ms
+        self._pending = deque()
+        self._condition = threading.Condition()
+        self._closed = False
+
+        self._number_of_batches = 0
+        self._number_of_requests = 0
+        self._total_queue_delay = 0.
+        self._max_queue_delay = 0.
+
+        # Started on the first submit, so that a scheduler built before a fork
+        # (see preforkServer.py) gets its thread in the process that uses it
+        self._worker = None
+
+    def submit(self, audio: np.ndarray, language: str) -> Future:
+        future = Future()
+        with self._condition:
+            if self._closed:
+                raise RuntimeError('Batch scheduler is closed')
+            if self._worker is None:
+                self._worker = threading.Thread(
+                    target=self._run, name='whisper-batch-scheduler', daemon=True)
+                self._worker.start()
+            self._pending.append((audio, language, time.time(), future))
+            self._condition.notify()
+        return future
+
+    def transcribe(self, audio: np.ndarray, language: str, timeout: float = None) -> dict:
+        return self.submit(audio, language).result(timeout)
+
+    def close(self):
+        with self._condition:
+            self._closed = True
+            self._condition.notify()
+        if self._worker is not None:
+            self._worker.join()
+
+    def getMetrics(self) -> dict:
+        with self._condition:
+            number_of_batches = max(self._number_of_batches, 1)
+            number_of_requests = max(self._number_of_requests, 1)
+            return {'batches': self._number_of_batches,
+                    'requests': self._number_of_requests,
+                    'pending': len(self._pending),
+                    'mean_batch_size': self._number_of_requests/number_of_batches,
+                    'mean_batch_fill': self._number_of_requests/number_of_batches/self.max_batch_size,
+                    'mean_queue_delay_ms': self._total_queue_delay/number_of_requests*1000,
+                    'max_queue_delay_ms': self._max_queue_delay*1000}
+
+    def _collectBatch(self) -> list:
+        with self._condition:
+            while not self._pending and not self._closed:
+                self._condition.wait()
+            if not self._pending:
+                return []
+
+            language = self._pending[0][1]
+            deadline = self._pending[0][2] + self.max_wait_ms/1000
+            while True:
+                number_of_candidates = sum(
+                    1 for request in self._pending if request[1] == language)
+                remaining_wait = deadline - time.time()
+                if number_of_candidates >= self.max_batch_size or remaining_wait <= 0 or self._closed:
+                    break
+                self._condition.wait(remaining_wait)
+
+            batch = []
+            other_languages = deque()
+            while self._pending and len(batch) < self.max_batch_size:
+                request = self._pending.popleft()
+                if request[1] == language:
+                    batch.append(request)
+                else:
+                    other_languages.append(request)
+            other_languages.extend(self._pending)
+            self._pending = other_languages
+
+            batch_start = time.time()
+            self._number_of_batches += 1
+            self._number_of_requests += len(batch)
+            for request in batch:
+                queue_delay = batch_start - request[2]
+                self._total_queue_delay += queue_delay
+                self._max_queue_delay = max(
+                    self._max_queue_delay, queue_delay)
+            return batch
+
+    def _run(self):
+        while True:
+            batch = self._collectBatch()
+            if not batch:
+                return
+            audios = [request[0] for request in batch]
+            try:
+                results = self.asr(audios, batch_size=len(audios),
+                                   generate_kwargs={"language": batch[0][1]})
+            except Exception as e:
+                for request in batch:
+                    request[3].set_exception(e)
+                continue
+            for request, result in zip(batch, results):
+                request[3].set_result(result)
+
+
+class WhisperBackend:
+    """One Whisper pipeline (weights and feature extractor) shared by every language.
+
+    The language is passed per call. With batching, one WhisperBatchScheduler
+    serves all languages; it only batches requests of the same language.
+    HF pipelines are not thread-safe, so calls from the inference threads and
+    from the batch scheduler run one at a time.
+    """
+
+    def __init__(self, model_name="openai/whisper-base"):
+        self.model_name = model_name
+        self.asr = pipeline("automatic-speech-recognition",
+                            model=model_name,
+                            return_timestamps="word")
+        self.batch_scheduler = None
+        self._lock = threading.Lock()
+        self._pipeline_lock = threading.Lock()
+
+    def getBatchScheduler(self, max_batch_size=8, max_wait_ms=20.) -> WhisperBatchScheduler:
+        with self._lock:
+            if self.batch_scheduler is None:
+                self.batch_scheduler = WhisperBatchScheduler(
+                    self.runPipeline, max_batch_size, max_wait_ms)
+            return self.batch_scheduler
+
+    def runPipeline(self, *args, **kwargs):
+        with self._pipeline_lock:
+            return self.asr(*args, **kwargs)
+
+    def transcribe(self, audio: np.ndarray, language: str, batching=False) -> dict:
+        if batching:
+            return self.getBatchScheduler().transcribe(audio, language)
+        return self.runPipeline(audio, generate_kwargs={"language": language})
+
+
+# Backends alive while some WhisperASRModel uses them, by model name
+whisper_backends = weakref.WeakValueDictionary()
+whisper_backends_lock = threading.Lock()
+
+
+def getWhisperBackend(model_name="openai/whisper-base") -> WhisperBackend:
+    with whisper_backends_lock:
+        backend = whisper_backends.get(model_name)
+        if backend is None:
+            backend = WhisperBackend(model_name)
+            whisper_backends[model_name] = backend
+        return backend
+
+
 class WhisperASRModel(IASRModel):
-    def __init__(self, model_name="openai/whisper-base", language="en"):
+    def __init__(self, model_name="openai/whisper-base", language="en", batching=False, max_batch_size=8, max_wait_ms=20.,
+                 shared_pipeline=True):
         # 设置语言参数，避免语言识别错误
         self.language = language
-        self.asr = pipeline("automatic-speech-recognition", 
-                           model=model_name, 
-                           return_timestamps="word")
+        # The pipeline is shared with the models of the other languages, unless
+        # this model must be usable concurrently with them (e.g. pool replicas)
+        self.backend = getWhisperBackend(
+            model_name) if shared_pipeline else WhisperBackend(model_name)
+        self.asr = self.backend.asr
         self._transcript = ""
         self._word_locations = []
         self.sample_rate = 16000
+        # Optional micro-batching of concurrent requests
+        self.batch_scheduler = self.backend.getBatchScheduler(
+            max_batch_size, max_wait_ms) if batching else None
 
     def processAudio(self, audio:Union[np.ndarray, torch.Tensor]):
+        result = self.transcribeAudio(audio)
+        self._transcript = result.transcript
+        self._word_locations = list(result.word_locations)
+
+    def transcribeAudio(self, audio:Union[np.ndarray, torch.Tensor]) -> ASRResult:
         # 'audio' can be a path to a file or a numpy array of audio samples.
+        # A CPU tensor is only viewed as numpy, not copied
         if isinstance(audio, torch.Tensor):
             audio = audio.detach().cpu().numpy()
         
         # 强制指定语言，避免自动检测错误
-        result = self.asr(audio[0], generate_kwargs={"language": self.language})
-        self._transcript = result["text"]
-        self._word_locations = [{"word": word_info["text"], 
+        if self.batch_scheduler is not None:
+            result = self.batch_scheduler.transcribe(audio[0], self.language)
+        else:
+            result = self.backend.transcribe(audio[0], self.language)
+        transcript, word_locations = self.parseResult(result)
+        return ASRResult(transcript, tuple(word_locations))
+
+    def parseResult(self, result: dict):
+        transcript = result["text"]
+        word_locations = [{"word": word_info["text"], 
                      "start_ts": word_info["timestamp"][0] * self.sample_rate if word_info["timestamp"][0] is not None else None,
                      "end_ts": (word_info["timestamp"][1] * self.sample_rate if word_info["timestamp"][1] is not None else (word_info["timestamp"][0] + 1) * self.sample_rate),
                      "tag": "processed"} for word_info in result["chunks"]]
+        return transcript, word_locations
 
     def getTranscript(self) -> str:
         return self._transcript